@@ -40,6 +40,13 @@ args_parser.parser.add_argument("--always-download-new-model", action='store_tru
 args_parser.parser.add_argument("--rebuild-hash-cache", help="Generates missing model and LoRA hashes.",
                                 type=int, nargs="?", metavar="CPU_NUM_THREADS", const=-1)
 
+args_parser.parser.add_argument("--stream-api-port", type=int, default=None,
+                                help="Serve task progress, previews and results as server-sent events on this port.")
+
+args_parser.parser.add_argument("--stream-api-listen", type=str, default="127.0.0.1", metavar="IP", nargs="?",
+                                const="0.0.0.0", help="Address the stream API binds to, it requires the Fooocus "
+                                                      "credentials whenever authentication is configured.")
+
 args_parser.parser.set_defaults(
     disable_cuda_malloc=True,
     in_browser=True,
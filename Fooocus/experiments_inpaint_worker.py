@@ -0,0 +1,44 @@
+import sys
+import time
+
+sys.argv = [sys.argv[0], '--always-cpu'] + sys.argv[1:]
+
+import args_manager  # noqa: F401, parses --always-cpu before modules.config is imported
+import numpy as np
+
+import modules.inpaint_worker as inpaint_worker
+from tests.test_inpaint_worker import make_case, reference_fooocus_fill, reference_morphological_open, \
+    reference_solve_abcd
+
+
+def benchmark(fn, *args, repeats=3):
+    result = fn(*args)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(*args)
+    return result, (time.perf_counter() - start) / repeats
+
+
+for H, W in [(1024, 1024), (832, 1216), (1344, 768)]:
+    image, mask = make_case(H, W, 0)
+    print(f'{W}x{H}')
+
+    # a small region of a 4x larger image, where the box grows the most
+    large_mask = np.zeros((H * 4, W * 4), dtype=np.uint8)
+    large_mask[H * 2:H * 2 + 16, W * 2:W * 2 + 16] = 255
+    abcd = inpaint_worker.compute_initial_abcd(large_mask > 0)
+    reference, before = benchmark(reference_solve_abcd, large_mask, *abcd, 0.618)
+    result, after = benchmark(inpaint_worker.solve_abcd, large_mask, *abcd, 0.618)
+    assert result == reference
+    print(f'  solve_abcd:         {before * 1000:8.2f}ms -> {after * 1000:6.2f}ms, identical')
+
+    reference, before = benchmark(reference_morphological_open, mask)
+    result, after = benchmark(inpaint_worker.morphological_open, mask)
+    assert np.array_equal(result, reference)
+    print(f'  morphological_open: {before * 1000:8.2f}ms -> {after * 1000:6.2f}ms, identical')
+
+    reference, before = benchmark(reference_fooocus_fill, image, mask, repeats=1)
+    result, after = benchmark(inpaint_worker.fooocus_fill, image, mask)
+    difference = np.abs(result.astype(np.int32) - reference.astype(np.int32))
+    print(f'  fooocus_fill:       {before * 1000:8.2f}ms -> {after * 1000:6.2f}ms, '
+          f'max difference {difference.max()}, mean {difference.mean():.3f}')
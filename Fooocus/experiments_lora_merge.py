@@ -0,0 +1,63 @@
+import sys
+import time
+
+sys.argv = [sys.argv[0], '--always-cpu'] + sys.argv[1:]
+
+import args_manager  # noqa: F401, parses --always-cpu before ldm_patched is imported
+import torch
+import ldm_patched.modules.utils
+
+from types import SimpleNamespace
+from modules.patch import calculate_weight_merge
+from modules.lora_merge import LoraMergePlan
+
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+
+def kohya_patches(lora):
+    patches = {}
+    for name in lora.keys():
+        if name.endswith('.lora_up.weight'):
+            prefix = name[:-len('.lora_up.weight')]
+            alpha = lora.get(f'{prefix}.alpha', None)
+            alpha = alpha.item() if alpha is not None else None
+            patches[prefix] = ('lora', (lora[name], lora[f'{prefix}.lora_down.weight'], alpha, None))
+    return patches
+
+
+def sdxl_like_patches(rank=32):
+    # attention and feed forward projections of the SDXL unet, with their counts
+    shapes = [(640, 640, 4 * 2 * 10), (1280, 1280, 4 * 10 * 10), (640, 2048, 2 * 2 * 10), (1280, 2048, 2 * 10 * 10),
+              (5120, 640, 2 * 10), (640, 2560, 2 * 10), (10240, 1280, 10 * 10), (1280, 5120, 10 * 10)]
+    patches = {}
+    for out_features, in_features, count in shapes:
+        for i in range(count):
+            up = torch.randn(out_features, rank, dtype=torch.float16)
+            down = torch.randn(rank, in_features, dtype=torch.float16)
+            patches[f'{out_features}_{in_features}_{i}'] = ('lora', (up, down, float(rank), None))
+    return patches
+
+
+def merge(patches, plan):
+    patcher = SimpleNamespace(lora_merge_plan=plan)
+    started = time.perf_counter()
+    for key, v in patches.items():
+        up, down = v[1][0], v[1][1]
+        weight = torch.zeros(up.shape[0], *down.shape[1:], dtype=torch.float32, device=device)
+        calculate_weight_merge(patcher, [(1.0, v, 1.0)], weight, key)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.perf_counter() - started
+
+
+if len(sys.argv) > 2:
+    patches = kohya_patches(ldm_patched.modules.utils.load_torch_file(sys.argv[2], safe_load=True))
+else:
+    patches = sdxl_like_patches()
+
+print(f'{len(patches)} LoRA keys on {device}')
+merge(patches, None)
+print(f'per key: {merge(patches, None):.3f}s')
+plan = LoraMergePlan([[(1.0, v, 1.0)] for v in patches.values()])
+print(f'batched: {merge(patches, plan):.3f}s ({plan.batched} keys batched)')
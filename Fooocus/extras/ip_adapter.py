@@ -1,3 +1,5 @@
+import os
+
 import torch
 import ldm_patched.modules.clip_vision
 import safetensors.torch as sf
@@ -8,6 +10,7 @@ from extras.resampler import Resampler
 from ldm_patched.modules.model_patcher import ModelPatcher
 from modules.core import numpy_to_pytorch
 from modules.ops import use_patched_ops
+from modules.patch import patch_settings
 from ldm_patched.modules.ops import manual_cast
 
 
@@ -204,52 +207,70 @@ def preprocess(img, ip_adapter_path):
 def patch_model(model, tasks):
     new_model = model.clone()
 
-    def make_attn_patcher(ip_index):
-        def patcher(n, context_attn2, value_attn2, extra_options):
-            org_dtype = n.dtype
-            current_step = float(model.model.diffusion_model.current_step.detach().cpu().numpy()[0])
-            cond_or_uncond = extra_options['cond_or_uncond']
+    # weighted k / v blocks per (ip_index, cond_or_uncond layout, active tasks), built on the first attention call
+    # of a layer and reused by every later step
+    ip_blocks = {}
 
-            q = n
-            k = [context_attn2]
-            v = [value_attn2]
-            b, _, _ = q.shape
+    def make_ip_blocks(ip_index, cond_or_uncond, active, q):
+        ip_k_all = []
+        ip_v_all = []
 
-            for (cs, ucs), cn_stop, cn_weight in tasks:
-                if current_step < cn_stop:
-                    ip_k_c = cs[ip_index * 2].to(q)
-                    ip_v_c = cs[ip_index * 2 + 1].to(q)
-                    ip_k_uc = ucs[ip_index * 2].to(q)
-                    ip_v_uc = ucs[ip_index * 2 + 1].to(q)
+        for ((cs, ucs), cn_stop, cn_weight), is_active in zip(tasks, active):
+            if not is_active:
+                continue
 
-                    ip_k = torch.cat([(ip_k_c, ip_k_uc)[i] for i in cond_or_uncond], dim=0)
-                    ip_v = torch.cat([(ip_v_c, ip_v_uc)[i] for i in cond_or_uncond], dim=0)
+            ip_k = []
+            ip_v = []
+            for ip_k_x, ip_v_x in [(cs[ip_index * 2], cs[ip_index * 2 + 1]), (ucs[ip_index * 2], ucs[ip_index * 2 + 1])]:
+                ip_k_x = ip_k_x.to(q)
+                ip_v_x = ip_v_x.to(q)
 
-                    # Midjourney's attention formulation of image prompt (non-official reimplementation)
-                    # Written by Lvmin Zhang at Stanford University, 2023 Dec
-                    # For non-commercial use only - if you use this in commercial project then
-                    # probably it has some intellectual property issues.
-                    # Contact lvminzhang@acm.org if you are not sure.
+                # Midjourney's attention formulation of image prompt (non-official reimplementation)
+                # Written by Lvmin Zhang at Stanford University, 2023 Dec
+                # For non-commercial use only - if you use this in commercial project then
+                # probably it has some intellectual property issues.
+                # Contact lvminzhang@acm.org if you are not sure.
 
-                    # Below is the sensitive part with potential intellectual property issues.
+                # Below is the sensitive part with potential intellectual property issues.
 
-                    ip_v_mean = torch.mean(ip_v, dim=1, keepdim=True)
-                    ip_v_offset = ip_v - ip_v_mean
+                ip_v_mean = torch.mean(ip_v_x, dim=1, keepdim=True)
+                ip_v_offset = ip_v_x - ip_v_mean
 
-                    B, F, C = ip_k.shape
-                    channel_penalty = float(C) / 1280.0
-                    weight = cn_weight * channel_penalty
+                B, F, C = ip_k_x.shape
+                channel_penalty = float(C) / 1280.0
+                weight = cn_weight * channel_penalty
 
-                    ip_k = ip_k * weight
-                    ip_v = ip_v_offset + ip_v_mean * weight
+                ip_k.append(ip_k_x * weight)
+                ip_v.append(ip_v_offset + ip_v_mean * weight)
 
-                    k.append(ip_k)
-                    v.append(ip_v)
+            # the mean is taken per batch row, so weighting cond and uncond before stacking them is the same
+            ip_k_all.append(torch.cat([ip_k[i] for i in cond_or_uncond], dim=0))
+            ip_v_all.append(torch.cat([ip_v[i] for i in cond_or_uncond], dim=0))
 
-            k = torch.cat(k, dim=1)
-            v = torch.cat(v, dim=1)
-            out = sdp(q, k, v, extra_options)
+        if len(ip_k_all) == 0:
+            return None
+        return torch.cat(ip_k_all, dim=1), torch.cat(ip_v_all, dim=1)
 
+    def make_attn_patcher(ip_index):
+        def patcher(n, context_attn2, value_attn2, extra_options):
+            org_dtype = n.dtype
+            # set once per unet forward on the host, reading the step from the unet here would sync every layer
+            current_step = patch_settings[os.getpid()].global_diffusion_progress
+            cond_or_uncond = extra_options['cond_or_uncond']
+
+            q = n
+            active = tuple(current_step < cn_stop for _, cn_stop, _ in tasks)
+            key = (ip_index, tuple(cond_or_uncond), active, q.dtype, q.device)
+            if key not in ip_blocks:
+                ip_blocks[key] = make_ip_blocks(ip_index, cond_or_uncond, active, q)
+            blocks = ip_blocks[key]
+
+            if blocks is None:
+                k, v = context_attn2, value_attn2
+            else:
+                k = torch.cat([context_attn2, blocks[0]], dim=1)
+                v = torch.cat([value_attn2, blocks[1]], dim=1)
+            out = sdp(q, k, v, extra_options)
 
             return out.to(dtype=org_dtype)
         return patcher
@@ -344,15 +344,22 @@ class LoadedModel:
 def minimum_inference_memory():
     return (1024 * 1024 * 1024)
 
-def unload_model_clones(model):
+def unload_model_clones(model, inherit_weights=False):
     to_unload = []
     for i in range(len(current_loaded_models)):
         if model.is_clone(current_loaded_models[i].model):
             to_unload = [i] + to_unload
 
     for i in to_unload:
+        loaded_model = current_loaded_models.pop(i)
+        if inherit_weights and not loaded_model.model_accelerated and loaded_model.device == model.load_device:
+            # keep the patched weights where they are, only keys with different patches get recomputed
+            print("reuse clone", i)
+            model.inherit_weight_patches(loaded_model.model)
+            inherit_weights = False
+            continue
         print("unload clone", i)
-        current_loaded_models.pop(i).model_unload()
+        loaded_model.model_unload()
 
 def free_memory(memory_required, device, keep_loaded=[]):
     unloaded_model = False
@@ -407,7 +414,7 @@ def load_models_gpu(models, memory_required=0):
 
     total_memory_required = {}
     for loaded_model in models_to_load:
-        unload_model_clones(loaded_model.model)
+        unload_model_clones(loaded_model.model, inherit_weights=hasattr(loaded_model.model, "inherit_weight_patches"))
         total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
 
     for device in total_memory_required:
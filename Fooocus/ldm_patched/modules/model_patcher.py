@@ -11,6 +11,7 @@ class ModelPatcher:
         self.model = model
         self.patches = {}
         self.backup = {}
+        self.applied_patches = {}
         self.object_patches = {}
         self.object_patches_backup = {}
         self.model_options = {"transformer_options":{}}
@@ -23,6 +24,7 @@ class ModelPatcher:
             self.current_device = current_device
 
         self.weight_inplace_update = weight_inplace_update
+        self.weight_cache_key = None
 
     def model_size(self):
         if self.size > 0:
@@ -41,6 +43,7 @@ class ModelPatcher:
         n.object_patches = self.object_patches.copy()
         n.model_options = copy.deepcopy(self.model_options)
         n.model_keys = self.model_keys
+        n.weight_cache_key = self.weight_cache_key
         return n
 
     def is_clone(self, other):
@@ -149,6 +152,9 @@ class ModelPatcher:
                 current_patches.append((strength_patch, patches[k], strength_model))
                 self.patches[k] = current_patches
 
+        if len(p) > 0:
+            # whoever adds patches has to name the new set of merged weights again
+            self.weight_cache_key = None
         return list(p)
 
     def get_key_patches(self, filter_prefix=None):
@@ -183,17 +189,27 @@ class ModelPatcher:
 
         if patch_weights:
             model_sd = self.model_state_dict()
+            for key in list(self.applied_patches.keys()):
+                if key not in self.patches:
+                    # only patched by the clone these weights were inherited from
+                    self.restore_weight(key)
+
             for key in self.patches:
                 if key not in model_sd:
                     print("could not patch. key doesn't exist in model:", key)
                     continue
 
+                if self.same_patches(self.applied_patches.get(key, None), self.patches[key]):
+                    continue
+
                 weight = model_sd[key]
 
                 inplace_update = self.weight_inplace_update
 
                 if key not in self.backup:
                     self.backup[key] = weight.to(device=self.offload_device, copy=inplace_update)
+                else:
+                    weight = self.backup[key]
 
                 if device_to is not None:
                     temp_weight = ldm_patched.modules.model_management.cast_to_device(weight, device_to, torch.float32, copy=True)
@@ -204,6 +220,7 @@ class ModelPatcher:
                     ldm_patched.modules.utils.copy_to_param(self.model, key, out_weight)
                 else:
                     ldm_patched.modules.utils.set_attr(self.model, key, out_weight)
+                self.applied_patches[key] = self.patches[key][:]
                 del temp_weight
 
             if device_to is not None:
@@ -334,6 +351,32 @@ class ModelPatcher:
 
         return weight
 
+    @staticmethod
+    def same_patches(a, b):
+        if a is None or len(a) != len(b):
+            return False
+        return all(x[0] == y[0] and x[1] is y[1] and x[2] == y[2] for x, y in zip(a, b))
+
+    def restore_weight(self, key):
+        if self.weight_inplace_update:
+            ldm_patched.modules.utils.copy_to_param(self.model, key, self.backup[key])
+        else:
+            ldm_patched.modules.utils.set_attr(self.model, key, self.backup[key])
+        del self.backup[key]
+        self.applied_patches.pop(key, None)
+
+    def inherit_weight_patches(self, other):
+        """Take over the patched weights of a loaded clone, patch_model then only repatches keys whose patches differ."""
+        for k in list(other.object_patches_backup.keys()):
+            setattr(self.model, k, other.object_patches_backup[k])
+        other.object_patches_backup = {}
+
+        self.backup = other.backup
+        self.applied_patches = other.applied_patches
+        self.current_device = other.current_device
+        other.backup = {}
+        other.applied_patches = {}
+
     def unpatch_model(self, device_to=None):
         keys = list(self.backup.keys())
 
@@ -345,6 +388,7 @@ class ModelPatcher:
                 ldm_patched.modules.utils.set_attr(self.model, k, self.backup[k])
 
         self.backup = {}
+        self.applied_patches = {}
 
         if device_to is not None:
             self.model.to(device_to)
@@ -19,10 +19,49 @@ from . import sdxl_clip
 import ldm_patched.modules.model_patcher
 import ldm_patched.modules.lora
 import ldm_patched.t2ia.adapter
+import ldm_patched.modules.supported_models
 import ldm_patched.modules.supported_models_base
 import ldm_patched.taesd.taesd
 
+def set_module_tensor(model, name, value, buffer=False):
+    if not buffer:
+        ldm_patched.modules.utils.set_attr(model, name, value)
+        return
+    module_name, _, attr = name.rpartition(".")
+    module = model.get_submodule(module_name) if module_name != "" else model
+    module.register_buffer(attr, value)
+
+def load_model_weights_streaming(model, sd, prefix="", device=None):
+    """Moves weights from a SafetensorsStateDict into model one tensor at a time. Parameters and buffers on the meta
+    device are replaced by the loaded tensor converted to their dtype on device, others are copied into. Tensors
+    still on the meta device have no initialized value to fall back to, a missing one raises."""
+    missing = []
+    buffers = set(name for name, _ in model.named_buffers())
+    for name, current in list(model.state_dict(keep_vars=True).items()):
+        key = prefix + name
+        if key not in sd:
+            missing.append(name)
+            continue
+
+        tensor = sd.pop(key)
+        if current.is_meta:
+            set_module_tensor(model, name, tensor.to(device=device, dtype=current.dtype), buffer=name in buffers)
+        else:
+            current.data.copy_(tensor)
+        del tensor
+
+    uninitialized = [name for name, current in model.state_dict(keep_vars=True).items() if current.is_meta]
+    if len(uninitialized) > 0:
+        raise RuntimeError("ERROR: Missing weights for {}".format(uninitialized))
+    return missing
+
 def load_model_weights(model, sd):
+    if isinstance(sd, ldm_patched.modules.utils.SafetensorsStateDict):
+        m = load_model_weights_streaming(model, sd)
+        if len(m) > 0:
+            print("extra", m)
+        return model
+
     m, u = model.load_state_dict(sd, strict=False)
     m = set(m)
     unexpected_keys = set(u)
@@ -427,8 +466,12 @@ def load_checkpoint(config_path=None, ckpt_path=None, output_vae=True, output_cl
 
     return (ldm_patched.modules.model_patcher.ModelPatcher(model, load_device=model_management.get_torch_device(), offload_device=offload_device), clip, vae)
 
-def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, vae_filename_param=None):
-    sd = ldm_patched.modules.utils.load_torch_file(ckpt_path)
+# models whose only parameters outside the unet do not depend on the device passed to get_model
+STREAMING_MODEL_CONFIGS = (ldm_patched.modules.supported_models.SD15, ldm_patched.modules.supported_models.SDXL,
+                           ldm_patched.modules.supported_models.SDXLRefiner)
+
+def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, vae_filename_param=None, initial_device=None):
+    sd = ldm_patched.modules.utils.load_torch_file(ckpt_path, lazy=True)
     sd_keys = sd.keys()
     clip = None
     clipvision = None
@@ -457,10 +500,28 @@ def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, o
             clipvision = clip_vision.load_clipvision_from_sd(sd, model_config.clip_vision_prefix, True)
 
     if output_model:
-        inital_load_device = model_management.unet_inital_load_device(parameters, unet_dtype)
+        inital_load_device = initial_device if initial_device is not None else model_management.unet_inital_load_device(parameters, unet_dtype)
         offload_device = model_management.unet_offload_device()
-        model = model_config.get_model(sd, "model.diffusion_model.", device=inital_load_device)
-        model.load_model_weights(sd, "model.diffusion_model.")
+        model = None
+        if isinstance(sd, ldm_patched.modules.utils.SafetensorsStateDict) and isinstance(model_config, STREAMING_MODEL_CONFIGS):
+            # only the unet is created on the meta device, its weights are then read from the file key by key
+            model = model_config.get_model(sd, "model.diffusion_model.", device=torch.device("meta"))
+            m = [k for k in model.diffusion_model.state_dict().keys() if "model.diffusion_model." + k not in sd]
+            if len(m) > 0:
+                # missing weights keep the values the model is initialized with, that needs a real allocation
+                print("unet missing:", m)
+                model = None
+
+        if model is not None:
+            load_model_weights_streaming(model.diffusion_model, sd, "model.diffusion_model.", device=inital_load_device)
+            u = [k for k in sd.keys() if k.startswith("model.diffusion_model.")]
+            if len(u) > 0:
+                print("unet unexpected:", u)
+                for k in u:
+                    del sd[k]
+        else:
+            model = model_config.get_model(sd, "model.diffusion_model.", device=inital_load_device)
+            model.load_model_weights(sd, "model.diffusion_model.")
 
     if output_vae:
         if vae_filename_param is None:
@@ -493,6 +554,47 @@ def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, o
     return model_patcher, clip, vae, vae_filename, clipvision
 
 
+def load_converted_checkpoint(model_config_name, unet_config, model_type, unet_sd, clip_sd=None, vae_sd=None, embedding_directory=None, initial_device=None):
+    """Loads a checkpoint from state dicts already converted by load_checkpoint_guess_config: unet keys without
+    the diffusion_model prefix, clip keys of cond_stage_model and vae keys of first_stage_model."""
+    parameters = ldm_patched.modules.utils.calculate_parameters(unet_sd)
+    unet_dtype = model_management.unet_dtype(model_params=parameters)
+    load_device = model_management.get_torch_device()
+    manual_cast_dtype = model_management.unet_manual_cast(unet_dtype, load_device)
+
+    model_config_class = getattr(ldm_patched.modules.supported_models, model_config_name)
+    if not issubclass(model_config_class, STREAMING_MODEL_CONFIGS):
+        raise RuntimeError("ERROR: Can not load converted {} checkpoints".format(model_config_name))
+    model_config = model_config_class(dict(unet_config, dtype=unet_dtype))
+    model_config.set_manual_cast(manual_cast_dtype)
+
+    # the model type of these configs only depends on the presence of a v_pred key
+    type_sd = {"v_pred": None} if model_type == model_base.ModelType.V_PREDICTION.name else {}
+    inital_load_device = initial_device if initial_device is not None else model_management.unet_inital_load_device(parameters, unet_dtype)
+    model = model_config.get_model(type_sd, "", device=torch.device("meta"))
+    m = load_model_weights_streaming(model.diffusion_model, unet_sd, device=inital_load_device)
+    if len(m) > 0:
+        print("unet missing:", m)
+
+    clip = None
+    if clip_sd is not None:
+        clip = CLIP(model_config.clip_target(), embedding_directory=embedding_directory)
+        m = load_model_weights_streaming(clip.cond_stage_model, clip_sd)
+        if len(m) > 0:
+            print("clip missing:", m)
+
+    vae = None
+    if vae_sd is not None:
+        vae = VAE(sd=vae_sd)
+
+    model_patcher = ldm_patched.modules.model_patcher.ModelPatcher(model, load_device=load_device, offload_device=model_management.unet_offload_device(), current_device=inital_load_device)
+    if inital_load_device != torch.device("cpu"):
+        print("loaded straight to GPU")
+        model_management.load_model_gpu(model_patcher)
+
+    return model_patcher, clip, vae
+
+
 def load_unet_state_dict(sd): #load unet in diffusers format
     parameters = ldm_patched.modules.utils.calculate_parameters(sd)
     unet_dtype = model_management.unet_dtype(model_params=parameters)
@@ -1,15 +1,75 @@
 import torch
 import math
 import struct
+import collections.abc
 import ldm_patched.modules.checkpoint_pickle
+import safetensors
 import safetensors.torch
 import numpy as np
 from PIL import Image
 
-def load_torch_file(ckpt, safe_load=False, device=None):
+class SafetensorsStateDict(collections.abc.MutableMapping):
+    """State dict backed by a memory-mapped safetensors file. Tensors are read on every access and never kept,
+    renaming a key does not read it."""
+
+    def __init__(self, ckpt, device=None):
+        if device is None:
+            device = torch.device("cpu")
+        self.handle = safetensors.safe_open(ckpt, framework="pt", device=device.type)
+        self.sources = {k: k for k in self.handle.keys()}
+        self.tensors = {}
+
+    def __getitem__(self, key):
+        if key in self.tensors:
+            return self.tensors[key]
+        return self.handle.get_tensor(self.sources[key])
+
+    def __setitem__(self, key, value):
+        self.sources.pop(key, None)
+        self.tensors[key] = value
+
+    def __delitem__(self, key):
+        if key in self.tensors:
+            del self.tensors[key]
+        else:
+            del self.sources[key]
+
+    def __contains__(self, key):
+        return key in self.sources or key in self.tensors
+
+    def __iter__(self):
+        return iter(list(self.sources) + list(self.tensors))
+
+    def __len__(self):
+        return len(self.sources) + len(self.tensors)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def rename(self, key, new_key):
+        if key in self.tensors:
+            self[new_key] = self.tensors.pop(key)
+        else:
+            self.tensors.pop(new_key, None)
+            self.sources[new_key] = self.sources.pop(key)
+
+    def nelement(self, key):
+        if key in self.tensors:
+            return self.tensors[key].nelement()
+        return math.prod(self.handle.get_slice(self.sources[key]).get_shape())
+
+def rename_key(sd, key, new_key):
+    if isinstance(sd, SafetensorsStateDict):
+        sd.rename(key, new_key)
+    else:
+        sd[new_key] = sd.pop(key)
+
+def load_torch_file(ckpt, safe_load=False, device=None, lazy=False):
     if device is None:
         device = torch.device("cpu")
     if ckpt.lower().endswith(".safetensors"):
+        if lazy:
+            return SafetensorsStateDict(ckpt, device=device)
         sd = safetensors.torch.load_file(ckpt, device=device.type)
     else:
         if safe_load:
@@ -38,13 +98,16 @@ def calculate_parameters(sd, prefix=""):
     params = 0
     for k in sd.keys():
         if k.startswith(prefix):
-            params += sd[k].nelement()
+            if isinstance(sd, SafetensorsStateDict):
+                params += sd.nelement(k)
+            else:
+                params += sd[k].nelement()
     return params
 
 def state_dict_key_replace(state_dict, keys_to_replace):
     for x in keys_to_replace:
         if x in state_dict:
-            state_dict[keys_to_replace[x]] = state_dict.pop(x)
+            rename_key(state_dict, x, keys_to_replace[x])
     return state_dict
 
 def state_dict_prefix_replace(state_dict, replace_prefix, filter_keys=False):
@@ -55,8 +118,10 @@ def state_dict_prefix_replace(state_dict, replace_prefix, filter_keys=False):
     for rp in replace_prefix:
         replace = list(map(lambda a: (a, "{}{}".format(replace_prefix[rp], a[len(rp):])), filter(lambda a: a.startswith(rp), state_dict.keys())))
         for x in replace:
-            w = state_dict.pop(x[0])
-            out[x[1]] = w
+            if out is state_dict:
+                rename_key(state_dict, x[0], x[1])
+            else:
+                out[x[1]] = state_dict.pop(x[0])
     return out
 
 
@@ -71,7 +136,7 @@ def transformers_convert(sd, prefix_from, prefix_to, number):
     for k in keys_to_replace:
         x = k.format(prefix_from)
         if x in sd:
-            sd[keys_to_replace[k].format(prefix_to)] = sd.pop(x)
+            rename_key(sd, x, keys_to_replace[k].format(prefix_to))
 
     resblock_to_replace = {
         "ln_1": "layer_norm1",
@@ -87,7 +152,7 @@ def transformers_convert(sd, prefix_from, prefix_to, number):
                 k = "{}transformer.resblocks.{}.{}.{}".format(prefix_from, resblock, x, y)
                 k_to = "{}encoder.layers.{}.{}.{}".format(prefix_to, resblock, resblock_to_replace[x], y)
                 if k in sd:
-                    sd[k_to] = sd.pop(k)
+                    rename_key(sd, k, k_to)
 
         for y in ["weight", "bias"]:
             k_from = "{}transformer.resblocks.{}.attn.in_proj_{}".format(prefix_from, resblock, y)
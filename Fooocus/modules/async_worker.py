@@ -1,8 +1,11 @@
 import threading
+import time
 
 from extras.inpaint_mask import generate_mask_from_image, SAMOptions
 from modules.patch import PatchSettings, patch_settings, patch_all
+from modules.preview_policy import PreviewPolicy
 import modules.config
+import modules.prefetch
 
 patch_all()
 
@@ -16,9 +19,16 @@ class AsyncTask:
 
         self.args = args.copy()
         self.yields = []
+        self.yields_condition = threading.Condition()
         self.results = []
         self.last_stop = False
         self.processing = False
+        self.finished = False
+        self.request = None
+        self.preview_consumers = 0
+        self.preview_policy = None
+        self.deliver = 'path'
+        self.persist = True
 
         self.performance_loras = []
 
@@ -158,7 +168,188 @@ class AsyncTask:
         self.images_to_enhance_count = 0
         self.enhance_stats = {}
 
-async_tasks = []
+    @classmethod
+    def from_request(cls, request, deliver='path', persist=True):
+        """Build a task from a GenerationRequest (or a dict of its fields) instead of the positional webui ctrls.
+        With deliver='bytes' or 'array' the results are encoded images or image arrays instead of file paths, and are
+        only written to disk in the background when persist is set."""
+        from modules.generation_request import GenerationRequest
+        from modules.flags import result_deliveries
+
+        if deliver not in result_deliveries:
+            raise ValueError(f'deliver must be one of {result_deliveries}')
+        if isinstance(request, dict):
+            request = GenerationRequest.from_dict(request)
+        request.validate()
+        task = cls(args=request.to_ctrls())
+        task.request = request
+        task.deliver = deliver
+        task.persist = persist
+        return task
+
+    def lora_references(self):
+        """Enabled LoRAs together with the ones referenced in the prompt."""
+        from modules.util import parse_lora_references_from_prompt, remove_performance_lora
+
+        lora_filenames = remove_performance_lora(modules.config.lora_filenames, self.performance_selection)
+        loras, _ = parse_lora_references_from_prompt(self.prompt, self.loras, modules.config.default_max_lora_number,
+                                                     lora_filenames=lora_filenames)
+        return loras
+
+    def weight_files(self):
+        """Checkpoint, VAE and LoRA files the task will load, as (kind, filename) pairs."""
+        import os
+        import modules.flags
+        from modules.util import get_file_from_folder_list
+
+        if len(self.args) == 0:
+            return []
+
+        files = [('checkpoint', get_file_from_folder_list(self.base_model_name, modules.config.paths_checkpoints))]
+        if self.refiner_model_name != 'None':
+            files.append(('checkpoint', get_file_from_folder_list(self.refiner_model_name, modules.config.paths_checkpoints)))
+        if self.vae_name != modules.flags.default_vae:
+            files.append(('vae', get_file_from_folder_list(self.vae_name, modules.config.path_vae)))
+
+        lora_names = [name for name, weight in self.lora_references()]
+        if self.performance_selection.lora_filename() is not None:
+            lora_names.append(self.performance_selection.lora_filename())
+        for name in lora_names:
+            if name != 'None':
+                files.append(('lora', name if os.path.exists(name) else get_file_from_folder_list(name, modules.config.paths_loras)))
+        return files
+
+    def batch_signature(self):
+        """Settings that have to match for tasks to share one sampling run, None if the task can not be batched."""
+        from modules.sdxl_styles import fooocus_expansion
+
+        if len(self.args) == 0 or self.input_image_checkbox or self.enhance_checkbox:
+            return None
+
+        loras = self.lora_references()
+
+        return (self.base_model_name, self.refiner_model_name, self.refiner_switch, self.vae_name,
+                tuple(tuple(lora) for lora in loras), self.performance_selection, self.aspect_ratios_selection,
+                self.sampler_name, self.scheduler_name, self.cfg_scale, self.sharpness, self.adm_scaler_positive,
+                self.adm_scaler_negative, self.adm_scaler_end, self.adaptive_cfg, self.clip_skip,
+                self.refiner_swap_method, self.freeu_enabled, self.freeu_b1, self.freeu_b2, self.freeu_s1,
+                self.freeu_s2, self.overwrite_step, self.overwrite_switch, self.overwrite_width, self.overwrite_height,
+                fooocus_expansion in self.style_selections, self.output_format, self.black_out_nsfw,
+                self.save_metadata_to_images, self.metadata_scheme, self.disable_preview)
+
+    def __getstate__(self):
+        # locks can not be copied, gr.State deep copies its default task for every session
+        state = self.__dict__.copy()
+        del state['yields_condition']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.yields_condition = threading.Condition()
+
+    def emit(self, flag, product):
+        with self.yields_condition:
+            self.yields.append([flag, product])
+            if flag == 'finish':
+                self.finished = True
+            self.yields_condition.notify_all()
+
+    def submit(self):
+        async_tasks.append(self)
+        return self
+
+    def wait(self, timeout=None):
+        """Block until the worker finished this task, returns the results or None on timeout."""
+        with self.yields_condition:
+            if not self.yields_condition.wait_for(lambda: self.finished, timeout):
+                return None
+        return self.results
+
+    def stream_events(self, timeout=None, previews=True):
+        """Consume yields as [flag, product] pairs until 'finish' or until timeout seconds have passed.
+        Preview images are only decoded while at least one consumer streams with previews=True."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if previews:
+            with self.yields_condition:
+                self.preview_consumers += 1
+        try:
+            while True:
+                with self.yields_condition:
+                    remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                    if not self.yields_condition.wait_for(lambda: len(self.yields) > 0, remaining):
+                        return
+                    flag, product = self.yields.pop(0)
+                yield flag, product
+                if flag == 'finish':
+                    return
+        finally:
+            if previews:
+                with self.yields_condition:
+                    self.preview_consumers -= 1
+
+    def stream_progress(self, timeout=None, min_preview_interval=0.0, previews=True):
+        """stream_events with previews coalesced: a preview is dropped when a newer one is already queued or when
+        less than min_preview_interval seconds passed since the last one, so slow consumers skip frames instead of lagging."""
+        last_preview = None
+        for flag, product in self.stream_events(timeout=timeout, previews=previews):
+            if flag == 'preview':
+                with self.yields_condition:
+                    newer = len(self.yields) > 0 and self.yields[0][0] == 'preview'
+                now = time.monotonic()
+                if newer or (last_preview is not None and now - last_preview < min_preview_interval):
+                    continue
+                last_preview = now
+            yield flag, product
+
+
+class AsyncTaskQueue:
+    def __init__(self):
+        self.tasks = []
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def append(self, task):
+        with self.condition:
+            self.tasks.append(task)
+            self.condition.notify_all()
+        modules.prefetch.prefetch(task.weight_files())
+
+    def peek(self):
+        """The task at the head of the queue without removing it, None if the queue is empty."""
+        with self.condition:
+            return self.tasks[0] if len(self.tasks) > 0 else None
+
+    def pop(self, timeout=None):
+        """Block until a task is queued and remove it, returns None on timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.tasks) > 0, timeout):
+                return None
+            return self.tasks.pop(0)
+
+    def pop_compatible(self, signature, window, max_images):
+        """Collect queued tasks with the given batch signature for up to window seconds and remove them, in queue order.
+        A task popped from an empty queue has no concurrent requests to wait for and starts right away."""
+        deadline = time.monotonic() + window
+        batch = []
+        with self.condition:
+            if len(self.tasks) == 0:
+                return batch
+            while max_images > 0:
+                for task in list(self.tasks):
+                    if task.image_number <= max_images and task.batch_signature() == signature:
+                        self.tasks.remove(task)
+                        batch.append(task)
+                        max_images -= task.image_number
+                remaining = deadline - time.monotonic()
+                if max_images <= 0 or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+        return batch
+
+
+async_tasks = AsyncTaskQueue()
 
 
 class EarlyReturnException(BaseException):
@@ -182,6 +373,7 @@ def worker():
     import modules.core as core
     import modules.flags as flags
     import modules.patch
+    import modules.cond_cache
     import ldm_patched.modules.model_management
     import extras.preprocessors as preprocessors
     import modules.inpaint_worker as inpaint_worker
@@ -192,7 +384,11 @@ def worker():
 
     from extras.censor import default_censor
     from modules.sdxl_styles import apply_style, get_random_style, fooocus_expansion, apply_arrays, random_style_name
-    from modules.private_logger import log
+    from modules.private_logger import log, after_saved, wait_for_saves, drop_failed
+    from modules.embedding_cache import embedding_cache
+    from modules.hint_cache import hint_cache
+    from modules.latent_cache import latent_cache, vae_identity
+    from concurrent.futures import ThreadPoolExecutor
     from extras.expansion import safe_str
     from modules.util import (remove_empty_str, HWC3, resize_image, get_image_shape_ceil, set_image_shape_ceil,
                               get_shape_ceil, resample_image, erode_or_dilate, parse_lora_references_from_prompt,
@@ -215,7 +411,7 @@ def worker():
 
     def progressbar(async_task, number, text):
         print(f'[Fooocus] {text}')
-        async_task.yields.append(['preview', (number, text, None)])
+        async_task.emit('preview', (number, text, None))
 
     def yield_result(async_task, imgs, progressbar_index, black_out_nsfw, censor=True, do_not_show_finished_images=False):
         if not isinstance(imgs, list):
@@ -230,7 +426,9 @@ def worker():
         if do_not_show_finished_images:
             return
 
-        async_task.yields.append(['results', async_task.results])
+        # shown once the files are written, sampling goes on meanwhile
+        results = async_task.results
+        after_saved(lambda: async_task.emit('results', drop_failed(results)))
         return
 
     def build_image_wall(async_task):
@@ -243,6 +441,9 @@ def worker():
             if isinstance(img, str) and os.path.exists(img):
                 img = cv2.imread(img)
                 img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            elif isinstance(img, bytes):
+                img = cv2.imdecode(np.frombuffer(img, dtype=np.uint8), cv2.IMREAD_COLOR)
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
             if not isinstance(img, np.ndarray):
                 return
             if img.ndim != 3:
@@ -281,8 +482,11 @@ def worker():
                      denoising_strength, final_scheduler_name, goals, initial_latent, steps, switch, positive_cond,
                      negative_cond, task, loras, tiled, use_expansion, width, height, base_progress, preparation_steps,
                      total_count, show_intermediate_results, persist_image=True):
-        if async_task.last_stop is not False:
+        # a list of tasks is sampled as one batch, one image per task seed
+        batch = task if isinstance(task, list) else [task]
+        if any(t.get('async_task', async_task).last_stop is not False for t in batch):
             ldm_patched.modules.model_management.interrupt_current_processing()
+        image_seed = [t['task_seed'] for t in batch] if len(batch) > 1 else batch[0]['task_seed']
         if 'cn' in goals:
             for cn_flag, cn_path in [
                 (flags.cn_canny, controlnet_canny_path),
@@ -299,7 +503,7 @@ def worker():
             switch=switch,
             width=width,
             height=height,
-            image_seed=task['task_seed'],
+            image_seed=image_seed,
             callback=callback,
             sampler_name=async_task.sampler_name,
             scheduler_name=final_scheduler_name,
@@ -308,19 +512,29 @@ def worker():
             tiled=tiled,
             cfg_scale=async_task.cfg_scale,
             refiner_swap_method=async_task.refiner_swap_method,
-            disable_preview=async_task.disable_preview
+            disable_preview=async_task.disable_preview,
+            preview_policy=async_task.preview_policy
         )
         del positive_cond, negative_cond  # Save memory
         if inpaint_worker.current_task is not None:
             imgs = [inpaint_worker.current_task.post_process(x) for x in imgs]
-        current_progress = int(base_progress + (100 - preparation_steps) / float(all_steps) * steps)
+        current_progress = int(base_progress + (100 - preparation_steps) / float(all_steps) * steps * len(batch))
         if modules.config.default_black_out_nsfw or async_task.black_out_nsfw:
             progressbar(async_task, current_progress, 'Checking for NSFW content ...')
             imgs = default_censor(imgs)
-        progressbar(async_task, current_progress, f'Saving image {current_task_id + 1}/{total_count} to system ...')
-        img_paths = save_and_log(async_task, height, imgs, task, use_expansion, width, loras, persist_image)
-        yield_result(async_task, img_paths, current_progress, async_task.black_out_nsfw, False,
-                     do_not_show_finished_images=not show_intermediate_results or async_task.disable_intermediate_results)
+        progressbar(async_task, current_progress, f'Saving image {current_task_id + len(batch)}/{total_count} to system ...')
+        img_paths = []
+        owner_paths = {}
+        for batch_task, img in zip(batch, imgs):
+            # tasks batched in from other requests are saved with the shared settings of async_task
+            owner = batch_task.get('async_task', async_task)
+            paths = save_and_log(async_task, height, [img], batch_task, use_expansion, width, loras, persist_image)
+            owner_paths.setdefault(owner, []).extend(paths)
+            img_paths += paths
+        for owner, paths in owner_paths.items():
+            show_owner_results = show_intermediate_results if owner is async_task else owner.image_number > 1
+            yield_result(owner, paths, current_progress, owner.black_out_nsfw, False,
+                         do_not_show_finished_images=not show_owner_results or owner.disable_intermediate_results)
 
         return imgs, img_paths, current_progress
 
@@ -389,61 +603,93 @@ def worker():
             d.append(('Metadata Scheme', 'metadata_scheme',
                       async_task.metadata_scheme.value if async_task.save_metadata_to_images else async_task.save_metadata_to_images))
             d.append(('Version', 'version', 'Fooocus v' + fooocus_version.version))
-            img_paths.append(log(x, d, metadata_parser, async_task.output_format, task, persist_image))
+            owner = task.get('async_task', async_task)
+            img_paths.append(log(x, d, metadata_parser, async_task.output_format, task, persist_image,
+                                 deliver=owner.deliver, persist=owner.persist))
 
         return img_paths
 
-    def apply_control_nets(async_task, height, ip_adapter_face_path, ip_adapter_path, width, current_progress):
-        for task in async_task.cn_tasks[flags.cn_canny]:
-            cn_img, cn_stop, cn_weight = task
-            cn_img = resize_image(HWC3(cn_img), width=width, height=height)
-
-            if not async_task.skipping_cn_preprocessor:
+    def ip_preprocess(async_task, cn_img, adapter_path, face_crop, current_progress):
+        # reference images are reused a lot, their embeddings are cached by content unless the crop is to be shown
+        key = None
+        if not async_task.debugging_cn_preprocessor:
+            key = embedding_cache.make_key(cn_img, adapter_path, 'face' if face_crop else 'none')
+            cached = embedding_cache.get(key)
+            if cached is not None:
+                print(f'[Embedding Cache] Reused image prompt embedding {key[:10]}')
+                return cached
+
+        cn_img = HWC3(cn_img)
+
+        if face_crop:
+            cn_img = extras.face_crop.crop_image(cn_img)
+
+        # https://github.com/tencent-ailab/IP-Adapter/blob/d580c50a291566bbf9fc7ac0f760506607297e6d/README.md?plain=1#L75
+        cn_img = resize_image(cn_img, width=224, height=224, resize_mode=0)
+
+        ip_conds, ip_unconds = ip_adapter.preprocess(cn_img, ip_adapter_path=adapter_path)
+        if key is not None:
+            embedding_cache.put(key, ip_conds, ip_unconds)
+        if async_task.debugging_cn_preprocessor:
+            yield_result(async_task, cn_img, current_progress, async_task.black_out_nsfw, do_not_show_finished_images=True)
+        return ip_conds, ip_unconds
+
+    def preprocess_hint(async_task, cn_img, cn_type, width, height):
+        parameters = (async_task.skipping_cn_preprocessor,)
+        if cn_type == flags.cn_canny:
+            parameters += (async_task.canny_low_threshold, async_task.canny_high_threshold)
+        key = hint_cache.make_key(cn_img, cn_type, width, height, parameters)
+        cached = hint_cache.get(key)
+        if cached is not None:
+            return cached
+
+        cn_img = resize_image(HWC3(cn_img), width=width, height=height)
+
+        if not async_task.skipping_cn_preprocessor:
+            if cn_type == flags.cn_canny:
                 cn_img = preprocessors.canny_pyramid(cn_img, async_task.canny_low_threshold,
                                                      async_task.canny_high_threshold)
+            else:
+                cn_img = preprocessors.cpds(cn_img)
 
-            cn_img = HWC3(cn_img)
-            task[0] = core.numpy_to_pytorch(cn_img)
-            if async_task.debugging_cn_preprocessor:
-                yield_result(async_task, cn_img, current_progress, async_task.black_out_nsfw, do_not_show_finished_images=True)
-        for task in async_task.cn_tasks[flags.cn_cpds]:
-            cn_img, cn_stop, cn_weight = task
-            cn_img = resize_image(HWC3(cn_img), width=width, height=height)
+        cn_img = HWC3(cn_img)
+        hint_cache.put(key, cn_img)
+        return cn_img
 
-            if not async_task.skipping_cn_preprocessor:
-                cn_img = preprocessors.cpds(cn_img)
+    def apply_control_nets(async_task, height, ip_adapter_face_path, ip_adapter_path, width, current_progress):
+        hint_tasks = [(task, cn_type) for cn_type in [flags.cn_canny, flags.cn_cpds] for task in async_task.cn_tasks[cn_type]]
+        workers = min(modules.config.default_cn_preprocess_workers, len(hint_tasks))
+        if workers > 1:
+            # opencv releases the gil, so the control images of a task are preprocessed concurrently
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                cn_imgs = list(executor.map(lambda t: preprocess_hint(async_task, t[0][0], t[1], width, height), hint_tasks))
+        else:
+            cn_imgs = [preprocess_hint(async_task, task[0], cn_type, width, height) for task, cn_type in hint_tasks]
 
-            cn_img = HWC3(cn_img)
+        for (task, cn_type), cn_img in zip(hint_tasks, cn_imgs):
             task[0] = core.numpy_to_pytorch(cn_img)
             if async_task.debugging_cn_preprocessor:
                 yield_result(async_task, cn_img, current_progress, async_task.black_out_nsfw, do_not_show_finished_images=True)
         for task in async_task.cn_tasks[flags.cn_ip]:
             cn_img, cn_stop, cn_weight = task
-            cn_img = HWC3(cn_img)
-
-            # https://github.com/tencent-ailab/IP-Adapter/blob/d580c50a291566bbf9fc7ac0f760506607297e6d/README.md?plain=1#L75
-            cn_img = resize_image(cn_img, width=224, height=224, resize_mode=0)
-
-            task[0] = ip_adapter.preprocess(cn_img, ip_adapter_path=ip_adapter_path)
-            if async_task.debugging_cn_preprocessor:
-                yield_result(async_task, cn_img, current_progress, async_task.black_out_nsfw, do_not_show_finished_images=True)
+            task[0] = ip_preprocess(async_task, cn_img, ip_adapter_path, face_crop=False,
+                                    current_progress=current_progress)
         for task in async_task.cn_tasks[flags.cn_ip_face]:
             cn_img, cn_stop, cn_weight = task
-            cn_img = HWC3(cn_img)
-
-            if not async_task.skipping_cn_preprocessor:
-                cn_img = extras.face_crop.crop_image(cn_img)
-
-            # https://github.com/tencent-ailab/IP-Adapter/blob/d580c50a291566bbf9fc7ac0f760506607297e6d/README.md?plain=1#L75
-            cn_img = resize_image(cn_img, width=224, height=224, resize_mode=0)
-
-            task[0] = ip_adapter.preprocess(cn_img, ip_adapter_path=ip_adapter_face_path)
-            if async_task.debugging_cn_preprocessor:
-                yield_result(async_task, cn_img, current_progress, async_task.black_out_nsfw, do_not_show_finished_images=True)
+            task[0] = ip_preprocess(async_task, cn_img, ip_adapter_face_path,
+                                    face_crop=not async_task.skipping_cn_preprocessor,
+                                    current_progress=current_progress)
         all_ip_tasks = async_task.cn_tasks[flags.cn_ip] + async_task.cn_tasks[flags.cn_ip_face]
         if len(all_ip_tasks) > 0:
             pipeline.final_unet = ip_adapter.patch_model(pipeline.final_unet, all_ip_tasks)
 
+    def encode_vae_cached(vae, image, tiled=False):
+        # reruns of vary, upscale and inpaint encode the same input image again
+        samples = latent_cache.get_or_compute(
+            latent_cache.make_key('encode_vae', image, vae_identity(vae), tiled),
+            lambda: core.encode_vae(vae=vae, pixels=core.numpy_to_pytorch(image), tiled=tiled)['samples'])
+        return {'samples': samples}
+
     def apply_vary(async_task, uov_method, denoising_strength, uov_input_image, switch, current_progress, advance_progress=False):
         if 'subtle' in uov_method:
             denoising_strength = 0.5
@@ -459,7 +705,6 @@ def worker():
             print(f'[Vary] Image is resized because it is too big.')
             shape_ceil = 2048
         uov_input_image = set_image_shape_ceil(uov_input_image, shape_ceil)
-        initial_pixels = core.numpy_to_pytorch(uov_input_image)
         if advance_progress:
             current_progress += 1
         progressbar(async_task, current_progress, 'VAE encoding ...')
@@ -469,7 +714,7 @@ def worker():
             denoise=denoising_strength,
             refiner_swap_method=async_task.refiner_swap_method
         )
-        initial_latent = core.encode_vae(vae=candidate_vae, pixels=initial_pixels)
+        initial_latent = encode_vae_cached(candidate_vae, uov_input_image)
         B, C, H, W = initial_latent['samples'].shape
         width = W * 8
         height = H * 8
@@ -497,33 +742,32 @@ def worker():
         if advance_progress:
             current_progress += 1
         progressbar(async_task, current_progress, 'VAE Inpaint encoding ...')
-        inpaint_pixel_fill = core.numpy_to_pytorch(inpaint_worker.current_task.interested_fill)
-        inpaint_pixel_image = core.numpy_to_pytorch(inpaint_worker.current_task.interested_image)
-        inpaint_pixel_mask = core.numpy_to_pytorch(inpaint_worker.current_task.interested_mask)
+        inpaint_pixel_fill = inpaint_worker.current_task.interested_fill
+        inpaint_pixel_image = inpaint_worker.current_task.interested_image
+        inpaint_pixel_mask = inpaint_worker.current_task.interested_mask
         candidate_vae, candidate_vae_swap = pipeline.get_candidate_vae(
             steps=async_task.steps,
             switch=switch,
             denoise=denoising_strength,
             refiner_swap_method=async_task.refiner_swap_method
         )
-        latent_inpaint, latent_mask = core.encode_vae_inpaint(
-            mask=inpaint_pixel_mask,
-            vae=candidate_vae,
-            pixels=inpaint_pixel_image)
+        latent_inpaint, latent_mask = latent_cache.get_or_compute(
+            latent_cache.make_key('encode_vae_inpaint', inpaint_pixel_image, inpaint_pixel_mask,
+                                  vae_identity(candidate_vae)),
+            lambda: core.encode_vae_inpaint(
+                mask=core.numpy_to_pytorch(inpaint_pixel_mask),
+                vae=candidate_vae,
+                pixels=core.numpy_to_pytorch(inpaint_pixel_image)))
         latent_swap = None
         if candidate_vae_swap is not None:
             if advance_progress:
                 current_progress += 1
             progressbar(async_task, current_progress, 'VAE SD15 encoding ...')
-            latent_swap = core.encode_vae(
-                vae=candidate_vae_swap,
-                pixels=inpaint_pixel_fill)['samples']
+            latent_swap = encode_vae_cached(candidate_vae_swap, inpaint_pixel_fill)['samples']
         if advance_progress:
             current_progress += 1
         progressbar(async_task, current_progress, 'VAE encoding ...')
-        latent_fill = core.encode_vae(
-            vae=candidate_vae,
-            pixels=inpaint_pixel_fill)['samples']
+        latent_fill = encode_vae_cached(candidate_vae, inpaint_pixel_fill)['samples']
         inpaint_worker.current_task.load_latent(
             latent_fill=latent_fill, latent_mask=latent_mask, latent_swap=latent_swap)
         if inpaint_parameterized:
@@ -575,7 +819,8 @@ def worker():
         if advance_progress:
             current_progress += 1
         progressbar(async_task, current_progress, f'Upscaling image from {str((W, H))} ...')
-        uov_input_image = perform_upscale(uov_input_image)
+        uov_input_image = latent_cache.get_or_compute(latent_cache.make_key('perform_upscale', uov_input_image),
+                                                      lambda: perform_upscale(uov_input_image))
         print(f'Image upscaled.')
         if '1.5x' in uov_method:
             f = 1.5
@@ -607,7 +852,6 @@ def worker():
         denoising_strength = 0.382
         if async_task.overwrite_upscale_strength > 0:
             denoising_strength = async_task.overwrite_upscale_strength
-        initial_pixels = core.numpy_to_pytorch(uov_input_image)
         if advance_progress:
             current_progress += 1
         progressbar(async_task, current_progress, 'VAE encoding ...')
@@ -617,9 +861,7 @@ def worker():
             denoise=denoising_strength,
             refiner_swap_method=async_task.refiner_swap_method
         )
-        initial_latent = core.encode_vae(
-            vae=candidate_vae,
-            pixels=initial_pixels, tiled=True)
+        initial_latent = encode_vae_cached(candidate_vae, uov_input_image, tiled=True)
         B, C, H, W = initial_latent['samples'].shape
         width = W * 8
         height = H * 8
@@ -752,6 +994,7 @@ def worker():
             else:
                 progressbar(async_task, current_progress, f'Encoding negative #{i + 1} ...')
                 t['uc'] = pipeline.clip_encode(texts=t['negative'], pool_top_k=t['negative_top_k'])
+        print(f'[CLIP Cache] {modules.cond_cache.cond_cache.stats()}')
         return tasks, use_expansion, loras, current_progress
 
     def apply_freeu(async_task):
@@ -961,6 +1204,9 @@ def worker():
         async_task.processing = False
         processing_time = time.perf_counter() - processing_start_time
         print(f'Processing time (total): {processing_time:.2f} seconds')
+        if async_task.preview_policy is not None:
+            stats = async_task.preview_policy.stats()
+            print(f'[Preview] Rendered {stats["rendered"]} previews, skipped {stats["skipped"]}')
 
     def process_enhance(all_steps, async_task, callback, controlnet_canny_path, controlnet_cpds_path,
                         current_progress, current_task_id, denoising_strength, inpaint_disable_initial_latent,
@@ -988,7 +1234,8 @@ def worker():
                     progressbar(async_task, current_progress, 'Checking for NSFW content ...')
                     img = default_censor(img)
                 progressbar(async_task, current_progress, f'Saving image {current_task_id + 1}/{total_count} to system ...')
-                uov_image_path = log(img, d, output_format=async_task.output_format, persist_image=persist_image)
+                uov_image_path = log(img, d, output_format=async_task.output_format, persist_image=persist_image,
+                                     deliver=async_task.deliver, persist=async_task.persist)
                 yield_result(async_task, uov_image_path, current_progress, async_task.black_out_nsfw, False,
                              do_not_show_finished_images=not show_intermediate_results or async_task.disable_intermediate_results)
                 return current_progress, img, prompt, negative_prompt
@@ -1068,9 +1315,12 @@ def worker():
 
     @torch.no_grad()
     @torch.inference_mode()
-    def handler(async_task: AsyncTask):
+    def handler(async_task: AsyncTask, followers=()):
         preparation_start_time = time.perf_counter()
         async_task.processing = True
+        followers = list(followers)
+        for follower in followers:
+            follower.processing = True
 
         async_task.outpaint_selections = [o.lower() for o in async_task.outpaint_selections]
         base_model_additional_loras = []
@@ -1083,6 +1333,10 @@ def worker():
         else:
             use_expansion = False
 
+        for follower in followers:
+            if fooocus_expansion in follower.style_selections:
+                follower.style_selections.remove(fooocus_expansion)
+
         use_style = len(async_task.style_selections) > 0
 
         if async_task.base_model_name == async_task.refiner_model_name:
@@ -1162,6 +1416,20 @@ def worker():
                                                          async_task.disable_seed_increment, use_expansion, use_style,
                                                          use_synthetic_refiner, current_progress, advance_progress=True)
 
+        # followers share the pipeline settings of async_task, only prompts, styles and seeds differ
+        for follower in followers:
+            follower.performance_loras = async_task.performance_loras
+            follower.refiner_model_name = async_task.refiner_model_name
+            follower.cfg_scale = async_task.cfg_scale
+            follower_tasks, _, _, _ = process_prompt(follower, follower.prompt, follower.negative_prompt,
+                                                     base_model_additional_loras, follower.image_number,
+                                                     follower.disable_seed_increment, use_expansion,
+                                                     len(follower.style_selections) > 0, use_synthetic_refiner,
+                                                     current_progress)
+            for t in follower_tasks:
+                t['async_task'] = follower
+            tasks += follower_tasks
+
         if len(goals) > 0:
             current_progress += 1
             progressbar(async_task, current_progress, 'Image processing ...')
@@ -1183,7 +1451,8 @@ def worker():
                     progressbar(async_task, 100, 'Checking for NSFW content ...')
                     async_task.uov_input_image = default_censor(async_task.uov_input_image)
                 progressbar(async_task, 100, 'Saving image to system ...')
-                uov_input_image_path = log(async_task.uov_input_image, d, output_format=async_task.output_format)
+                uov_input_image_path = log(async_task.uov_input_image, d, output_format=async_task.output_format,
+                                           deliver=async_task.deliver, persist=async_task.persist)
                 yield_result(async_task, uov_input_image_path, 100, async_task.black_out_nsfw, False,
                              do_not_show_finished_images=True)
                 return
@@ -1226,7 +1495,8 @@ def worker():
             yield_result(async_task, async_task.enhance_input_image, current_progress, async_task.black_out_nsfw, False,
                          async_task.disable_intermediate_results)
 
-        all_steps = steps * async_task.image_number
+        total_count = async_task.image_number + sum(follower.image_number for follower in followers)
+        all_steps = steps * total_count
 
         if async_task.enhance_checkbox and async_task.enhance_uov_method != flags.disabled.casefold():
             enhance_upscale_steps = async_task.performance_selection.steps()
@@ -1256,55 +1526,113 @@ def worker():
 
         preparation_time = time.perf_counter() - preparation_start_time
         print(f'Preparation time: {preparation_time:.2f} seconds')
+        hidden_load_time = pipeline.take_lookahead_hidden_seconds()
+        if hidden_load_time > 0:
+            print(f'[Lookahead] Model loading hidden behind the previous task: {hidden_load_time:.2f} seconds')
+
+        # this task's models are in place, load the next task's ones while sampling
+        pipeline.start_lookahead(async_tasks.peek())
 
         final_scheduler_name = patch_samplers(async_task)
         print(f'Using {final_scheduler_name} scheduler.')
 
-        async_task.yields.append(['preview', (current_progress, 'Moving model to GPU ...', None)])
+        async_task.emit('preview', (current_progress, 'Moving model to GPU ...', None))
 
         processing_start_time = time.perf_counter()
 
         preparation_steps = current_progress
-        total_count = async_task.image_number
+        current_batch_size = 1
+
+        watchers = [async_task] + followers
+        async_task.preview_policy = PreviewPolicy(
+            every_n_steps=modules.config.default_preview_every_n_steps,
+            min_interval=modules.config.default_preview_min_interval / 1000.0,
+            watched=(lambda: any(t.preview_consumers > 0 for t in watchers))
+            if modules.config.default_preview_only_when_watched else None)
 
         def callback(step, x0, x, total_steps, y):
             if step == 0:
                 async_task.callback_steps = 0
-            async_task.callback_steps += (100 - preparation_steps) / float(all_steps)
-            async_task.yields.append(['preview', (
-                int(current_progress + async_task.callback_steps),
-                f'Sampling step {step + 1}/{total_steps}, image {current_task_id + 1}/{total_count} ...', y)])
-
-        show_intermediate_results = len(tasks) > 1 or async_task.should_enhance
+            async_task.callback_steps += (100 - preparation_steps) / float(all_steps) * current_batch_size
+            image_label = f'{current_task_id + 1}' if current_batch_size == 1 \
+                else f'{current_task_id + 1}-{current_task_id + current_batch_size}'
+            for member in [async_task] + followers:
+                member.emit('preview', (
+                    int(current_progress + async_task.callback_steps),
+                    f'Sampling step {step + 1}/{total_steps}, image {image_label}/{total_count} ...', y))
+
+        show_intermediate_results = len([t for t in tasks if 'async_task' not in t]) > 1 or async_task.should_enhance
         persist_image = not async_task.should_enhance or not async_task.save_final_enhanced_image_only
 
-        for current_task_id, task in enumerate(tasks):
-            progressbar(async_task, current_progress, f'Preparing task {current_task_id + 1}/{async_task.image_number} ...')
+        # inpainting and image prompts patch the model for a single image, everything else can be batched
+        batch_size = 1
+        if len(tasks) > 1 and 'inpaint' not in goals \
+                and len(async_task.cn_tasks[flags.cn_ip]) == 0 and len(async_task.cn_tasks[flags.cn_ip_face]) == 0:
+            batch_size = pipeline.get_image_batch_size(width, height, len(tasks), async_task.sampler_name)
+
+        task_batches = []
+        for task in tasks:
+            if len(task_batches) > 0 and len(task_batches[-1]) < batch_size \
+                    and core.can_stack_conds(task_batches[-1][0]['c'], task['c']) \
+                    and core.can_stack_conds(task_batches[-1][0]['uc'], task['uc']):
+                task_batches[-1].append(task)
+            else:
+                task_batches.append([task])
+
+        members = [async_task] + followers
+        current_task_id = 0
+        while len(task_batches) > 0:
+            batch = task_batches.pop(0)
+            current_batch_size = len(batch)
+            progressbar(async_task, current_progress, f'Preparing task {current_task_id + 1}/{total_count} ...')
             execution_start_time = time.perf_counter()
 
+            if len(batch) > 1:
+                task = batch
+                positive_cond = core.stack_conds([t['c'] for t in batch])
+                negative_cond = core.stack_conds([t['uc'] for t in batch])
+            else:
+                task = batch[0]
+                positive_cond, negative_cond = task['c'], task['uc']
+
             try:
                 imgs, img_paths, current_progress = process_task(all_steps, async_task, callback, controlnet_canny_path,
                                                                  controlnet_cpds_path, current_task_id,
                                                                  denoising_strength, final_scheduler_name, goals,
-                                                                 initial_latent, async_task.steps, switch, task['c'],
-                                                                 task['uc'], task, loras, tiled, use_expansion, width,
+                                                                 initial_latent, async_task.steps, switch, positive_cond,
+                                                                 negative_cond, task, loras, tiled, use_expansion, width,
                                                                  height, current_progress, preparation_steps,
-                                                                 async_task.image_number, show_intermediate_results,
+                                                                 total_count, show_intermediate_results,
                                                                  persist_image)
 
-                current_progress = int(preparation_steps + (100 - preparation_steps) / float(all_steps) * async_task.steps * (current_task_id + 1))
+                current_task_id += len(batch)
+                current_progress = int(preparation_steps + (100 - preparation_steps) / float(all_steps) * async_task.steps * current_task_id)
                 images_to_enhance += imgs
 
             except ldm_patched.modules.model_management.InterruptProcessingException:
-                if async_task.last_stop == 'skip':
-                    print('User skipped')
-                    async_task.last_stop = False
-                    continue
-                else:
+                # stop and skip of batched tasks only end the images of the task they were pressed for
+                stopped = [m for m in members if m.last_stop == 'stop']
+                skipped = [m for m in members if m.last_stop == 'skip']
+                if len(stopped) == 0 and len(skipped) == 0:
                     print('User stopped')
                     break
+                for m in skipped:
+                    print('User skipped')
+                    m.last_stop = False
+                if len(stopped) > 0:
+                    print('User stopped')
 
-            del task['c'], task['uc']  # Save memory
+                ended = [t for t in batch if t.get('async_task', async_task) in stopped + skipped]
+                current_task_id += len(ended)
+                # images of the other tasks in the batch are sampled again
+                task_batches.insert(0, [t for t in batch if not any(t is e for e in ended)])
+                task_batches = [[t for t in b if t.get('async_task', async_task) not in stopped] for b in task_batches]
+                task_batches = [b for b in task_batches if len(b) > 0]
+                continue
+
+            del positive_cond, negative_cond
+            for t in batch:
+                del t['c'], t['uc']  # Save memory
             execution_time = time.perf_counter() - execution_start_time
             print(f'Generating and saving time: {execution_time:.2f} seconds')
 
@@ -1328,6 +1656,7 @@ def worker():
 
         base_progress = current_progress
         current_task_id = -1
+        current_batch_size = 1
         done_steps_upscaling = 0
         done_steps_inpainting = 0
         enhance_steps, _, _, _ = apply_overrides(async_task, async_task.original_steps, height, width)
@@ -1389,7 +1718,7 @@ def worker():
                     mask = 255 - mask
 
                 if async_task.debugging_enhance_masks_checkbox:
-                    async_task.yields.append(['preview', (current_progress, 'Loading ...', mask)])
+                    async_task.emit('preview', (current_progress, 'Loading ...', mask))
                     yield_result(async_task, mask, current_progress, async_task.black_out_nsfw, False,
                                  async_task.disable_intermediate_results)
                     async_task.enhance_stats[index] += 1
@@ -1463,22 +1792,40 @@ def worker():
         return
 
     while True:
-        time.sleep(0.01)
-        if len(async_tasks) > 0:
-            task = async_tasks.pop(0)
-
+        task = async_tasks.pop()
+
+        # hold the task for a short window so concurrent requests with the same pipeline settings share one batch
+        followers = []
+        signature = task.batch_signature()
+        if signature is not None and modules.config.default_task_batch_window > 0:
+            followers = async_tasks.pop_compatible(signature, modules.config.default_task_batch_window / 1000.0,
+                                                   modules.config.default_max_image_batch_size - task.image_number)
+            if len(followers) > 0:
+                print(f'[Batch] Sampling {len(followers) + 1} tasks together.')
+
+        try:
+            handler(task, followers)
+            wait_for_saves()
+            for t in [task] + followers:
+                t.results = drop_failed(t.results)
+                if t.generate_image_grid:
+                    build_image_wall(t)
+                t.emit('finish', t.results)
+            pipeline.prepare_text_encoder(async_call=True)
+        except:
+            traceback.print_exc()
             try:
-                handler(task)
-                if task.generate_image_grid:
-                    build_image_wall(task)
-                task.yields.append(['finish', task.results])
-                pipeline.prepare_text_encoder(async_call=True)
+                wait_for_saves()
             except:
                 traceback.print_exc()
-                task.yields.append(['finish', task.results])
-            finally:
-                if pid in modules.patch.patch_settings:
-                    del modules.patch.patch_settings[pid]
+            for t in [task] + followers:
+                t.results = drop_failed(t.results)
+                t.emit('finish', t.results)
+        finally:
+            for t in followers:
+                t.processing = False
+            if pid in modules.patch.patch_settings:
+                del modules.patch.patch_settings[pid]
     pass
 
 
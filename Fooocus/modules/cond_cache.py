@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import safetensors.torch
+import torch
+
+import modules.config
+from modules.util import file_signature
+
+
+class CondCache:
+    """LRU cache of CLIP conds, optionally backed by a directory of memory-mapped safetensors files."""
+
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(identity, layer_idx, text):
+        return hashlib.sha256(f'{identity}\n{layer_idx}\n{text}'.encode('utf-8')).hexdigest()
+
+    def get(self, key, persistent=True):
+        with self.lock:
+            result = self.entries.get(key, None)
+            if result is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+
+        result = self.load_from_disk(key) if persistent else None
+
+        with self.lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.insert(key, result)
+        return result
+
+    def put(self, key, cond, pooled, persistent=True):
+        with self.lock:
+            self.insert(key, (cond, pooled))
+        if persistent:
+            self.save_to_disk(key, cond, pooled)
+
+    def insert(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return dict(entries=len(self.entries), hits=self.hits, disk_hits=self.disk_hits, misses=self.misses)
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], f'{key}.safetensors')
+
+    def load_from_disk(self, key):
+        if self.path is None:
+            return None
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with safetensors.safe_open(filename, framework='pt') as f:
+                return f.get_tensor('cond'), f.get_tensor('pooled')
+        except Exception as e:
+            print(f'[CLIP Cache] Loading {filename} failed: {e}')
+            return None
+
+    def save_to_disk(self, key, cond, pooled):
+        if self.path is None or pooled is None:
+            return
+        filename = self.filename(key)
+        if os.path.exists(filename):
+            return
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            temp_filename = f'{filename}.{os.getpid()}.tmp'
+            safetensors.torch.save_file({'cond': cond.contiguous(), 'pooled': pooled.contiguous()}, temp_filename)
+            os.replace(temp_filename, filename)
+        except Exception as e:
+            print(f'[CLIP Cache] Saving {filename} failed: {e}')
+
+
+cond_cache = CondCache(modules.config.default_clip_cond_cache_size,
+                       modules.config.clip_cond_cache_path if modules.config.clip_cond_cache_path not in ['', 'None'] else None)
+
+
+def clip_identity(filename, loras):
+    """Identifies CLIP weights by checkpoint file and applied (lora_filename, weight) stack, stable across processes."""
+    loras = [(file_signature(lora_filename), weight) for lora_filename, weight in loras]
+    return hashlib.sha256(f'{file_signature(filename)}:{loras}'.encode('utf-8')).hexdigest()
+
+
+@torch.no_grad()
+@torch.inference_mode()
+def encode(clip, text, verbose=False):
+    identity = getattr(clip, 'fcs_cond_identity', None)
+    persistent = identity is not None
+    if identity is None:
+        identity = f'id:{id(clip)}'
+
+    key = CondCache.make_key(identity, clip.layer_idx, text)
+    cached = cond_cache.get(key, persistent=persistent)
+    if cached is not None:
+        if verbose:
+            print(f'[CLIP Cached] {text}')
+        return cached
+
+    tokens = clip.tokenize(text)
+    cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
+    cond_cache.put(key, cond, pooled, persistent=persistent)
+    if verbose:
+        print(f'[CLIP Encoded] {text}')
+    return cond, pooled
@@ -451,6 +451,132 @@ default_image_number = get_config_item_or_set_default(
     validator=lambda x: isinstance(x, int) and 1 <= x <= default_max_image_number,
     expected_type=int
 )
+default_max_image_batch_size = get_config_item_or_set_default(
+    key='default_max_image_batch_size',
+    default_value=4,
+    validator=lambda x: isinstance(x, int) and x >= 1,
+    expected_type=int
+)
+default_task_batch_window = get_config_item_or_set_default(
+    key='default_task_batch_window',
+    default_value=50,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+default_clip_cond_cache_size = get_config_item_or_set_default(
+    key='default_clip_cond_cache_size',
+    default_value=256,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+clip_cond_cache_path = get_config_item_or_set_default(
+    key='clip_cond_cache_path',
+    default_value='',
+    validator=lambda x: isinstance(x, str),
+    expected_type=str
+)
+default_latent_cache_budget = get_config_item_or_set_default(
+    key='default_latent_cache_budget',
+    default_value=1024,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+default_cn_hint_cache_size = get_config_item_or_set_default(
+    key='default_cn_hint_cache_size',
+    default_value=16,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+default_cn_preprocess_workers = get_config_item_or_set_default(
+    key='default_cn_preprocess_workers',
+    default_value=2,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+default_ip_embedding_cache_size = get_config_item_or_set_default(
+    key='default_ip_embedding_cache_size',
+    default_value=64,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+ip_embedding_cache_path = get_config_item_or_set_default(
+    key='ip_embedding_cache_path',
+    default_value='',
+    validator=lambda x: isinstance(x, str),
+    expected_type=str
+)
+default_model_pool_budget = get_config_item_or_set_default(
+    key='default_model_pool_budget',
+    default_value=-1,
+    validator=lambda x: isinstance(x, int),
+    expected_type=int
+)
+default_lora_merge_cache_budget = get_config_item_or_set_default(
+    key='default_lora_merge_cache_budget',
+    default_value=0,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+default_lora_file_cache_size = get_config_item_or_set_default(
+    key='default_lora_file_cache_size',
+    default_value=8,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+lora_merge_cache_path = get_config_item_or_set_default(
+    key='lora_merge_cache_path',
+    default_value='',
+    validator=lambda x: isinstance(x, str),
+    expected_type=str
+)
+fast_load_cache_path = get_config_item_or_set_default(
+    key='fast_load_cache_path',
+    default_value='',
+    validator=lambda x: isinstance(x, str),
+    expected_type=str
+)
+default_prefetch_workers = get_config_item_or_set_default(
+    key='default_prefetch_workers',
+    default_value=2,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+default_lookahead_loading = get_config_item_or_set_default(
+    key='default_lookahead_loading',
+    default_value=True,
+    validator=lambda x: isinstance(x, bool),
+    expected_type=bool
+)
+default_stream_preview_interval = get_config_item_or_set_default(
+    key='default_stream_preview_interval',
+    default_value=250,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+default_preview_every_n_steps = get_config_item_or_set_default(
+    key='default_preview_every_n_steps',
+    default_value=1,
+    validator=lambda x: isinstance(x, int) and x >= 1,
+    expected_type=int
+)
+default_preview_min_interval = get_config_item_or_set_default(
+    key='default_preview_min_interval',
+    default_value=0,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
+default_preview_only_when_watched = get_config_item_or_set_default(
+    key='default_preview_only_when_watched',
+    default_value=True,
+    validator=lambda x: isinstance(x, bool),
+    expected_type=bool
+)
+default_image_save_workers = get_config_item_or_set_default(
+    key='default_image_save_workers',
+    default_value=2,
+    validator=lambda x: isinstance(x, int) and x >= 0,
+    expected_type=int
+)
 checkpoint_downloads = get_config_item_or_set_default(
     key='checkpoint_downloads',
     default_value={},
@@ -9,6 +9,8 @@ import ldm_patched.modules.model_patcher
 import ldm_patched.modules.utils
 import ldm_patched.modules.controlnet
 import modules.sample_hijack
+import modules.model_cache
+import modules.prefetch
 import ldm_patched.modules.samplers
 import ldm_patched.modules.latent_formats
 
@@ -17,7 +19,7 @@ from ldm_patched.contrib.external import VAEDecode, EmptyLatentImage, VAEEncode,
     ControlNetApplyAdvanced
 from ldm_patched.contrib.external_freelunch import FreeU_V2
 from ldm_patched.modules.sample import prepare_mask
-from modules.lora import match_lora
+from modules.lora_cache import stack_key, match_lora_cached
 from modules.util import get_file_from_folder_list
 from ldm_patched.modules.lora import model_lora_keys_unet, model_lora_keys_clip
 from modules.config import path_embeddings
@@ -45,6 +47,7 @@ class StableDiffusionModel:
         self.unet_with_lora = unet
         self.clip_with_lora = clip
         self.visited_loras = ''
+        self.loaded_clip_loras = []
 
         self.lora_key_map_unet = {}
         self.lora_key_map_clip = {}
@@ -92,10 +95,13 @@ class StableDiffusionModel:
         self.unet_with_lora = self.unet.clone() if self.unet is not None else None
         self.clip_with_lora = self.clip.clone() if self.clip is not None else None
 
+        loaded_unet_loras = []
+        loaded_clip_loras = []
+
         for lora_filename, weight in loras_to_load:
-            lora_unmatch = ldm_patched.modules.utils.load_torch_file(lora_filename, safe_load=False)
-            lora_unet, lora_unmatch = match_lora(lora_unmatch, self.lora_key_map_unet)
-            lora_clip, lora_unmatch = match_lora(lora_unmatch, self.lora_key_map_clip)
+            modules.prefetch.wait(lora_filename)
+            lora_unet, lora_clip, lora_unmatch = match_lora_cached(lora_filename, self.filename,
+                                                                   self.lora_key_map_unet, self.lora_key_map_clip)
 
             if len(lora_unmatch) > 12:
                 # model mismatch
@@ -107,6 +113,7 @@ class StableDiffusionModel:
 
             if self.unet_with_lora is not None and len(lora_unet) > 0:
                 loaded_keys = self.unet_with_lora.add_patches(lora_unet, weight)
+                loaded_unet_loras.append((lora_filename, weight))
                 print(f'Loaded LoRA [{lora_filename}] for UNet [{self.filename}] '
                       f'with {len(loaded_keys)} keys at weight {weight}.')
                 for item in lora_unet:
@@ -115,12 +122,21 @@ class StableDiffusionModel:
 
             if self.clip_with_lora is not None and len(lora_clip) > 0:
                 loaded_keys = self.clip_with_lora.add_patches(lora_clip, weight)
+                loaded_clip_loras.append((lora_filename, weight))
                 print(f'Loaded LoRA [{lora_filename}] for CLIP [{self.filename}] '
                       f'with {len(loaded_keys)} keys at weight {weight}.')
                 for item in lora_clip:
                     if item not in loaded_keys:
                         print("CLIP LoRA key skipped: ", item)
 
+        self.loaded_clip_loras = loaded_clip_loras
+
+        # merged weights of this stack can be reused whenever the same stack is loaded again
+        if self.unet_with_lora is not None and len(loaded_unet_loras) > 0:
+            self.unet_with_lora.weight_cache_key = stack_key(self.filename, 'unet', loaded_unet_loras)
+        if self.clip_with_lora is not None and len(loaded_clip_loras) > 0:
+            self.clip_with_lora.patcher.weight_cache_key = stack_key(self.filename, 'clip', loaded_clip_loras)
+
 
 @torch.no_grad()
 @torch.inference_mode()
@@ -141,11 +157,51 @@ def apply_controlnet(positive, negative, control_net, image, strength, start_per
         image=image, strength=strength, start_percent=start_percent, end_percent=end_percent)
 
 
+# samplers whose images only depend on their own seed when batched, the deterministic ones and the sde ones drawing
+# from one brownian tree per seed, the others take their noise from the global torch generator
+batch_reproducible_samplers = ['euler', 'heun', 'heunpp2', 'dpm_2', 'lms', 'dpmpp_2m', 'dpmpp_sde', 'dpmpp_sde_gpu',
+                               'dpmpp_2m_sde', 'dpmpp_2m_sde_gpu', 'dpmpp_3m_sde', 'dpmpp_3m_sde_gpu', 'ddim',
+                               'uni_pc', 'uni_pc_bh2']
+
+
+def can_stack_conds(a, b):
+    if len(a) != len(b):
+        return False
+    for (ca, pa), (cb, pb) in zip(a, b):
+        if ca.shape != cb.shape or pa.keys() != pb.keys():
+            return False
+        if 'pooled_output' in pa and pa['pooled_output'].shape != pb['pooled_output'].shape:
+            return False
+    return True
+
+
+@torch.no_grad()
+@torch.inference_mode()
+def stack_conds(conds):
+    # one batch item per cond, so images with different prompts can share a single sampling run
+    results = []
+    for entries in zip(*conds):
+        c = torch.cat([x[0] for x in entries], dim=0)
+        p = dict(entries[0][1])
+        if 'pooled_output' in p:
+            p['pooled_output'] = torch.cat([x[1]['pooled_output'] for x in entries], dim=0)
+        results.append([c, p])
+    return results
+
+
 @torch.no_grad()
 @torch.inference_mode()
-def load_model(ckpt_filename, vae_filename=None):
-    unet, clip, vae, vae_filename, clip_vision = load_checkpoint_guess_config(ckpt_filename, embedding_directory=path_embeddings,
-                                                                vae_filename_param=vae_filename)
+def load_model(ckpt_filename, vae_filename=None, initial_device=None):
+    cached = modules.model_cache.load(ckpt_filename, vae_filename, embedding_directory=path_embeddings,
+                                      initial_device=initial_device)
+    if cached is not None:
+        unet, clip, vae, vae_filename = cached
+        clip_vision = None
+    else:
+        unet, clip, vae, vae_filename, clip_vision = load_checkpoint_guess_config(ckpt_filename, embedding_directory=path_embeddings,
+                                                                    vae_filename_param=vae_filename,
+                                                                    initial_device=initial_device)
+        modules.model_cache.save(ckpt_filename, unet, clip, vae if vae_filename is None else None)
     return StableDiffusionModel(unet=unet, clip=clip, vae=vae, clip_vision=clip_vision, filename=ckpt_filename, vae_filename=vae_filename)
 
 
@@ -265,7 +321,8 @@ def get_previewer(model):
 def ksampler(model, positive, negative, latent, seed=None, steps=30, cfg=7.0, sampler_name='dpmpp_2m_sde_gpu',
              scheduler='karras', denoise=1.0, disable_noise=False, start_step=None, last_step=None,
              force_full_denoise=False, callback_function=None, refiner=None, refiner_switch=-1,
-             previewer_start=None, previewer_end=None, sigmas=None, noise_mean=None, disable_preview=False):
+             previewer_start=None, previewer_end=None, sigmas=None, noise_mean=None, disable_preview=False,
+             preview_policy=None):
 
     if sigmas is not None:
         sigmas = sigmas.clone().to(ldm_patched.modules.model_management.get_torch_device())
@@ -274,6 +331,11 @@ def ksampler(model, positive, negative, latent, seed=None, steps=30, cfg=7.0, sa
 
     if disable_noise:
         noise = torch.zeros(latent_image.size(), dtype=latent_image.dtype, layout=latent_image.layout, device="cpu")
+    elif isinstance(seed, list):
+        # each batch item gets the noise of its own seed, same as sampling the images one by one, the seed list
+        # also reaches the sampler so that sde samplers use one brownian tree per seed
+        noise = torch.cat([ldm_patched.modules.sample.prepare_noise(latent_image[i:i + 1], s)
+                           for i, s in enumerate(seed)], dim=0)
     else:
         batch_inds = latent["batch_index"] if "batch_index" in latent else None
         noise = ldm_patched.modules.sample.prepare_noise(latent_image, seed, batch_inds)
@@ -296,7 +358,8 @@ def ksampler(model, positive, negative, latent, seed=None, steps=30, cfg=7.0, sa
     def callback(step, x0, x, total_steps):
         ldm_patched.modules.model_management.throw_exception_if_processing_interrupted()
         y = None
-        if previewer is not None and not disable_preview:
+        if previewer is not None and not disable_preview and \
+                (preview_policy is None or preview_policy.should_preview(previewer_start + step, previewer_end)):
             y = previewer(x0, previewer_start + step, previewer_end)
         if callback_function is not None:
             callback_function(previewer_start + step, x0, x, previewer_end, y)
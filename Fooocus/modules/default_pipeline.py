@@ -1,8 +1,14 @@
 import modules.core as core
 import os
+import threading
+import time
+import psutil
 import torch
 import modules.patch
 import modules.config
+import modules.cond_cache
+import modules.model_pool
+import modules.prefetch
 import modules.flags
 import ldm_patched.modules.model_management
 import ldm_patched.modules.latent_formats
@@ -27,6 +33,16 @@ final_refiner_vae = None
 
 loaded_ControlNets = {}
 
+refresh_fingerprint = None
+refresh_fast_path_hits = 0
+
+model_pool = modules.model_pool.ModelPool(modules.model_pool.default_budget(modules.config.default_model_pool_budget))
+
+lookahead_thread = None
+lookahead_keys = set()
+lookahead_seconds = {}
+lookahead_hidden_seconds = 0.0
+
 
 @torch.no_grad()
 @torch.inference_mode()
@@ -57,23 +73,71 @@ def assert_model_integrity():
     return True
 
 
-@torch.no_grad()
-@torch.inference_mode()
-def refresh_base_model(name, vae_name=None):
-    global model_base
-
+def base_model_key(name, vae_name=None):
     filename = get_file_from_folder_list(name, modules.config.paths_checkpoints)
 
     vae_filename = None
     if vae_name is not None and vae_name != modules.flags.default_vae:
         vae_filename = get_file_from_folder_list(vae_name, modules.config.path_vae)
 
-    if model_base.filename == filename and model_base.vae_filename == vae_filename:
+    return 'base', filename, vae_filename
+
+
+def refiner_model_key(name):
+    return 'refiner', get_file_from_folder_list(name, modules.config.paths_checkpoints)
+
+
+@torch.no_grad()
+@torch.inference_mode()
+def load_pool_model(key, initial_device=None):
+    """Loads the base or refiner model described by a pool key, the refiner without the parts it does not use."""
+    for filename in key[1:]:
+        if filename is not None:
+            modules.prefetch.wait(filename)
+
+    if key[0] == 'base':
+        return core.load_model(key[1], key[2], initial_device=initial_device)
+
+    model = core.load_model(key[1], initial_device=initial_device)
+    model.clip = None
+    if isinstance(model.unet.model, (SDXL, SDXLRefiner)):
+        model.vae = None
+    return model
+
+
+def pool_model(key):
+    """Model of the pool for key, waits for the lookahead thread when it is loading that key."""
+    global lookahead_hidden_seconds
+
+    if key in lookahead_keys and lookahead_thread is not None:
+        lookahead_thread.join()
+
+    model = model_pool.get(key)
+    if model is not None and key in lookahead_seconds:
+        lookahead_hidden_seconds += lookahead_seconds.pop(key)
+    return model
+
+
+@torch.no_grad()
+@torch.inference_mode()
+def refresh_base_model(name, vae_name=None):
+    global model_base
+
+    key = base_model_key(name, vae_name)
+    if (model_base.filename, model_base.vae_filename) == key[1:]:
+        return
+
+    model = pool_model(key)
+    if model is not None:
+        model_base = model
+        print(f'Base model restored from pool: {model_base.filename}')
         return
 
-    model_base = core.load_model(filename, vae_filename)
+    model_base = load_pool_model(key)
     print(f'Base model loaded: {model_base.filename}')
     print(f'VAE loaded: {model_base.vae_filename}')
+    if model_pool.put(key, model_base, modules.model_pool.model_size(model_base), keep=[model_refiner]) > 0:
+        ldm_patched.modules.model_management.cleanup_models()
     return
 
 
@@ -82,9 +146,8 @@ def refresh_base_model(name, vae_name=None):
 def refresh_refiner_model(name):
     global model_refiner
 
-    filename = get_file_from_folder_list(name, modules.config.paths_checkpoints)
-
-    if model_refiner.filename == filename:
+    key = refiner_model_key(name)
+    if model_refiner.filename == key[1]:
         return
 
     model_refiner = core.StableDiffusionModel()
@@ -93,21 +156,75 @@ def refresh_refiner_model(name):
         print(f'Refiner unloaded.')
         return
 
-    model_refiner = core.load_model(filename)
-    print(f'Refiner model loaded: {model_refiner.filename}')
+    model = pool_model(key)
+    if model is not None:
+        model_refiner = model
+        print(f'Refiner model restored from pool: {model_refiner.filename}')
+        return
 
-    if isinstance(model_refiner.unet.model, SDXL):
-        model_refiner.clip = None
-        model_refiner.vae = None
-    elif isinstance(model_refiner.unet.model, SDXLRefiner):
-        model_refiner.clip = None
-        model_refiner.vae = None
-    else:
-        model_refiner.clip = None
+    model_refiner = load_pool_model(key)
+    print(f'Refiner model loaded: {model_refiner.filename}')
 
+    if model_pool.put(key, model_refiner, modules.model_pool.model_size(model_refiner), keep=[model_base]) > 0:
+        ldm_patched.modules.model_management.cleanup_models()
     return
 
 
+def lookahead_fits(filename):
+    size = os.path.getsize(filename)
+    return model_pool.total_size() + size <= model_pool.budget and psutil.virtual_memory().available > size * 2
+
+
+@torch.no_grad()
+@torch.inference_mode()
+def run_lookahead(keys):
+    for key in keys:
+        started = time.perf_counter()
+        try:
+            model = load_pool_model(key, initial_device=torch.device('cpu'))
+        except Exception as e:
+            print(f'[Lookahead] Loading {key[1]} failed: {e}')
+            lookahead_keys.discard(key)
+            continue
+        lookahead_seconds[key] = time.perf_counter() - started
+        # evicted models are cleaned up by the worker on its next load
+        model_pool.put(key, model, modules.model_pool.model_size(model), keep=[model_base, model_refiner])
+        lookahead_keys.discard(key)
+        print(f'[Lookahead] Loaded {key[1]} in {lookahead_seconds[key]:.2f} seconds')
+
+
+def start_lookahead(async_task):
+    """Loads the checkpoints of the next queued task into the model pool on a background thread while the
+    current task is sampling, as long as they fit in the pool budget and free RAM."""
+    global lookahead_thread
+
+    if not modules.config.default_lookahead_loading or async_task is None or len(async_task.args) == 0:
+        return
+    if lookahead_thread is not None and lookahead_thread.is_alive():
+        return
+
+    keys = [base_model_key(async_task.base_model_name, async_task.vae_name)]
+    if async_task.refiner_model_name != 'None':
+        keys.append(refiner_model_key(async_task.refiner_model_name))
+
+    current = [('base', model_base.filename, model_base.vae_filename), ('refiner', model_refiner.filename)]
+    keys = [key for key in keys if key not in current and model_pool.get(key) is None
+            and os.path.isfile(key[1]) and lookahead_fits(key[1])]
+    if len(keys) == 0:
+        return
+
+    lookahead_keys.update(keys)
+    lookahead_thread = threading.Thread(target=run_lookahead, args=(keys,), daemon=True)
+    lookahead_thread.start()
+
+
+def take_lookahead_hidden_seconds():
+    global lookahead_hidden_seconds
+    seconds = lookahead_hidden_seconds
+    lookahead_hidden_seconds = 0.0
+    return seconds
+
+
 @torch.no_grad()
 @torch.inference_mode()
 def synthesize_refiner_model():
@@ -145,17 +262,7 @@ def refresh_loras(loras, base_model_additional_loras=None):
 @torch.no_grad()
 @torch.inference_mode()
 def clip_encode_single(clip, text, verbose=False):
-    cached = clip.fcs_cond_cache.get(text, None)
-    if cached is not None:
-        if verbose:
-            print(f'[CLIP Cached] {text}')
-        return cached
-    tokens = clip.tokenize(text)
-    result = clip.encode_from_tokens(tokens, return_pooled=True)
-    clip.fcs_cond_cache[text] = result
-    if verbose:
-        print(f'[CLIP Encoded] {text}')
-    return result
+    return modules.cond_cache.encode(clip, text, verbose=verbose)
 
 
 @torch.no_grad()
@@ -215,7 +322,7 @@ def set_clip_skip(clip_skip: int):
 @torch.no_grad()
 @torch.inference_mode()
 def clear_all_caches():
-    final_clip.fcs_cond_cache = {}
+    modules.cond_cache.cond_cache.clear()
 
 
 @torch.no_grad()
@@ -233,7 +340,24 @@ def prepare_text_encoder(async_call=True):
 @torch.inference_mode()
 def refresh_everything(refiner_model_name, base_model_name, loras,
                        base_model_additional_loras=None, use_synthetic_refiner=False, vae_name=None):
-    global final_unet, final_clip, final_vae, final_refiner_unet, final_refiner_vae, final_expansion
+    global final_unet, final_clip, final_vae, final_refiner_unet, final_refiner_vae, final_expansion, \
+        refresh_fingerprint, refresh_fast_path_hits
+
+    fingerprint = str((refiner_model_name, base_model_name, loras, base_model_additional_loras,
+                       use_synthetic_refiner, vae_name))
+
+    if fingerprint == refresh_fingerprint:
+        # same models and LoRAs as last time, only undo the per-task patches on the final models
+        refresh_fast_path_hits += 1
+        final_unet = model_base.unet_with_lora
+        final_clip = model_base.clip_with_lora
+        final_vae = model_base.vae
+        final_refiner_unet = model_refiner.unet_with_lora
+        final_refiner_vae = model_refiner.vae
+        print(f'[Models] Unchanged, skipped refresh ({refresh_fast_path_hits} times).')
+        return
+
+    refresh_fingerprint = None
 
     final_unet = None
     final_clip = None
@@ -262,8 +386,11 @@ def refresh_everything(refiner_model_name, base_model_name, loras,
     if final_expansion is None:
         final_expansion = FooocusExpansion()
 
+    # conds stay cached across refreshes, the key includes the checkpoint and LoRA stack of the CLIP
+    final_clip.fcs_cond_identity = modules.cond_cache.clip_identity(model_base.filename, model_base.loaded_clip_loras)
+
     prepare_text_encoder(async_call=True)
-    clear_all_caches()
+    refresh_fingerprint = fingerprint
     return
 
 
@@ -331,9 +458,29 @@ def get_candidate_vae(steps, switch, denoise=1.0, refiner_swap_method='joint'):
     return final_vae, final_refiner_vae
 
 
+def get_image_batch_size(width, height, image_number, sampler_name):
+    max_batch_size = min(image_number, modules.config.default_max_image_batch_size)
+    if max_batch_size <= 1 or final_unet is None or sampler_name not in core.batch_reproducible_samplers:
+        return 1
+
+    model_management = ldm_patched.modules.model_management
+    free_memory = model_management.get_free_memory(model_management.get_torch_device())
+    free_memory -= model_management.minimum_inference_memory()
+
+    for unet in [final_unet, final_refiner_unet]:
+        if unet is not None and not any(m.model is unet for m in model_management.current_loaded_models):
+            free_memory -= unet.model_size()
+
+    # cond and uncond of every image go through the unet together
+    memory_per_image = final_unet.model.memory_required([2, 4, height // 8, width // 8])
+    batch_size = max(1, min(max_batch_size, int(free_memory // memory_per_image)))
+    print(f'[Sampler] image batch size = {batch_size}, free memory = {free_memory / (1024 * 1024):.0f} MB')
+    return batch_size
+
+
 @torch.no_grad()
 @torch.inference_mode()
-def process_diffusion(positive_cond, negative_cond, steps, switch, width, height, image_seed, callback, sampler_name, scheduler_name, latent=None, denoise=1.0, tiled=False, cfg_scale=7.0, refiner_swap_method='joint', disable_preview=False):
+def process_diffusion(positive_cond, negative_cond, steps, switch, width, height, image_seed, callback, sampler_name, scheduler_name, latent=None, denoise=1.0, tiled=False, cfg_scale=7.0, refiner_swap_method='joint', disable_preview=False, preview_policy=None):
     target_unet, target_vae, target_refiner_unet, target_refiner_vae, target_clip \
         = final_unet, final_vae, final_refiner_unet, final_refiner_vae, final_clip
 
@@ -358,8 +505,14 @@ def process_diffusion(positive_cond, negative_cond, steps, switch, width, height
 
     print(f'[Sampler] refiner_swap_method = {refiner_swap_method}')
 
+    # a list of seeds samples one image per seed in a single batch
+    batch_size = len(image_seed) if isinstance(image_seed, list) else 1
+
     if latent is None:
-        initial_latent = core.generate_empty_latent(width=width, height=height, batch_size=1)
+        initial_latent = core.generate_empty_latent(width=width, height=height, batch_size=batch_size)
+    elif latent['samples'].shape[0] != batch_size:
+        initial_latent = latent.copy()
+        initial_latent['samples'] = latent['samples'].repeat(batch_size, 1, 1, 1)
     else:
         initial_latent = latent
 
@@ -392,7 +545,8 @@ def process_diffusion(positive_cond, negative_cond, steps, switch, width, height
             refiner_switch=switch,
             previewer_start=0,
             previewer_end=steps,
-            disable_preview=disable_preview
+            disable_preview=disable_preview,
+            preview_policy=preview_policy
         )
         decoded_latent = core.decode_vae(vae=target_vae, latent_image=sampled_latent, tiled=tiled)
 
@@ -411,7 +565,8 @@ def process_diffusion(positive_cond, negative_cond, steps, switch, width, height
             scheduler=scheduler_name,
             previewer_start=0,
             previewer_end=steps,
-            disable_preview=disable_preview
+            disable_preview=disable_preview,
+            preview_policy=preview_policy
         )
         print('Refiner swapped by changing ksampler. Noise preserved.')
 
@@ -434,7 +589,8 @@ def process_diffusion(positive_cond, negative_cond, steps, switch, width, height
             scheduler=scheduler_name,
             previewer_start=switch,
             previewer_end=steps,
-            disable_preview=disable_preview
+            disable_preview=disable_preview,
+            preview_policy=preview_policy
         )
 
         target_model = target_refiner_vae
@@ -462,7 +618,8 @@ def process_diffusion(positive_cond, negative_cond, steps, switch, width, height
             scheduler=scheduler_name,
             previewer_start=0,
             previewer_end=steps,
-            disable_preview=disable_preview
+            disable_preview=disable_preview,
+            preview_policy=preview_policy
         )
         print('Fooocus VAE-based swap.')
 
@@ -492,7 +649,7 @@ def process_diffusion(positive_cond, negative_cond, steps, switch, width, height
             negative=clip_separate(negative_cond, target_model=target_model.model, target_clip=target_clip),
             latent=sampled_latent,
             steps=len_sigmas, start_step=0, last_step=len_sigmas, disable_noise=False, force_full_denoise=True,
-            seed=image_seed+1,
+            seed=[seed + 1 for seed in image_seed] if isinstance(image_seed, list) else image_seed + 1,
             denoise=denoise,
             callback_function=callback,
             cfg=cfg_scale,
@@ -502,7 +659,8 @@ def process_diffusion(positive_cond, negative_cond, steps, switch, width, height
             previewer_end=steps,
             sigmas=sigmas,
             noise_mean=noise_mean,
-            disable_preview=disable_preview
+            disable_preview=disable_preview,
+            preview_policy=preview_policy
         )
 
         target_model = target_refiner_vae
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import safetensors.torch
+
+import modules.config
+
+
+class EmbeddingCache:
+    """LRU cache of IP-Adapter (cond, uncond) K/V lists, optionally backed by a directory of safetensors files."""
+
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(img, adapter_filename, crop):
+        img = np.ascontiguousarray(img)
+        size = os.path.getsize(adapter_filename) if os.path.exists(adapter_filename) else 0
+        h = hashlib.sha256(f'{os.path.basename(adapter_filename)}:{size}:{crop}:{img.shape}:{img.dtype}\n'.encode('utf-8'))
+        h.update(img.data)
+        return h.hexdigest()
+
+    def get(self, key):
+        if self.capacity <= 0:
+            return None
+
+        with self.lock:
+            result = self.entries.get(key, None)
+            if result is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+
+        result = self.load_from_disk(key)
+
+        with self.lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.insert(key, result)
+        return result
+
+    def put(self, key, ip_conds, ip_unconds):
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            self.insert(key, (ip_conds, ip_unconds))
+        self.save_to_disk(key, ip_conds, ip_unconds)
+
+    def insert(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return dict(entries=len(self.entries), hits=self.hits, disk_hits=self.disk_hits, misses=self.misses)
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], f'{key}.safetensors')
+
+    def load_from_disk(self, key):
+        if self.path is None:
+            return None
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            tensors = safetensors.torch.load_file(filename)
+            ip_conds = [tensors[f'cond.{i}'] for i in range(len(tensors) // 2)]
+            ip_unconds = [tensors[f'uncond.{i}'] for i in range(len(tensors) // 2)]
+            return ip_conds, ip_unconds
+        except Exception as e:
+            print(f'[Embedding Cache] Loading {filename} failed: {e}')
+            return None
+
+    def save_to_disk(self, key, ip_conds, ip_unconds):
+        if self.path is None:
+            return
+        filename = self.filename(key)
+        if os.path.exists(filename):
+            return
+        try:
+            tensors = {f'cond.{i}': t.contiguous() for i, t in enumerate(ip_conds)}
+            tensors.update({f'uncond.{i}': t.contiguous() for i, t in enumerate(ip_unconds)})
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            temp_filename = f'{filename}.{os.getpid()}.tmp'
+            safetensors.torch.save_file(tensors, temp_filename)
+            os.replace(temp_filename, filename)
+        except Exception as e:
+            print(f'[Embedding Cache] Saving {filename} failed: {e}')
+
+
+embedding_cache = EmbeddingCache(modules.config.default_ip_embedding_cache_size,
+                                 modules.config.ip_embedding_cache_path if modules.config.ip_embedding_cache_path not in ['', 'None'] else None)
@@ -118,6 +118,9 @@ metadata_scheme = [
 ]
 
 
+result_deliveries = ['path', 'bytes', 'array']
+
+
 class OutputFormat(Enum):
     PNG = 'png'
     JPEG = 'jpeg'
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import random
+from dataclasses import dataclass, field, fields, MISSING
+
+import numpy as np
+
+import args_manager
+import modules.config
+import modules.constants as constants
+import modules.flags as flags
+
+
+def config_default(name, copy=False):
+    """Field whose default is read from modules.config when the request is created, not when it is defined."""
+    if copy:
+        return field(default_factory=lambda: list(getattr(modules.config, name)))
+    return field(default_factory=lambda: getattr(modules.config, name))
+
+
+def random_seed():
+    return random.randint(constants.MIN_SEED, constants.MAX_SEED)
+
+
+@dataclass(slots=True)
+class ImagePrompt:
+    image: np.ndarray = None
+    stop_at: float = flags.default_parameters[flags.default_ip][0]
+    weight: float = flags.default_parameters[flags.default_ip][1]
+    type: str = flags.default_ip
+
+    def to_ctrls(self) -> list:
+        return [self.image, self.stop_at, self.weight, self.type]
+
+
+@dataclass(slots=True)
+class EnhanceTab:
+    enabled: bool = False
+    mask_dino_prompt_text: str = ''
+    prompt: str = ''
+    negative_prompt: str = ''
+    mask_model: str = config_default('default_enhance_inpaint_mask_model')
+    mask_cloth_category: str = config_default('default_inpaint_mask_cloth_category')
+    mask_sam_model: str = config_default('default_inpaint_mask_sam_model')
+    mask_text_threshold: float = 0.25
+    mask_box_threshold: float = 0.3
+    mask_sam_max_detections: int = config_default('default_sam_max_detections')
+    inpaint_disable_initial_latent: bool = False
+    inpaint_engine: str = config_default('default_inpaint_engine_version')
+    inpaint_strength: float = 1.0
+    inpaint_respective_field: float = 0.618
+    inpaint_erode_or_dilate: int = 0
+    mask_invert: bool = False
+
+    def to_ctrls(self) -> list:
+        return [getattr(self, f.name) for f in fields(self)]
+
+
+@dataclass(slots=True)
+class GenerationRequest:
+    """
+    Keyword based alternative to the positional ctrls list of the webui, see AsyncTask.from_request.
+    Fields are declared in the same order AsyncTask consumes them, to_ctrls() relies on it.
+    """
+    generate_image_grid: bool = False
+    prompt: str = config_default('default_prompt')
+    negative_prompt: str = config_default('default_prompt_negative')
+    style_selections: list = config_default('default_styles', copy=True)
+    performance_selection: str = config_default('default_performance')
+    aspect_ratios_selection: str = config_default('default_aspect_ratio')
+    image_number: int = config_default('default_image_number')
+    output_format: str = config_default('default_output_format')
+    seed: int = field(default_factory=random_seed)
+    read_wildcards_in_order: bool = False
+    sharpness: float = config_default('default_sample_sharpness')
+    cfg_scale: float = config_default('default_cfg_scale')
+    base_model_name: str = config_default('default_base_model_name')
+    refiner_model_name: str = config_default('default_refiner_model_name')
+    refiner_switch: float = config_default('default_refiner_switch')
+    loras: list = config_default('default_loras', copy=True)
+    input_image_checkbox: bool = False
+    current_tab: str = 'uov'
+    uov_method: str = config_default('default_uov_method')
+    uov_input_image: np.ndarray = None
+    outpaint_selections: list = field(default_factory=list)
+    inpaint_input_image: dict = None
+    inpaint_additional_prompt: str = ''
+    inpaint_mask_image_upload: np.ndarray = None
+    disable_preview: bool = config_default('default_black_out_nsfw')
+    disable_intermediate_results: bool = False
+    disable_seed_increment: bool = False
+    black_out_nsfw: bool = config_default('default_black_out_nsfw')
+    adm_scaler_positive: float = 1.5
+    adm_scaler_negative: float = 0.8
+    adm_scaler_end: float = 0.3
+    adaptive_cfg: float = config_default('default_cfg_tsnr')
+    clip_skip: int = config_default('default_clip_skip')
+    sampler_name: str = config_default('default_sampler')
+    scheduler_name: str = config_default('default_scheduler')
+    vae_name: str = config_default('default_vae')
+    overwrite_step: int = config_default('default_overwrite_step')
+    overwrite_switch: float = config_default('default_overwrite_switch')
+    overwrite_width: int = -1
+    overwrite_height: int = -1
+    overwrite_vary_strength: float = -1
+    overwrite_upscale_strength: float = config_default('default_overwrite_upscale')
+    mixing_image_prompt_and_vary_upscale: bool = False
+    mixing_image_prompt_and_inpaint: bool = False
+    debugging_cn_preprocessor: bool = False
+    skipping_cn_preprocessor: bool = False
+    canny_low_threshold: int = 64
+    canny_high_threshold: int = 128
+    refiner_swap_method: str = flags.refiner_swap_method
+    controlnet_softness: float = 0.25
+    freeu_enabled: bool = False
+    freeu_b1: float = 1.01
+    freeu_b2: float = 1.02
+    freeu_s1: float = 0.99
+    freeu_s2: float = 0.95
+    debugging_inpaint_preprocessor: bool = False
+    inpaint_disable_initial_latent: bool = False
+    inpaint_engine: str = config_default('default_inpaint_engine_version')
+    inpaint_strength: float = 1.0
+    inpaint_respective_field: float = 0.618
+    inpaint_advanced_masking_checkbox: bool = config_default('default_inpaint_advanced_masking_checkbox')
+    invert_mask_checkbox: bool = config_default('default_invert_mask_checkbox')
+    inpaint_erode_or_dilate: int = 0
+    save_final_enhanced_image_only: bool = config_default('default_save_only_final_enhanced_image')
+    save_metadata_to_images: bool = config_default('default_save_metadata_to_images')
+    metadata_scheme: str = config_default('default_metadata_scheme')
+    image_prompts: list = field(default_factory=list)
+    debugging_dino: bool = False
+    dino_erode_or_dilate: int = 0
+    debugging_enhance_masks_checkbox: bool = False
+    enhance_input_image: np.ndarray = None
+    enhance_checkbox: bool = config_default('default_enhance_checkbox')
+    enhance_uov_method: str = config_default('default_enhance_uov_method')
+    enhance_uov_processing_order: str = config_default('default_enhance_uov_processing_order')
+    enhance_uov_prompt_type: str = config_default('default_enhance_uov_prompt_type')
+    enhance_tabs: list = field(default_factory=list)
+
+    def __post_init__(self):
+        if int(self.seed) < constants.MIN_SEED or int(self.seed) > constants.MAX_SEED:
+            self.seed = random_seed()
+        self.aspect_ratios_selection = self.aspect_ratios_selection.replace('*', '×')
+        self.loras = [(True, *lora) if len(lora) == 2 else tuple(lora) for lora in self.loras]
+        self.image_prompts = [ip if isinstance(ip, ImagePrompt) else ImagePrompt(**ip) for ip in self.image_prompts]
+        self.enhance_tabs = [t if isinstance(t, EnhanceTab) else EnhanceTab(**t) for t in self.enhance_tabs]
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        names = {f.name for f in fields(cls)}
+        unknown = sorted(set(data.keys()) - names)
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown generation request fields: {", ".join(unknown)}')
+        return cls(**data)
+
+    def validate(self):
+        errors = []
+
+        def check(condition, message):
+            if not condition:
+                errors.append(message)
+
+        check(self.performance_selection in flags.Performance.values(),
+              f'performance_selection must be one of {flags.Performance.values()}')
+        check(self.output_format in flags.OutputFormat.list(), f'output_format must be one of {flags.OutputFormat.list()}')
+        check(self.sampler_name in flags.sampler_list, f'unknown sampler_name {self.sampler_name}')
+        check(self.scheduler_name in flags.scheduler_list, f'unknown scheduler_name {self.scheduler_name}')
+        check(self.uov_method in flags.uov_list, f'uov_method must be one of {flags.uov_list}')
+        check(self.enhance_uov_method in flags.uov_list, f'enhance_uov_method must be one of {flags.uov_list}')
+        check(self.refiner_swap_method in ['joint', 'separate', 'vae'], 'refiner_swap_method must be joint, separate or vae')
+        check(self.metadata_scheme in [m.value for m in flags.MetadataScheme], 'unknown metadata_scheme')
+        check(1 <= int(self.image_number), 'image_number must be at least 1')
+        check(1 <= int(self.clip_skip) <= flags.clip_skip_max, f'clip_skip must be between 1 and {flags.clip_skip_max}')
+        check(0.1 <= float(self.refiner_switch) <= 1.0, 'refiner_switch must be between 0.1 and 1.0')
+        try:
+            width, height = self.aspect_ratios_selection.replace('×', ' ').split(' ')[:2]
+            check(int(width) > 0 and int(height) > 0, 'aspect_ratios_selection must be positive')
+        except ValueError:
+            errors.append('aspect_ratios_selection must look like 1152×896')
+        check(len(self.loras) <= modules.config.default_max_lora_number,
+              f'at most {modules.config.default_max_lora_number} loras are supported')
+        check(all(len(lora) == 3 for lora in self.loras), 'loras must be (enabled, filename, weight)')
+        check(len(self.image_prompts) <= modules.config.default_controlnet_image_count,
+              f'at most {modules.config.default_controlnet_image_count} image prompts are supported')
+        check(all(ip.type in flags.ip_list for ip in self.image_prompts), f'image prompt type must be one of {flags.ip_list}')
+        check(len(self.enhance_tabs) <= modules.config.default_enhance_tabs,
+              f'at most {modules.config.default_enhance_tabs} enhance tabs are supported')
+
+        if len(errors) > 0:
+            raise ValueError('Invalid generation request: ' + '; '.join(errors))
+        return self
+
+    def to_ctrls(self) -> list:
+        """Positional args in the order AsyncTask pops them, the webui builds the same list from its ctrls."""
+        ctrls = []
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if f.name == 'loras':
+                value = value + [(False, 'None', 1.0)] * (modules.config.default_max_lora_number - len(value))
+                ctrls += [x for lora in value for x in lora]
+            elif f.name == 'image_prompts':
+                value = value + [ImagePrompt() for _ in range(modules.config.default_controlnet_image_count - len(value))]
+                ctrls += [x for ip in value for x in ip.to_ctrls()]
+            elif f.name == 'enhance_tabs':
+                value = value + [EnhanceTab() for _ in range(modules.config.default_enhance_tabs - len(value))]
+                ctrls += [x for tab in value for x in tab.to_ctrls()]
+            elif f.name == 'save_final_enhanced_image_only':
+                if not args_manager.args.disable_image_log:
+                    ctrls.append(value)
+            elif f.name in ['save_metadata_to_images', 'metadata_scheme']:
+                if not args_manager.args.disable_metadata:
+                    ctrls.append(value)
+            elif isinstance(value, list):
+                ctrls.append(value.copy())
+            else:
+                ctrls.append(value)
+        return ctrls
+
+    def fingerprint(self) -> str:
+        """sha256 over all parameters, images are included by content. Equal fingerprints produce equal outputs."""
+        def encode(value):
+            if isinstance(value, np.ndarray):
+                return {'ndarray': hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest(),
+                        'shape': list(value.shape), 'dtype': str(value.dtype)}
+            if isinstance(value, dict):
+                return {k: encode(v) for k, v in sorted(value.items())}
+            if isinstance(value, (list, tuple)):
+                return [encode(v) for v in value]
+            if isinstance(value, (ImagePrompt, EnhanceTab)):
+                return {f.name: encode(getattr(value, f.name)) for f in fields(value)}
+            if isinstance(value, np.generic):
+                return value.item()
+            return value
+
+        data = {f.name: encode(getattr(self, f.name)) for f in fields(self)}
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+json_types = {bool: 'boolean', int: 'integer', float: 'number', str: 'string', list: 'array', dict: 'object'}
+
+json_enums = {
+    'performance_selection': flags.Performance.values(),
+    'output_format': flags.OutputFormat.list(),
+    'sampler_name': flags.sampler_list,
+    'scheduler_name': flags.scheduler_list,
+    'uov_method': flags.uov_list,
+    'enhance_uov_method': flags.uov_list,
+    'enhance_uov_processing_order': flags.enhancement_uov_processing_order,
+    'enhance_uov_prompt_type': flags.enhancement_uov_prompt_types,
+    'refiner_swap_method': ['joint', 'separate', 'vae'],
+    'metadata_scheme': [m.value for m in flags.MetadataScheme],
+    'type': flags.ip_list,
+    'mask_model': flags.inpaint_mask_models,
+    'mask_cloth_category': flags.inpaint_mask_cloth_category,
+    'mask_sam_model': flags.inpaint_mask_sam_model,
+    'inpaint_engine': flags.inpaint_engine_versions,
+}
+
+
+def dataclass_json_schema(cls) -> dict:
+    properties = {}
+    for f in fields(cls):
+        if f.type is np.ndarray or f.name == 'inpaint_input_image':
+            # images can only be passed from python
+            properties[f.name] = {'type': 'null', 'description': 'numpy image, not available through JSON'}
+            continue
+        prop = {'type': json_types[f.type]}
+        if f.name in json_enums:
+            prop['enum'] = json_enums[f.name]
+        if f.name == 'loras':
+            prop['items'] = {'type': 'array', 'minItems': 2, 'maxItems': 3,
+                             'description': '[enabled, filename, weight] or [filename, weight]'}
+            prop['maxItems'] = modules.config.default_max_lora_number
+        elif f.name == 'image_prompts':
+            prop['items'] = dataclass_json_schema(ImagePrompt)
+            prop['maxItems'] = modules.config.default_controlnet_image_count
+        elif f.name == 'enhance_tabs':
+            prop['items'] = dataclass_json_schema(EnhanceTab)
+            prop['maxItems'] = modules.config.default_enhance_tabs
+        elif f.name in ['style_selections', 'outpaint_selections']:
+            prop['items'] = {'type': 'string'}
+        if f.name != 'seed':
+            if f.default is not MISSING:
+                prop['default'] = f.default
+            elif f.default_factory is not MISSING:
+                prop['default'] = f.default_factory()
+        properties[f.name] = prop
+    return {'type': 'object', 'title': cls.__name__, 'properties': properties, 'additionalProperties': False}
+
+
+def json_schema() -> dict:
+    schema = dataclass_json_schema(GenerationRequest)
+    schema['$schema'] = 'https://json-schema.org/draft/2020-12/schema'
+    return schema
@@ -0,0 +1,52 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import modules.config
+
+
+class HintCache:
+    """LRU cache of preprocessed ControlNet hint images keyed by source image content and preprocessing parameters."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(img, preprocessor, width, height, parameters=()):
+        img = np.ascontiguousarray(img)
+        h = hashlib.sha256(f'{preprocessor}:{width}:{height}:{parameters}:{img.shape}:{img.dtype}\n'.encode('utf-8'))
+        h.update(img.data)
+        return h.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            hint = self.entries.get(key, None)
+            if hint is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return hint
+
+    def put(self, key, hint):
+        if self.capacity <= 0:
+            return
+        # shared between tasks, nobody may write into it
+        hint.flags.writeable = False
+        with self.lock:
+            self.entries[key] = hint
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return dict(entries=len(self.entries), hits=self.hits, misses=self.misses)
+
+
+hint_cache = HintCache(modules.config.default_cn_hint_cache_size)
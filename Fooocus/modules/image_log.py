@@ -0,0 +1,212 @@
+import json
+import os
+import re
+import urllib.parse
+
+VIEWER_PREFIX = '<!--fooocus-log-viewer'
+VIEWER_MARK = '<!--fooocus-log-viewer-2-->'
+LEGACY_SPLIT = '<!--fooocus-log-split-->'
+PAGE_SIZE = 50
+
+css_styles = (
+    "<style>"
+    "body { background-color: #121212; color: #E0E0E0; } "
+    "a { color: #BB86FC; } "
+    ".metadata { border-collapse: collapse; width: 100%; } "
+    ".metadata .label { width: 15%; } "
+    ".metadata .value { width: 85%; font-weight: bold; } "
+    ".metadata th, .metadata td { border: 1px solid #4d4d4d; padding: 4px; } "
+    ".image-container img { height: auto; max-width: 512px; display: block; padding-right:10px; } "
+    ".image-container div { text-align: center; padding: 4px; } "
+    "hr { border-color: gray; } "
+    "button { background-color: black; color: white; border: 1px solid grey; border-radius: 5px; padding: 5px 10px; text-align: center; display: inline-block; font-size: 16px; cursor: pointer; }"
+    "button:hover {background-color: grey; color: black;}"
+    "</style>"
+)
+
+js = (
+    """<script>
+    function to_clipboard(txt) {
+    txt = decodeURIComponent(txt);
+    if (navigator.clipboard && navigator.permissions) {
+        navigator.clipboard.writeText(txt)
+    } else {
+        const textArea = document.createElement('textArea')
+        textArea.value = txt
+        textArea.style.width = 0
+        textArea.style.position = 'fixed'
+        textArea.style.left = '-999px'
+        textArea.style.top = '10px'
+        textArea.setAttribute('readonly', 'readonly')
+        document.body.appendChild(textArea)
+
+        textArea.select()
+        document.execCommand('copy')
+        document.body.removeChild(textArea)
+    }
+    alert('Copied to Clipboard!\\nPaste to prompt area to load parameters.\\nCurrent clipboard content is:\\n\\n' + txt);
+    }
+
+    function escape_html(txt) {
+        return String(txt).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+    }
+
+    function render_entry(entry) {
+        const name = escape_html(entry.image);
+        let item = `<div class="image-container"><hr><table><tr>`;
+        item += `<td><a href="${name}" target="_blank"><img src="${name}" onerror="this.closest('.image-container').style.display='none';" loading="lazy"/></a><div>${name}</div></td>`;
+        item += `<td><table class='metadata'>`;
+        const parameters = {};
+        for (const [label, key, value] of entry.metadata) {
+            parameters[key] = value;
+            item += `<tr><td class='label'>${escape_html(label)}</td><td class='value'>${escape_html(value).replace(/\\n/g, ' <br> ')}</td></tr>`;
+        }
+        if (entry.positive && entry.negative) {
+            item += `<tr><td class='label'>Full raw prompt</td><td class='value'><details><summary>Positive</summary>${escape_html(entry.positive.join(', '))}</details>`;
+            item += `<details><summary>Negative</summary>${escape_html(entry.negative.join(', '))}</details></td></tr>`;
+        }
+        item += `</table><br><button onclick="to_clipboard('${encodeURIComponent(JSON.stringify(parameters, null, 0)).replace(/'/g, '%27')}')">Copy to Clipboard</button>`;
+        return item + `</td></tr></table></div>`;
+    }
+
+    let log_entries = [];
+    let log_shown = 0;
+
+    function show_more() {
+        const end = Math.min(log_shown + PAGE_SIZE, log_entries.length);
+        let items = '';
+        for (; log_shown < end; log_shown++) {
+            items += render_entry(log_entries[log_entries.length - 1 - log_shown]);
+        }
+        document.getElementById('log').insertAdjacentHTML('beforeend', items);
+        document.getElementById('more').style.display = log_shown < log_entries.length ? 'inline-block' : 'none';
+    }
+
+    // log.js is loaded as a script since browsers refuse fetch() on file:// pages
+    window.addEventListener('load', () => {
+        const script = document.createElement('script');
+        script.src = 'log.js?' + Date.now();
+        script.onload = () => show_more();
+        script.onerror = () => {
+            document.getElementById('log').innerText = 'The log could not be loaded, log.js is missing next to this page.';
+        };
+        document.body.appendChild(script);
+    });
+    </script>"""
+)
+
+
+def viewer_html(date_string):
+    return (f"<!DOCTYPE html><html><head><title>Fooocus Log {date_string}</title>{css_styles}</head><body>"
+            f"{VIEWER_MARK}{js.replace('PAGE_SIZE', str(PAGE_SIZE))}<p>Fooocus Log {date_string} (private)</p>\n"
+            "<p>Metadata is embedded if enabled in the config or developer debug mode. You can find the information "
+            "for each image in line Metadata Scheme.</p>\n"
+            "<div id=\"log\"></div><button id=\"more\" style=\"display: none;\" onclick=\"show_more()\">Show more</button>"
+            "</body></html>")
+
+
+def make_entry(only_name, metadata, task=None):
+    entry = dict(image=only_name, metadata=[[label, key, value] for label, key, value in metadata])
+    if task is not None and 'positive' in task and 'negative' in task:
+        entry['positive'] = list(task['positive'])
+        entry['negative'] = list(task['negative'])
+    return entry
+
+
+def script_name(jsonl_name):
+    return os.path.join(os.path.dirname(jsonl_name), 'log.js')
+
+
+def script_line(entry):
+    return f'log_entries.push({json.dumps(entry, default=str)});\n'
+
+
+def append_entry(jsonl_name, entry):
+    """One line per image in log.jsonl and in the log.js the viewer loads, the files are never rewritten."""
+    with open(jsonl_name, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, default=str) + '\n')
+    with open(script_name(jsonl_name), 'a', encoding='utf-8') as f:
+        f.write(script_line(entry))
+
+
+def read_entries(jsonl_name):
+    entries = []
+    with open(jsonl_name, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+
+def legacy_value(value):
+    return str(value).replace('\n', ' </br> ')
+
+
+def parse_legacy_html(text):
+    """Entries of a log.html written before log.jsonl existed, oldest first."""
+    parts = text.split(LEGACY_SPLIT)
+    middle_part = parts[1] if len(parts) == 3 else parts[0]
+
+    entries = []
+    for item in middle_part.split('class="image-container"')[1:]:
+        image = re.search(r"<img src='([^']*)'", item)
+        clipboard = re.search(r"to_clipboard\('([^']*)'\)", item)
+        if image is None or clipboard is None:
+            continue
+        try:
+            parameters = json.loads(urllib.parse.unquote(clipboard.group(1)))
+        except ValueError:
+            continue
+
+        # rows and clipboard keys do not line up one to one (repeated keys, rows without a key),
+        # so every row takes the first unused key showing the same value
+        metadata = []
+        unused = dict(parameters)
+        rows = re.findall(r"<tr><td class='label'>(.*?)</td><td class='value'>(.*?)</td></tr>", item, re.S)
+        for label, shown in rows:
+            if label == 'Full raw prompt':
+                continue
+            key = next((k for k, v in unused.items() if legacy_value(v) == shown), None)
+            if key is None:
+                metadata.append([label, label.lower().replace(' ', '_'), shown.replace(' </br> ', '\n')])
+                continue
+            metadata.append([label, key, unused.pop(key)])
+        metadata += [[key, key, value] for key, value in unused.items()]
+
+        entry = dict(image=image.group(1), metadata=metadata)
+        prompts = re.findall(r'<details><summary>(?:Positive|Negative)</summary>(.*?)</details>', item, re.S)
+        if len(prompts) == 2:
+            entry['positive'], entry['negative'] = [p.split(', ') if p != '' else [] for p in prompts]
+        entries.append(entry)
+
+    entries.reverse()
+    return entries
+
+
+def ensure_viewer(html_name, jsonl_name, date_string):
+    """Write the log.html viewer of a day and its log.js, a log.html of the old format is migrated to log.jsonl first."""
+    js_name = script_name(jsonl_name)
+    if os.path.exists(html_name):
+        with open(html_name, 'r', encoding='utf-8') as f:
+            text = f.read()
+        if VIEWER_MARK in text and os.path.exists(js_name):
+            return
+        if VIEWER_PREFIX not in text:
+            if not os.path.exists(jsonl_name):
+                entries = parse_legacy_html(text)
+                with open(jsonl_name, 'w', encoding='utf-8') as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry, default=str) + '\n')
+                print(f'[Image Log] Migrated {len(entries)} entries of {html_name}')
+            os.replace(html_name, os.path.join(os.path.dirname(html_name), 'log_legacy.html'))
+
+    if not os.path.exists(js_name):
+        entries = read_entries(jsonl_name) if os.path.exists(jsonl_name) else []
+        with open(js_name, 'w', encoding='utf-8') as f:
+            f.write(''.join(script_line(entry) for entry in entries))
+
+    with open(html_name, 'w', encoding='utf-8') as f:
+        f.write(viewer_html(date_string))
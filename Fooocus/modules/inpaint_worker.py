@@ -1,9 +1,10 @@
+import math
+
 import torch
 import numpy as np
 
-from PIL import Image, ImageFilter
+from PIL import Image
 from modules.util import resample_image, set_image_shape_ceil, get_image_shape_ceil
-from modules.upscaler import perform_upscale
 import cv2
 
 
@@ -22,32 +23,16 @@ class InpaintHead(torch.nn.Module):
 
 current_task = None
 
-
-def box_blur(x, k):
-    x = Image.fromarray(x)
-    x = x.filter(ImageFilter.BoxBlur(k))
-    return np.array(x)
-
-
-def max_filter_opencv(x, ksize=3):
-    # Use OpenCV maximum filter
-    # Make sure the input type is int16
-    return cv2.dilate(x, np.ones((ksize, ksize), dtype=np.int16))
+fill_schedule = [(512, 2), (256, 2), (128, 4), (64, 4), (33, 8), (15, 8), (5, 16), (3, 16)]
+fill_pyramid_scale = 4
+fill_pyramid_min_radius = 64
 
 
 def morphological_open(x):
-    # Convert array to int16 type via threshold operation
-    x_int16 = np.zeros_like(x, dtype=np.int16)
-    x_int16[x > 127] = 256
-
-    for i in range(32):
-        # Use int16 type to avoid overflow
-        maxed = max_filter_opencv(x_int16, ksize=3) - 8
-        x_int16 = np.maximum(maxed, x_int16)
-
-    # Clip negative values to 0 and convert back to uint8 type
-    x_uint8 = np.clip(x_int16, 0, 255).astype(np.uint8)
-    return x_uint8
+    # 32 rounds of max(x, dilate_3x3(x) - 8) from 256 on the mask leave 256 - 8 * d,
+    # d being the chessboard distance to the closest masked pixel
+    distance = cv2.distanceTransform((x <= 127).astype(np.uint8), cv2.DIST_C, 3)
+    return np.clip(256.0 - 8.0 * np.minimum(distance, 32.0), 0, 255).astype(np.uint8)
 
 
 def up255(x, t=0):
@@ -101,6 +86,18 @@ def compute_initial_abcd(x):
     return a, b, c, d
 
 
+def grow_steps(lo, hi, size, target):
+    """Fewest steps growing [lo, hi) by one pixel on each side, clipped to [0, size), to reach a length of target."""
+    length = hi - lo
+    if length >= target:
+        return 0
+    both_sides = min(lo, size - hi)
+    n = math.ceil((target - length) / 2)
+    if n <= both_sides:
+        return n
+    return both_sides + math.ceil(target - length - 2 * both_sides)
+
+
 def solve_abcd(x, a, b, c, d, k):
     k = float(k)
     assert 0.0 <= k <= 1.0
@@ -108,41 +105,62 @@ def solve_abcd(x, a, b, c, d, k):
     H, W = x.shape[:2]
     if k == 1.0:
         return 0, H, 0, W
-    while True:
-        if b - a >= H * k and d - c >= W * k:
-            break
-
-        add_h = (b - a) < (d - c)
-        add_w = not add_h
 
-        if b - a == H:
-            add_w = True
+    # The box grows the shorter side one step at a time (the width on ties, a full side never grows) until both
+    # sides reach k of the image. Like merging the sorted lengths of both sides, so the step counts of the side
+    # finishing last and of the other side follow from the length the other side reaches meanwhile.
+    steps_h = grow_steps(a, b, H, H * k)
+    steps_w = grow_steps(c, d, W, W * k)
+    if steps_h == 0 and steps_w == 0:
+        return regulate_abcd(x, a, b, c, d)
 
-        if d - c == W:
-            add_h = True
+    # lengths before the last step a side needs
+    last_h = min(b + steps_h - 1, H) - max(a - steps_h + 1, 0)
+    last_w = min(d + steps_w - 1, W) - max(c - steps_w + 1, 0)
 
-        if add_h:
-            a -= 1
-            b += 1
+    if steps_w == 0 or (steps_h > 0 and last_h >= last_w):
+        steps_w = max(steps_w, grow_steps(c, d, W, min(last_h + 1, W)))
+    else:
+        steps_h = max(steps_h, grow_steps(a, b, H, min(last_w, H)))
 
-        if add_w:
-            c -= 1
-            d += 1
-
-        a, b, c, d = regulate_abcd(x, a, b, c, d)
-    return a, b, c, d
+    return regulate_abcd(x, a - steps_h, b + steps_h, c - steps_w, d + steps_w)
 
 
 def fooocus_fill(image, mask):
+    unknown = mask >= 127
+    if not unknown.any():
+        return image.copy()
+
+    keep = (~unknown).astype(np.uint8)
+    H, W = mask.shape[:2]
     current_image = image.copy()
-    raw_image = image.copy()
-    area = np.where(mask < 127)
-    store = raw_image[area]
 
-    for k, repeats in [(512, 2), (256, 2), (128, 4), (64, 4), (33, 8), (15, 8), (5, 16), (3, 16)]:
+    # the large boxes only carry low frequencies, they run on a downscaled copy
+    large = [(k, repeats) for k, repeats in fill_schedule if k >= fill_pyramid_min_radius]
+    small = [(k, repeats) for k, repeats in fill_schedule if k < fill_pyramid_min_radius]
+    if len(large) > 0:
+        h, w = -(-H // fill_pyramid_scale), -(-W // fill_pyramid_scale)
+        small_image = cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA)
+        small_keep = (cv2.resize(keep * 255, (w, h), interpolation=cv2.INTER_AREA) == 255).astype(np.uint8)
+        small_current = small_image.copy()
+        for k, repeats in large:
+            size = 2 * max(1, round(k / fill_pyramid_scale)) + 1
+            for _ in range(repeats):
+                small_current = cv2.blur(small_current, (size, size), borderType=cv2.BORDER_REPLICATE)
+                cv2.copyTo(small_image, small_keep, small_current)
+        current_image = cv2.resize(small_current, (W, H), interpolation=cv2.INTER_LINEAR)
+        cv2.copyTo(image, keep, current_image)
+
+    # pixels further than k from the unknown area are restored after every pass, they are left out
+    ys, xs = np.nonzero(unknown)
+    for k, repeats in small:
+        a, b = max(ys.min() - k, 0), min(ys.max() + k + 1, H)
+        c, d = max(xs.min() - k, 0), min(xs.max() + k + 1, W)
+        current, source, source_keep = current_image[a:b, c:d], image[a:b, c:d], keep[a:b, c:d]
         for _ in range(repeats):
-            current_image = box_blur(current_image, k)
-            current_image[area] = store
+            blurred = cv2.blur(current, (2 * k + 1, 2 * k + 1), borderType=cv2.BORDER_REPLICATE)
+            cv2.copyTo(source, source_keep, blurred)
+            current[...] = blurred
 
     return current_image
 
@@ -159,6 +177,7 @@ class InpaintWorker:
 
         # super resolution
         if get_image_shape_ceil(self.interested_image) < 1024:
+            from modules.upscaler import perform_upscale
             self.interested_image = perform_upscale(self.interested_image)
 
         # resize to make images ready for diffusion
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+import modules.config
+
+
+def value_size(value):
+    if isinstance(value, torch.Tensor):
+        return value.nelement() * value.element_size()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(value_size(v) for v in value)
+    return 0
+
+
+def freeze(value):
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            freeze(v)
+
+
+def vae_identity(vae):
+    """Unique per loaded VAE object, unlike id() it is never reused by a VAE loaded later."""
+    identity = getattr(vae, 'fcs_latent_identity', None)
+    if identity is None:
+        identity = uuid.uuid4().hex
+        vae.fcs_latent_identity = identity
+    return identity
+
+
+class LatentCache:
+    """LRU cache of VAE encodings and upscaled images of input images under a byte budget."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts):
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                part = np.ascontiguousarray(part)
+                h.update(f'array:{part.shape}:{part.dtype}\n'.encode('utf-8'))
+                h.update(part.data)
+            else:
+                h.update(f'{part!r}\n'.encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = value_size(value)
+        if size > self.budget:
+            return
+        freeze(value)
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.sizes[key] = size
+            while sum(self.sizes.values()) > self.budget:
+                evicted, _ = self.entries.popitem(last=False)
+                del self.sizes[evicted]
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        return dict(entries=len(self.entries), bytes=sum(self.sizes.values()), hits=self.hits, misses=self.misses)
+
+
+latent_cache = LatentCache(modules.config.default_latent_cache_budget * 1024 * 1024)
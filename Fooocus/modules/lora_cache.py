@@ -0,0 +1,208 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import safetensors
+import safetensors.torch
+
+import modules.config
+from modules.util import file_signature
+
+
+def stack_key(filename, component, loras):
+    """Identifies a model component with a LoRA stack applied, stable across processes and changed by replaced files."""
+    loras = [(file_signature(lora_filename), weight) for lora_filename, weight in loras]
+    return hashlib.sha256(f'{file_signature(filename)}:{component}:{loras}'.encode('utf-8')).hexdigest()
+
+
+class MergedWeightCache:
+    """LRU cache of LoRA merged weights per stack key, optionally persisted as one safetensors file per stack."""
+
+    def __init__(self, budget, path=None):
+        self.budget = budget
+        self.path = path
+        self.stacks = OrderedDict()
+        self.sizes = {}
+        self.dirty = set()
+        self.oversized = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def enabled(self):
+        return self.budget > 0
+
+    def get(self, stack, key):
+        with self.lock:
+            weights = self.stacks.get(stack, None)
+            if weights is None:
+                weights = self.load_from_disk(stack)
+            if weights is not None:
+                self.stacks.move_to_end(stack)
+                if key in weights:
+                    self.hits += 1
+                    return weights[key]
+            self.misses += 1
+            return None
+
+    def contains(self, stack, key):
+        if not self.enabled():
+            return False
+        with self.lock:
+            weights = self.stacks.get(stack, None)
+            if weights is None:
+                weights = self.load_from_disk(stack)
+            return weights is not None and key in weights
+
+    def put(self, stack, key, weight):
+        with self.lock:
+            if stack in self.oversized:
+                return
+            weights = self.stacks.setdefault(stack, {})
+            self.stacks.move_to_end(stack)
+            weights[key] = weight
+            self.sizes[stack] = self.sizes.get(stack, 0) + weight.nelement() * weight.element_size()
+            self.dirty.add(stack)
+            self.evict()
+
+    def evict(self):
+        # least recently used stacks go first, the one in use only when it alone exceeds the budget
+        while len(self.stacks) > 0 and sum(self.sizes.values()) > self.budget:
+            stack = next(iter(self.stacks))
+            if len(self.stacks) == 1:
+                self.oversized.add(stack)
+            del self.stacks[stack]
+            del self.sizes[stack]
+            self.dirty.discard(stack)
+
+    def clear(self):
+        with self.lock:
+            self.stacks.clear()
+            self.sizes.clear()
+            self.dirty.clear()
+
+    def stats(self):
+        return dict(stacks=len(self.stacks), bytes=sum(self.sizes.values()), hits=self.hits, misses=self.misses)
+
+    def filename(self, stack):
+        return os.path.join(self.path, f'{stack}.safetensors')
+
+    def load_from_disk(self, stack):
+        if self.path is None or stack in self.oversized:
+            return None
+        filename = self.filename(stack)
+        if not os.path.exists(filename):
+            return None
+        try:
+            weights = safetensors.torch.load_file(filename)
+        except Exception as e:
+            print(f'[LoRA Cache] Loading {filename} failed: {e}')
+            return None
+        self.stacks[stack] = weights
+        self.sizes[stack] = sum(w.nelement() * w.element_size() for w in weights.values())
+        self.evict()
+        return self.stacks.get(stack, None)
+
+    def flush(self):
+        """Write stacks with new weights to disk, called once a model has been patched."""
+        if self.path is None:
+            return
+        with self.lock:
+            for stack in list(self.dirty):
+                filename = self.filename(stack)
+                try:
+                    os.makedirs(self.path, exist_ok=True)
+                    temp_filename = f'{filename}.{os.getpid()}.tmp'
+                    weights = {k: w.contiguous() for k, w in self.stacks[stack].items()}
+                    safetensors.torch.save_file(weights, temp_filename)
+                    os.replace(temp_filename, filename)
+                except Exception as e:
+                    print(f'[LoRA Cache] Saving {filename} failed: {e}')
+            self.dirty.clear()
+
+
+merged_weight_cache = MergedWeightCache(
+    modules.config.default_lora_merge_cache_budget * 1024 * 1024,
+    modules.config.lora_merge_cache_path if modules.config.lora_merge_cache_path not in ['', 'None'] else None)
+
+
+class LazySafetensors(Mapping):
+    """Read-only mapping over a memory-mapped safetensors file, tensors are read on first access and kept."""
+
+    def __init__(self, filename):
+        self.handle = safetensors.safe_open(filename, framework='pt', device='cpu')
+        self.names = list(self.handle.keys())
+        self.name_set = set(self.names)
+        self.tensors = {}
+
+    def __getitem__(self, key):
+        if key not in self.name_set:
+            raise KeyError(key)
+        tensor = self.tensors.get(key, None)
+        if tensor is None:
+            tensor = self.handle.get_tensor(key)
+            self.tensors[key] = tensor
+        return tensor
+
+    def __contains__(self, key):
+        return key in self.name_set
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+lora_files = OrderedDict()
+matched_loras = OrderedDict()
+lora_files_lock = threading.Lock()
+
+
+def lru_put(cache, key, value, capacity):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > capacity:
+        cache.popitem(last=False)
+
+
+def load_lora_file(filename):
+    """LoRA tensors of a file, shared by every model in the process and reused until the file changes."""
+    from ldm_patched.modules.utils import load_torch_file
+
+    key = (filename, os.path.getmtime(filename))
+    with lora_files_lock:
+        lora = lora_files.get(key, None)
+        if lora is not None:
+            lora_files.move_to_end(key)
+            return lora
+
+        if filename.lower().endswith('.safetensors'):
+            lora = LazySafetensors(filename)
+        else:
+            lora = load_torch_file(filename, safe_load=False)
+        lru_put(lora_files, key, lora, modules.config.default_lora_file_cache_size)
+        return lora
+
+
+def match_lora_cached(filename, model_key, key_map_unet, key_map_clip):
+    """match_lora against the unet and then the clip key map, memoized per LoRA file and model."""
+    from modules.lora import match_lora
+
+    key = (filename, os.path.getmtime(filename), model_key)
+    with lora_files_lock:
+        matched = matched_loras.get(key, None)
+        if matched is not None:
+            matched_loras.move_to_end(key)
+            return matched
+
+    lora_unmatch = load_lora_file(filename)
+    lora_unet, lora_unmatch = match_lora(lora_unmatch, key_map_unet)
+    lora_clip, lora_unmatch = match_lora(lora_unmatch, key_map_clip)
+    matched = lora_unet, lora_clip, lora_unmatch
+
+    with lora_files_lock:
+        lru_put(matched_loras, key, matched, modules.config.default_lora_file_cache_size * 2)
+    return matched
@@ -0,0 +1,58 @@
+import torch
+
+
+def is_plain_lora(v):
+    return isinstance(v, tuple) and len(v) == 2 and v[0] == 'lora' and v[1][3] is None
+
+
+class LoraMergePlan:
+    """Computes up @ down of plain LoRA patches sharing factor shapes with one bmm per chunk instead of one mm per key."""
+
+    def __init__(self, patch_lists, chunk_elements=2 ** 24):
+        self.chunk_elements = chunk_elements
+        self.groups = {}
+        self.positions = {}
+        self.deltas = {}
+        self.batched = 0
+
+        for patches in patch_lists:
+            for p in patches:
+                v = p[1]
+                if not is_plain_lora(v) or id(v) in self.positions:
+                    continue
+                up, down = v[1][0], v[1][1]
+                signature = (up.shape[0], up[0].numel(), down[0].numel(), up.dtype, down.dtype, up.device)
+                group = self.groups.setdefault(signature, [])
+                self.positions[id(v)] = (signature, len(group))
+                group.append(v)
+
+    def delta(self, v, device):
+        """Unscaled up @ down of a planned patch in fp32 on device, None when the patch is merged on its own."""
+        if device.type == 'cpu':
+            # bmm is no faster than mm on cpu and stacking only adds copies
+            return None
+
+        delta = self.deltas.pop(id(v), None)
+        if delta is not None:
+            return delta
+
+        position = self.positions.get(id(v), None)
+        if position is None:
+            return None
+        signature, index = position
+        group = self.groups[signature]
+        if len(group) < 2:
+            return None
+
+        out_features, rank, in_features = signature[0], signature[1], signature[2]
+        size = max(1, self.chunk_elements // (out_features * in_features))
+        chunk = group[index:index + size]
+
+        up = torch.stack([x[1][0].reshape(out_features, rank) for x in chunk]).to(device=device, dtype=torch.float32)
+        down = torch.stack([x[1][1].reshape(rank, in_features) for x in chunk]).to(device=device, dtype=torch.float32)
+        deltas = torch.bmm(up, down)
+        self.batched += len(chunk)
+
+        for x, d in zip(chunk[1:], deltas[1:]):
+            self.deltas[id(x)] = d
+        return deltas[0]
@@ -0,0 +1,92 @@
+import json
+import os
+
+import safetensors.torch
+import torch
+
+import modules.config
+from modules.hash_cache import sha256_from_cache
+
+version = 1
+
+
+def cache_directory(ckpt_filename):
+    path = modules.config.fast_load_cache_path
+    if path in ['', 'None']:
+        return None
+    return os.path.join(path, sha256_from_cache(ckpt_filename))
+
+
+def save_state_dict(sd, filename):
+    temp_filename = f'{filename}.{os.getpid()}.tmp'
+    safetensors.torch.save_file({k: v.detach().to('cpu').contiguous() for k, v in sd.items()}, temp_filename)
+    os.replace(temp_filename, filename)
+
+
+def model_config_to_json(model):
+    """Detected model config of a BaseModel, without the dtype which is chosen again at load time."""
+    unet_config = {k: v for k, v in model.model_config.unet_config.items() if k != 'dtype'}
+    return dict(version=version, model_config=type(model.model_config).__name__, unet_config=unet_config,
+                model_type=model.model_type.name)
+
+
+def save(ckpt_filename, unet, clip, vae=None):
+    """Writes the converted unet, clip and (when it came from the checkpoint) vae of a loaded checkpoint,
+    config.json is written last and marks the entry complete."""
+    import ldm_patched.modules.sd
+
+    directory = cache_directory(ckpt_filename)
+    if directory is None or unet is None or clip is None:
+        return
+    if not isinstance(unet.model.model_config, ldm_patched.modules.sd.STREAMING_MODEL_CONFIGS):
+        return
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        config = model_config_to_json(unet.model)
+        save_state_dict(unet.model.diffusion_model.state_dict(), os.path.join(directory, 'unet.safetensors'))
+        save_state_dict(clip.cond_stage_model.state_dict(), os.path.join(directory, 'clip.safetensors'))
+        if vae is not None:
+            save_state_dict(vae.first_stage_model.state_dict(), os.path.join(directory, 'vae.safetensors'))
+        config['vae'] = vae is not None or os.path.exists(os.path.join(directory, 'vae.safetensors'))
+
+        temp_filename = os.path.join(directory, f'config.json.{os.getpid()}.tmp')
+        with open(temp_filename, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        os.replace(temp_filename, os.path.join(directory, 'config.json'))
+        print(f'[Fast Load] Saved {ckpt_filename} to {directory}')
+    except Exception as e:
+        print(f'[Fast Load] Saving {ckpt_filename} failed: {e}')
+
+
+def load(ckpt_filename, vae_filename=None, embedding_directory=None, initial_device=None):
+    """Returns (unet, clip, vae, vae_filename) read from the converted cache, None when there is no usable entry."""
+    import ldm_patched.modules.sd
+    import ldm_patched.modules.utils
+
+    directory = cache_directory(ckpt_filename)
+    if directory is None or not os.path.exists(os.path.join(directory, 'config.json')):
+        return None
+
+    try:
+        with open(os.path.join(directory, 'config.json'), encoding='utf-8') as f:
+            config = json.load(f)
+        if config.get('version', None) != version or (vae_filename is None and not config['vae']):
+            return None
+
+        unet_sd = ldm_patched.modules.utils.load_torch_file(os.path.join(directory, 'unet.safetensors'), lazy=True)
+        clip_sd = ldm_patched.modules.utils.load_torch_file(os.path.join(directory, 'clip.safetensors'), lazy=True)
+        if vae_filename is None:
+            vae_sd = ldm_patched.modules.utils.load_torch_file(os.path.join(directory, 'vae.safetensors'))
+        else:
+            vae_sd = ldm_patched.modules.utils.load_torch_file(vae_filename)
+
+        unet, clip, vae = ldm_patched.modules.sd.load_converted_checkpoint(
+            config['model_config'], config['unet_config'], config['model_type'], unet_sd, clip_sd, vae_sd,
+            embedding_directory=embedding_directory, initial_device=initial_device)
+    except Exception as e:
+        print(f'[Fast Load] Loading {ckpt_filename} from {directory} failed: {e}')
+        return None
+
+    print(f'[Fast Load] Loaded {ckpt_filename} from {directory}')
+    return unet, clip, vae, vae_filename
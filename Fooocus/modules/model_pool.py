@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+import psutil
+
+
+def model_size(model):
+    """Bytes held by the unet, clip and vae of a StableDiffusionModel."""
+    import ldm_patched.modules.model_management
+
+    size = 0
+    if model.unet is not None:
+        size += model.unet.model_size()
+    if model.clip is not None:
+        size += model.clip.patcher.model_size()
+    if model.vae is not None:
+        size += ldm_patched.modules.model_management.module_size(model.vae.first_stage_model)
+    return size
+
+
+def default_budget(budget_mb):
+    if budget_mb < 0:
+        return psutil.virtual_memory().total // 2
+    return budget_mb * 1024 * 1024
+
+
+class ModelPool:
+    """Keeps loaded StableDiffusionModels resident under a byte budget, least recently used ones are dropped first."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.models = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.models)
+
+    def total_size(self):
+        with self.lock:
+            return sum(self.sizes.values())
+
+    def get(self, key):
+        with self.lock:
+            model = self.models.get(key, None)
+            if model is not None:
+                self.models.move_to_end(key)
+            return model
+
+    def put(self, key, model, size, keep=()):
+        with self.lock:
+            self.models[key] = model
+            self.models.move_to_end(key)
+            self.sizes[key] = size
+            return self.evict(keep=list(keep) + [model])
+
+    def evict(self, keep=()):
+        """Drop least recently used models until the pool fits the budget, returns how many were dropped."""
+        evicted = 0
+        with self.lock:
+            for key in list(self.models.keys()):
+                if self.total_size() <= self.budget:
+                    break
+                if any(self.models[key] is k for k in keep):
+                    continue
+                del self.models[key]
+                del self.sizes[key]
+                evicted += 1
+                print(f'[Model Pool] Evicted {key}')
+        return evicted
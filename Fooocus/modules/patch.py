@@ -18,14 +18,18 @@ import ldm_patched.modules.model_patcher
 import ldm_patched.modules.samplers
 import ldm_patched.modules.args_parser
 import warnings
+import safetensors
 import safetensors.torch
 import modules.constants as constants
+import ldm_patched.modules.utils
 
 from ldm_patched.modules.samplers import calc_cond_uncond_batch
 from ldm_patched.k_diffusion.sampling import BatchedBrownianTree
 from ldm_patched.ldm.modules.diffusionmodules.openaimodel import forward_timestep_embed, apply_control
 from modules.patch_precision import patch_all_precision
 from modules.patch_clip import patch_all_clip
+from modules.lora_cache import merged_weight_cache
+from modules.lora_merge import LoraMergePlan
 
 
 class PatchSettings:
@@ -50,6 +54,38 @@ patch_settings = {}
 
 
 def calculate_weight_patched(self, patches, weight, key):
+    stack = self.weight_cache_key
+    if stack is None or not merged_weight_cache.enabled() or patches is not self.patches.get(key, None):
+        return calculate_weight_merge(self, patches, weight, key)
+
+    cached = merged_weight_cache.get(stack, key)
+    if cached is not None:
+        return weight.copy_(cached)
+
+    weight = calculate_weight_merge(self, patches, weight, key)
+    dtype = ldm_patched.modules.utils.get_attr(self.model, key).dtype
+    merged_weight_cache.put(stack, key, weight.to(device='cpu', dtype=dtype))
+    return weight
+
+
+def patch_model_patched(self, device_to=None, patch_weights=True):
+    if patch_weights:
+        pending = []
+        for key, patches in self.patches.items():
+            if self.same_patches(self.applied_patches.get(key, None), patches):
+                continue
+            if self.weight_cache_key is not None and merged_weight_cache.contains(self.weight_cache_key, key):
+                continue
+            pending.append(patches)
+        self.lora_merge_plan = LoraMergePlan(pending)
+
+    try:
+        return ldm_patched.modules.model_patcher.ModelPatcher.patch_model_origin(self, device_to, patch_weights)
+    finally:
+        self.lora_merge_plan = None
+
+
+def calculate_weight_merge(self, patches, weight, key):
     for p in patches:
         alpha = p[0]
         v = p[1]
@@ -75,18 +111,21 @@ def calculate_weight_patched(self, patches, weight, key):
                 else:
                     weight += alpha * ldm_patched.modules.model_management.cast_to_device(w1, weight.device, weight.dtype)
         elif patch_type == "lora":
-            mat1 = ldm_patched.modules.model_management.cast_to_device(v[0], weight.device, torch.float32)
-            mat2 = ldm_patched.modules.model_management.cast_to_device(v[1], weight.device, torch.float32)
             if v[2] is not None:
-                alpha *= v[2] / mat2.shape[0]
-            if v[3] is not None:
-                mat3 = ldm_patched.modules.model_management.cast_to_device(v[3], weight.device, torch.float32)
-                final_shape = [mat2.shape[1], mat2.shape[0], mat3.shape[2], mat3.shape[3]]
-                mat2 = torch.mm(mat2.transpose(0, 1).flatten(start_dim=1),
-                                mat3.transpose(0, 1).flatten(start_dim=1)).reshape(final_shape).transpose(0, 1)
+                alpha *= v[2] / v[1].shape[0]
+            plan = getattr(self, 'lora_merge_plan', None)
+            delta = plan.delta(p[1], weight.device) if plan is not None else None
+            if delta is None:
+                mat1 = ldm_patched.modules.model_management.cast_to_device(v[0], weight.device, torch.float32)
+                mat2 = ldm_patched.modules.model_management.cast_to_device(v[1], weight.device, torch.float32)
+                if v[3] is not None:
+                    mat3 = ldm_patched.modules.model_management.cast_to_device(v[3], weight.device, torch.float32)
+                    final_shape = [mat2.shape[1], mat2.shape[0], mat3.shape[2], mat3.shape[3]]
+                    mat2 = torch.mm(mat2.transpose(0, 1).flatten(start_dim=1),
+                                    mat3.transpose(0, 1).flatten(start_dim=1)).reshape(final_shape).transpose(0, 1)
+                delta = torch.mm(mat1.flatten(start_dim=1), mat2.flatten(start_dim=1))
             try:
-                weight += (alpha * torch.mm(mat1.flatten(start_dim=1), mat2.flatten(start_dim=1))).reshape(
-                    weight.shape).type(weight.dtype)
+                weight.add_(delta.reshape(weight.shape).type(weight.dtype), alpha=alpha)
             except Exception as e:
                 print("ERROR", key, e)
         elif patch_type == "fooocus":
@@ -445,6 +484,7 @@ def patched_unet_forward(self, x, timesteps=None, context=None, y=None, control=
 def patched_load_models_gpu(*args, **kwargs):
     execution_start_time = time.perf_counter()
     y = ldm_patched.modules.model_management.load_models_gpu_origin(*args, **kwargs)
+    merged_weight_cache.flush()
     moving_time = time.perf_counter() - execution_start_time
     if moving_time > 0.1:
         print(f'[Fooocus Model Management] Moving model(s) has taken {moving_time:.2f} seconds')
@@ -496,7 +536,11 @@ def patch_all():
     if not hasattr(ldm_patched.modules.model_management, 'load_models_gpu_origin'):
         ldm_patched.modules.model_management.load_models_gpu_origin = ldm_patched.modules.model_management.load_models_gpu
 
+    if not hasattr(ldm_patched.modules.model_patcher.ModelPatcher, 'patch_model_origin'):
+        ldm_patched.modules.model_patcher.ModelPatcher.patch_model_origin = ldm_patched.modules.model_patcher.ModelPatcher.patch_model
+
     ldm_patched.modules.model_management.load_models_gpu = patched_load_models_gpu
+    ldm_patched.modules.model_patcher.ModelPatcher.patch_model = patch_model_patched
     ldm_patched.modules.model_patcher.ModelPatcher.calculate_weight = calculate_weight_patched
     ldm_patched.controlnet.cldm.ControlNet.forward = patched_cldm_forward
     ldm_patched.ldm.modules.diffusionmodules.openaimodel.UNetModel.forward = patched_unet_forward
@@ -508,6 +552,7 @@ def patch_all():
     warnings.filterwarnings(action='ignore', module='torchsde')
 
     build_loaded(safetensors.torch, 'load_file')
+    build_loaded(safetensors, 'safe_open')
     build_loaded(torch, 'load')
 
     return
@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import modules.config
+
+chunk_size = 64 * 1024 * 1024
+
+executor = None
+futures = {}
+futures_lock = threading.Lock()
+
+
+def read_file(filename):
+    """Reads a file once so that memory-mapped loads of it hit the page cache."""
+    buffer = bytearray(chunk_size)
+    with open(filename, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while f.readinto(buffer) > 0:
+            pass
+
+
+def read_lora(filename):
+    """Decodes every tensor of a LoRA into the process wide LoRA file cache."""
+    from modules.lora_cache import load_lora_file
+
+    lora = load_lora_file(filename)
+    for key in lora:
+        lora[key]
+
+
+def checkpoint_files(filename):
+    """Files a load of the checkpoint reads, the converted ones if it is in the fast load cache."""
+    import modules.hash_cache
+    import modules.model_cache
+
+    if filename in modules.hash_cache.hash_cache:
+        directory = modules.model_cache.cache_directory(filename)
+        if directory is not None and os.path.exists(os.path.join(directory, 'config.json')):
+            return [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.safetensors')]
+    return [filename]
+
+
+def loaded_filenames():
+    pipeline = sys.modules.get('modules.default_pipeline', None)
+    if pipeline is None:
+        return set()
+    filenames = {pipeline.model_base.filename, pipeline.model_base.vae_filename, pipeline.model_refiner.filename}
+    filenames.update(key[1] for key in list(pipeline.model_pool.models.keys()))
+    return filenames
+
+
+def run(kind, filename):
+    started = time.perf_counter()
+    try:
+        if kind == 'lora':
+            read_lora(filename)
+        else:
+            read_file(filename)
+    except Exception as e:
+        print(f'[Prefetch] Reading {filename} failed: {e}')
+        return
+    finally:
+        with futures_lock:
+            futures.pop(filename, None)
+    print(f'[Prefetch] Read {filename} in {time.perf_counter() - started:.2f} seconds')
+
+
+def prefetch(files):
+    """Starts reading (kind, filename) pairs on the prefetch threads, files already loaded or in flight are skipped."""
+    global executor
+
+    if modules.config.default_prefetch_workers <= 0:
+        return
+
+    loaded = loaded_filenames()
+    with futures_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=modules.config.default_prefetch_workers,
+                                          thread_name_prefix='prefetch')
+        for kind, filename in files:
+            if filename in loaded or not os.path.isfile(filename):
+                continue
+            names = checkpoint_files(filename) if kind == 'checkpoint' else [filename]
+            for name in names:
+                if name not in futures:
+                    futures[name] = executor.submit(run, kind, name)
+
+
+def wait(filename):
+    """Called before loading a file: drops its prefetch if it has not started yet, otherwise waits for it."""
+    with futures_lock:
+        future = futures.pop(filename, None)
+    if future is not None and not future.cancel():
+        future.result()
@@ -0,0 +1,34 @@
+import time
+
+
+class PreviewPolicy:
+    """Decides per sampling step whether a preview is decoded, skipped frames cost neither the approx VAE pass nor
+    the copy to host memory. The last step is always previewed unless nobody is watching."""
+
+    def __init__(self, every_n_steps=1, min_interval=0.0, watched=None):
+        self.every_n_steps = max(1, every_n_steps)
+        self.min_interval = min_interval
+        self.watched = watched
+        self.last_preview = None
+        self.rendered = 0
+        self.skipped = 0
+
+    def should_preview(self, step, total_steps):
+        if self.watched is not None and not self.watched():
+            self.skipped += 1
+            return False
+
+        now = time.monotonic()
+        last_step = step + 1 >= total_steps
+        if not last_step:
+            if (step + 1) % self.every_n_steps != 0 or \
+                    (self.last_preview is not None and now - self.last_preview < self.min_interval):
+                self.skipped += 1
+                return False
+
+        self.last_preview = now
+        self.rendered += 1
+        return True
+
+    def stats(self):
+        return dict(rendered=self.rendered, skipped=self.skipped)
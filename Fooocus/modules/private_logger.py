@@ -1,8 +1,10 @@
+import io
 import os
+import threading
 import args_manager
 import modules.config
-import json
-import urllib.parse
+import modules.image_log
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
@@ -10,7 +12,79 @@ from modules.flags import OutputFormat
 from modules.meta_parser import MetadataParser, get_exif
 from modules.util import generate_temp_filename
 
-log_cache = {}
+log_viewers = set()
+log_lock = threading.Lock()
+
+save_executor = None
+delivery_executor = None
+pending_futures = []
+pending_lock = threading.Lock()
+failed_saves = set()
+
+
+def save_or_record(fn, path, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        print(f'[Image Save] Saving {path} failed: {e}')
+        if path is not None:
+            with pending_lock:
+                failed_saves.add(path)
+
+
+def submit(fn, *args, path=None):
+    """Run fn on the image saving pool, or right away when default_image_save_workers is 0. A failing fn is reported
+    and its path left out of the results by drop_failed."""
+    global save_executor
+
+    if modules.config.default_image_save_workers <= 0:
+        save_or_record(fn, path, *args)
+        return
+    with pending_lock:
+        if save_executor is None:
+            save_executor = ThreadPoolExecutor(max_workers=modules.config.default_image_save_workers,
+                                               thread_name_prefix='image_save')
+        pending_futures.append(save_executor.submit(save_or_record, fn, path, *args))
+
+
+def drop_failed(results):
+    """results without the paths of images that could not be saved."""
+    with pending_lock:
+        return [r for r in results if not (isinstance(r, str) and r in failed_saves)]
+
+
+def after_saved(fn):
+    """Call fn once every image submitted so far is saved or failed, in submission order and off the calling thread.
+    fn should pass its paths through drop_failed."""
+    global delivery_executor
+
+    with pending_lock:
+        futures = list(pending_futures)
+        if len(futures) == 0:
+            delivery = None
+        else:
+            if delivery_executor is None:
+                delivery_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image_delivery')
+
+            def deliver():
+                wait_futures(futures)
+                fn()
+
+            delivery = delivery_executor.submit(deliver)
+            pending_futures.append(delivery)
+    if delivery is None:
+        fn()
+
+
+def wait_for_saves():
+    """Block until all submitted images are saved and delivered, raises the first delivery error."""
+    global pending_futures
+
+    with pending_lock:
+        futures, pending_futures = pending_futures, []
+    wait_futures(futures)
+    for future in futures:
+        future.result()
 
 
 def get_current_html_path(output_format=None):
@@ -21,117 +95,72 @@ def get_current_html_path(output_format=None):
     return html_name
 
 
-def log(img, metadata, metadata_parser: MetadataParser | None = None, output_format=None, task=None, persist_image=True) -> str:
+def log(img, metadata, metadata_parser: MetadataParser | None = None, output_format=None, task=None, persist_image=True,
+        deliver='path', persist=True):
+    """Save an image with its metadata and return what deliver asks for: the file path, the encoded image bytes or
+    the image array itself. Bytes and arrays are written to disk in the background only if persist is set."""
     path_outputs = modules.config.temp_path if args_manager.args.disable_image_log or not persist_image else modules.config.path_outputs
     output_format = output_format if output_format else modules.config.default_output_format
-    date_string, local_temp_filename, only_name = generate_temp_filename(folder=path_outputs, extension=output_format)
-    os.makedirs(os.path.dirname(local_temp_filename), exist_ok=True)
 
     parsed_parameters = metadata_parser.to_string(metadata.copy()) if metadata_parser is not None else ''
+    scheme = metadata_parser.get_scheme().value if metadata_parser is not None else None
+
+    data = None
+    if deliver == 'bytes':
+        data = encode_image(img, parsed_parameters, scheme, output_format)
+
+    if deliver == 'path' or persist:
+        date_string, local_temp_filename, only_name = generate_temp_filename(folder=path_outputs, extension=output_format)
+        os.makedirs(os.path.dirname(local_temp_filename), exist_ok=True)
+
+        # encoding and the html log are written on the saving pool, the path is known right away
+        submit(write_image_and_log, img if data is None else data, list(metadata), parsed_parameters, scheme,
+               output_format, task, date_string, local_temp_filename, only_name, path=local_temp_filename)
+        if deliver == 'path':
+            return local_temp_filename
+
+    return img if data is None else data
+
+
+def encode_image(img, parsed_parameters, scheme, output_format):
     image = Image.fromarray(img)
+    buffer = io.BytesIO()
 
     if output_format == OutputFormat.PNG.value:
         if parsed_parameters != '':
             pnginfo = PngInfo()
             pnginfo.add_text('parameters', parsed_parameters)
-            pnginfo.add_text('fooocus_scheme', metadata_parser.get_scheme().value)
+            pnginfo.add_text('fooocus_scheme', scheme)
         else:
             pnginfo = None
-        image.save(local_temp_filename, pnginfo=pnginfo)
+        image.save(buffer, format='PNG', pnginfo=pnginfo)
     elif output_format == OutputFormat.JPEG.value:
-        image.save(local_temp_filename, quality=95, optimize=True, progressive=True, exif=get_exif(parsed_parameters, metadata_parser.get_scheme().value) if metadata_parser else Image.Exif())
+        image.save(buffer, format='JPEG', quality=95, optimize=True, progressive=True, exif=get_exif(parsed_parameters, scheme) if scheme is not None else Image.Exif())
     elif output_format == OutputFormat.WEBP.value:
-        image.save(local_temp_filename, quality=95, lossless=False, exif=get_exif(parsed_parameters, metadata_parser.get_scheme().value) if metadata_parser else Image.Exif())
+        image.save(buffer, format='WEBP', quality=95, lossless=False, exif=get_exif(parsed_parameters, scheme) if scheme is not None else Image.Exif())
     else:
-        image.save(local_temp_filename)
+        image.save(buffer, format=output_format.upper())
 
-    if args_manager.args.disable_image_log:
-        return local_temp_filename
+    return buffer.getvalue()
 
-    html_name = os.path.join(os.path.dirname(local_temp_filename), 'log.html')
 
-    css_styles = (
-        "<style>"
-        "body { background-color: #121212; color: #E0E0E0; } "
-        "a { color: #BB86FC; } "
-        ".metadata { border-collapse: collapse; width: 100%; } "
-        ".metadata .label { width: 15%; } "
-        ".metadata .value { width: 85%; font-weight: bold; } "
-        ".metadata th, .metadata td { border: 1px solid #4d4d4d; padding: 4px; } "
-        ".image-container img { height: auto; max-width: 512px; display: block; padding-right:10px; } "
-        ".image-container div { text-align: center; padding: 4px; } "
-        "hr { border-color: gray; } "
-        "button { background-color: black; color: white; border: 1px solid grey; border-radius: 5px; padding: 5px 10px; text-align: center; display: inline-block; font-size: 16px; cursor: pointer; }"
-        "button:hover {background-color: grey; color: black;}"
-        "</style>"
-    )
-
-    js = (
-        """<script>
-        function to_clipboard(txt) { 
-        txt = decodeURIComponent(txt);
-        if (navigator.clipboard && navigator.permissions) {
-            navigator.clipboard.writeText(txt)
-        } else {
-            const textArea = document.createElement('textArea')
-            textArea.value = txt
-            textArea.style.width = 0
-            textArea.style.position = 'fixed'
-            textArea.style.left = '-999px'
-            textArea.style.top = '10px'
-            textArea.setAttribute('readonly', 'readonly')
-            document.body.appendChild(textArea)
-
-            textArea.select()
-            document.execCommand('copy')
-            document.body.removeChild(textArea)
-        }
-        alert('Copied to Clipboard!\\nPaste to prompt area to load parameters.\\nCurrent clipboard content is:\\n\\n' + txt);
-        }
-        </script>"""
-    )
-
-    begin_part = f"<!DOCTYPE html><html><head><title>Fooocus Log {date_string}</title>{css_styles}</head><body>{js}<p>Fooocus Log {date_string} (private)</p>\n<p>Metadata is embedded if enabled in the config or developer debug mode. You can find the information for each image in line Metadata Scheme.</p><!--fooocus-log-split-->\n\n"
-    end_part = f'\n<!--fooocus-log-split--></body></html>'
-
-    middle_part = log_cache.get(html_name, "")
-
-    if middle_part == "":
-        if os.path.exists(html_name):
-            existing_split = open(html_name, 'r', encoding='utf-8').read().split('<!--fooocus-log-split-->')
-            if len(existing_split) == 3:
-                middle_part = existing_split[1]
-            else:
-                middle_part = existing_split[0]
-
-    div_name = only_name.replace('.', '_')
-    item = f"<div id=\"{div_name}\" class=\"image-container\"><hr><table><tr>\n"
-    item += f"<td><a href=\"{only_name}\" target=\"_blank\"><img src='{only_name}' onerror=\"this.closest('.image-container').style.display='none';\" loading='lazy'/></a><div>{only_name}</div></td>"
-    item += "<td><table class='metadata'>"
-    for label, key, value in metadata:
-        value_txt = str(value).replace('\n', ' </br> ')
-        item += f"<tr><td class='label'>{label}</td><td class='value'>{value_txt}</td></tr>\n"
-
-    if task is not None and 'positive' in task and 'negative' in task:
-        full_prompt_details = f"""<details><summary>Positive</summary>{', '.join(task['positive'])}</details>
-        <details><summary>Negative</summary>{', '.join(task['negative'])}</details>"""
-        item += f"<tr><td class='label'>Full raw prompt</td><td class='value'>{full_prompt_details}</td></tr>\n"
-
-    item += "</table>"
-
-    js_txt = urllib.parse.quote(json.dumps({k: v for _, k, v, in metadata}, indent=0), safe='')
-    item += f"</br><button onclick=\"to_clipboard('{js_txt}')\">Copy to Clipboard</button>"
-
-    item += "</td>"
-    item += "</tr></table></div>\n\n"
-
-    middle_part = item + middle_part
-
-    with open(html_name, 'w', encoding='utf-8') as f:
-        f.write(begin_part + middle_part + end_part)
+def write_image_and_log(img, metadata, parsed_parameters, scheme, output_format, task, date_string,
+                        local_temp_filename, only_name):
+    data = img if isinstance(img, bytes) else encode_image(img, parsed_parameters, scheme, output_format)
+    with open(local_temp_filename, 'wb') as f:
+        f.write(data)
 
-    print(f'Image generated with private log at: {html_name}')
+    if args_manager.args.disable_image_log:
+        return
+
+    log_directory = os.path.dirname(local_temp_filename)
+    html_name = os.path.join(log_directory, 'log.html')
+    jsonl_name = os.path.join(log_directory, 'log.jsonl')
 
-    log_cache[html_name] = middle_part
+    with log_lock:
+        if html_name not in log_viewers:
+            modules.image_log.ensure_viewer(html_name, jsonl_name, date_string)
+            log_viewers.add(html_name)
+        modules.image_log.append_entry(jsonl_name, modules.image_log.make_entry(only_name, metadata, task))
 
-    return local_temp_filename
+    print(f'Image generated with private log at: {html_name}')
@@ -0,0 +1,217 @@
+import base64
+import binascii
+import io
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+import modules.config
+
+max_tasks = 256
+keep_alive_interval = 15.0
+
+tasks = OrderedDict()
+tasks_lock = threading.Lock()
+
+
+def encode_image(image, image_format='JPEG', quality=80):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format=image_format, quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def encode_result(result):
+    if isinstance(result, np.ndarray):
+        return encode_image(result, 'PNG')
+    if isinstance(result, bytes):
+        return base64.b64encode(result).decode('ascii')
+    return result
+
+
+def encode_results(results):
+    """Result file paths as they are, encoded images and images without a file as base64."""
+    return [encode_result(r) for r in results]
+
+
+def event_data(flag, product):
+    if flag == 'preview':
+        percentage, title, image = product
+        return dict(percentage=percentage, title=title, preview=encode_image(image) if image is not None else None)
+    return dict(images=encode_results(product))
+
+
+class TaskEvents:
+    """Fans the events of one task out to any number of subscribers. A pump thread is the only consumer of the
+    task's yields, results and finish are kept for subscribers connecting later, previews only the latest one."""
+
+    def __init__(self, task):
+        self.task = task
+        self.events = []
+        self.preview = None
+        self.sequence = 0
+        self.condition = threading.Condition()
+        threading.Thread(target=self.pump, daemon=True).start()
+
+    def pump(self):
+        for flag, product in self.task.stream_events(previews=False):
+            with self.condition:
+                self.sequence += 1
+                if flag == 'preview':
+                    self.preview = (self.sequence, product)
+                else:
+                    self.events.append((self.sequence, flag, product))
+                self.condition.notify_all()
+
+    def subscribe(self, timeout=None, min_preview_interval=0.0):
+        """Yield the events of the task from the start, ('keep-alive', None) after timeout seconds without one.
+        Returns after 'finish', right away for a task that already finished once its events are replayed."""
+        index = 0
+        seen = 0
+        last_preview = None
+
+        def pending():
+            return index < len(self.events) or (self.preview is not None and self.preview[0] > seen)
+
+        with self.task.yields_condition:
+            self.task.preview_consumers += 1
+        try:
+            while True:
+                with self.condition:
+                    if not self.condition.wait_for(pending, timeout):
+                        event = ('keep-alive', None)
+                    elif index < len(self.events) and (self.preview is None or self.preview[0] <= seen
+                                                        or self.events[index][0] < self.preview[0]):
+                        sequence, flag, product = self.events[index]
+                        index += 1
+                        seen = max(seen, sequence)
+                        event = (flag, product)
+                    else:
+                        seen, product = self.preview
+                        event = ('preview', product)
+
+                if event[0] == 'preview':
+                    now = time.monotonic()
+                    if last_preview is not None and now - last_preview < min_preview_interval:
+                        continue
+                    last_preview = now
+                yield event
+                if event[0] == 'finish':
+                    return
+        finally:
+            with self.task.yields_condition:
+                self.task.preview_consumers -= 1
+
+
+def add_task(task):
+    task_id = uuid.uuid4().hex
+    with tasks_lock:
+        tasks[task_id] = TaskEvents(task)
+        while len(tasks) > max_tasks:
+            tasks.popitem(last=False)
+    return task_id
+
+
+class StreamRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        """Checks HTTP basic credentials against the server's auth function, if it has one."""
+        check_auth = getattr(self.server, 'check_auth', None)
+        if check_auth is None:
+            return True
+        header = self.headers.get('Authorization', '')
+        if header.startswith('Basic '):
+            try:
+                user, _, password = base64.b64decode(header[6:]).decode('utf-8').partition(':')
+                if check_auth(user, password):
+                    return True
+            except (binascii.Error, UnicodeDecodeError):
+                pass
+        body = json.dumps(dict(error='unauthorized')).encode('utf-8')
+        self.send_response(401)
+        self.send_header('WWW-Authenticate', 'Basic realm="Fooocus"')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return False
+
+    def do_POST(self):
+        from modules.async_worker import AsyncTask
+
+        if not self.authorized():
+            return
+        if self.path != '/v1/tasks':
+            return self.send_json(404, dict(error='not found'))
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            task = AsyncTask.from_request(json.loads(self.rfile.read(length) or b'{}'))
+        except Exception as e:
+            return self.send_json(400, dict(error=str(e)))
+        task_id = add_task(task.submit())
+        self.send_json(200, dict(task_id=task_id))
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        parts = self.path.strip('/').split('/')
+        if len(parts) < 3 or parts[:2] != ['v1', 'tasks']:
+            return self.send_json(404, dict(error='not found'))
+        with tasks_lock:
+            events = tasks.get(parts[2], None)
+        if events is None:
+            return self.send_json(404, dict(error='unknown task'))
+        task = events.task
+
+        if len(parts) == 3:
+            return self.send_json(200, dict(processing=task.processing, finished=task.finished,
+                                            results=encode_results(task.results) if task.finished else []))
+        if len(parts) != 4 or parts[3] != 'events':
+            return self.send_json(404, dict(error='not found'))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        interval = modules.config.default_stream_preview_interval / 1000.0
+        try:
+            for flag, product in events.subscribe(timeout=keep_alive_interval, min_preview_interval=interval):
+                if flag == 'keep-alive':
+                    # also finds out about clients that went away
+                    self.wfile.write(b': keep-alive\n\n')
+                else:
+                    self.wfile.write(f'event: {flag}\ndata: {json.dumps(event_data(flag, product))}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+
+def start(port, host='127.0.0.1', check_auth=None):
+    """Serves POST /v1/tasks, GET /v1/tasks/<id> and the event stream GET /v1/tasks/<id>/events on a daemon thread.
+    With check_auth(user, password) every request needs HTTP basic credentials."""
+    server = ThreadingHTTPServer((host, port), StreamRequestHandler)
+    server.daemon_threads = True
+    server.check_auth = check_auth
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'[Stream API] Serving task events on http://{host}:{port}/v1/tasks')
+    return server
@@ -175,6 +175,14 @@ def generate_temp_filename(folder='./outputs/', extension='png'):
     return date_string, os.path.abspath(result), filename
 
 
+def file_signature(filename):
+    """Name, size and modification time of a file, changes when the file is replaced even under the same name."""
+    if filename is None or not os.path.exists(filename):
+        return f'{os.path.basename(filename) if filename is not None else "None"}:0:0'
+    stat = os.stat(filename)
+    return f'{os.path.basename(filename)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
 def sha256(filename, use_addnet_hash=False, length=HASH_SHA256_LENGTH):
     if use_addnet_hash:
         with open(filename, "rb") as file:
@@ -0,0 +1,31 @@
+import unittest
+
+import torch
+
+import ldm_patched.k_diffusion.sampling as k_diffusion_sampling
+
+
+def model(x, sigma, **kwargs):
+    return x * 0.3
+
+
+class TestBatchedSeeds(unittest.TestCase):
+    def test_sde_batch_matches_images_sampled_alone(self):
+        seeds = [5, 6, 7]
+        sigmas = torch.cat([torch.linspace(10.0, 0.5, 8), torch.zeros(1)])
+        x = torch.randn(len(seeds), 4, 8, 8)
+
+        for sampler in [k_diffusion_sampling.sample_dpmpp_2m_sde_gpu, k_diffusion_sampling.sample_dpmpp_sde]:
+            batched = sampler(model, x.clone(), sigmas, extra_args={'seed': seeds}, disable=True)
+            for i, seed in enumerate(seeds):
+                alone = sampler(model, x[i:i + 1].clone(), sigmas, extra_args={'seed': seed}, disable=True)
+                self.assertTrue(torch.equal(batched[i:i + 1], alone))
+
+            # a single seed for the whole batch gives every later image different noise
+            shared = sampler(model, x.clone(), sigmas, extra_args={'seed': seeds[0]}, disable=True)
+            alone = sampler(model, x[1:2].clone(), sigmas, extra_args={'seed': seeds[1]}, disable=True)
+            self.assertFalse(torch.equal(shared[1:2], alone))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+import torch
+
+from modules.cond_cache import CondCache, clip_identity
+
+
+class TestCondCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = CondCache(capacity=2)
+        for key in ['a', 'b', 'c']:
+            cache.put(key, torch.zeros(1), torch.zeros(1))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+
+        cache.put('d', torch.zeros(1), torch.zeros(1))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(dict(entries=2, hits=2, disk_hits=0, misses=2), cache.stats())
+
+    def test_key_depends_on_identity_and_layer(self):
+        key = CondCache.make_key('model', -2, 'cat')
+        self.assertEqual(key, CondCache.make_key('model', -2, 'cat'))
+        self.assertNotEqual(key, CondCache.make_key('model', -1, 'cat'))
+        self.assertNotEqual(key, CondCache.make_key('other', -2, 'cat'))
+
+    def test_disk_spill(self):
+        with tempfile.TemporaryDirectory() as path:
+            cond, pooled = torch.randn(1, 77, 8), torch.randn(1, 4)
+            CondCache(capacity=1, path=path).put('ab' * 32, cond, pooled)
+
+            cache = CondCache(capacity=1, path=path)
+            cached_cond, cached_pooled = cache.get('ab' * 32)
+            self.assertTrue(torch.equal(cond, cached_cond))
+            self.assertTrue(torch.equal(pooled, cached_pooled))
+            self.assertEqual(1, cache.disk_hits)
+            self.assertIsNone(cache.get('cd' * 32, persistent=False))
+
+
+class TestClipIdentity(unittest.TestCase):
+    def test_replaced_files_change_identity(self):
+        with tempfile.TemporaryDirectory() as path:
+            checkpoint, lora = os.path.join(path, 'model.safetensors'), os.path.join(path, 'lora.safetensors')
+            for filename in [checkpoint, lora]:
+                with open(filename, 'wb') as f:
+                    f.write(b'a' * 16)
+            identity = clip_identity(checkpoint, [(lora, 0.5)])
+            self.assertEqual(identity, clip_identity(checkpoint, [(lora, 0.5)]))
+            self.assertNotEqual(identity, clip_identity(checkpoint, [(lora, 0.7)]))
+
+            # same name and size, new content
+            for filename in [checkpoint, lora]:
+                with open(filename, 'wb') as f:
+                    f.write(b'b' * 16)
+                os.utime(filename, ns=(0, 10 ** 9))
+                self.assertNotEqual(identity, clip_identity(checkpoint, [(lora, 0.5)]))
+                identity = clip_identity(checkpoint, [(lora, 0.5)])
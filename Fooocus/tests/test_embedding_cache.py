@@ -0,0 +1,31 @@
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from modules.embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_key_depends_on_content_adapter_and_crop(self):
+        img = np.zeros((8, 8, 3), dtype=np.uint8)
+        key = EmbeddingCache.make_key(img, 'ip-adapter.bin', 'none')
+        self.assertEqual(key, EmbeddingCache.make_key(img.copy(), 'ip-adapter.bin', 'none'))
+        self.assertNotEqual(key, EmbeddingCache.make_key(img, 'ip-adapter.bin', 'face'))
+        self.assertNotEqual(key, EmbeddingCache.make_key(img, 'ip-adapter-face.bin', 'none'))
+        img[0, 0, 0] = 1
+        self.assertNotEqual(key, EmbeddingCache.make_key(img, 'ip-adapter.bin', 'none'))
+
+    def test_disk_store(self):
+        with tempfile.TemporaryDirectory() as path:
+            ip_conds = [torch.randn(1, 16, 640) for _ in range(4)]
+            ip_unconds = [torch.randn(1, 16, 640) for _ in range(4)]
+            EmbeddingCache(capacity=1, path=path).put('ab' * 32, ip_conds, ip_unconds)
+
+            cache = EmbeddingCache(capacity=1, path=path)
+            cached_conds, cached_unconds = cache.get('ab' * 32)
+            self.assertTrue(all(torch.equal(a, b) for a, b in zip(ip_conds + ip_unconds, cached_conds + cached_unconds)))
+            self.assertEqual(4, len(cached_conds))
+            self.assertIsNone(cache.get('cd' * 32))
+            self.assertEqual(dict(entries=1, hits=0, disk_hits=1, misses=1), cache.stats())
@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+import modules.config
+import modules.flags
+from modules.generation_request import GenerationRequest, EnhanceTab, ImagePrompt, json_schema
+
+
+class TestGenerationRequest(unittest.TestCase):
+    def test_to_ctrls_matches_webui_length(self):
+        ctrls = GenerationRequest(prompt='cat').to_ctrls()
+        # 12 basic + 3 models + loras + 47 advanced + 3 save settings + image prompts + 8 enhance + enhance tabs
+        expected = 12 + 3 + 3 * modules.config.default_max_lora_number + 47 + 3 \
+            + 4 * modules.config.default_controlnet_image_count + 8 + 16 * modules.config.default_enhance_tabs
+        self.assertEqual(expected, len(ctrls))
+        self.assertEqual('cat', ctrls[1])
+
+    def test_loras_are_padded_and_normalized(self):
+        request = GenerationRequest(loras=[('a.safetensors', 0.5), (False, 'b.safetensors', 0.1)])
+        self.assertEqual([(True, 'a.safetensors', 0.5), (False, 'b.safetensors', 0.1)], request.loras)
+
+        ctrls = request.to_ctrls()
+        lora_ctrls = ctrls[15:15 + 3 * modules.config.default_max_lora_number]
+        self.assertEqual([True, 'a.safetensors', 0.5, False, 'b.safetensors', 0.1], lora_ctrls[:6])
+        self.assertEqual([False, 'None', 1.0], lora_ctrls[-3:])
+
+    def test_nested_fields_from_dict(self):
+        request = GenerationRequest.from_dict({
+            'image_prompts': [{'stop_at': 0.9, 'weight': 0.75, 'type': modules.flags.cn_ip_face}],
+            'enhance_tabs': [{'enabled': True, 'prompt': 'face'}],
+        })
+        self.assertIsInstance(request.image_prompts[0], ImagePrompt)
+        self.assertIsInstance(request.enhance_tabs[0], EnhanceTab)
+        self.assertRaises(ValueError, GenerationRequest.from_dict, {'promt': 'typo'})
+
+    def test_negative_seed_is_randomized(self):
+        self.assertGreaterEqual(GenerationRequest(seed=-1).seed, 0)
+        self.assertEqual(42, GenerationRequest(seed=42).seed)
+
+    def test_validate(self):
+        GenerationRequest(aspect_ratios_selection='896*1152').validate()
+        self.assertRaises(ValueError, GenerationRequest(performance_selection='Fastest').validate)
+        self.assertRaises(ValueError, GenerationRequest(image_number=0).validate)
+
+    def test_fingerprint(self):
+        a = GenerationRequest(prompt='cat', seed=1, uov_input_image=np.zeros((8, 8, 3), dtype=np.uint8))
+        b = GenerationRequest(prompt='cat', seed=1, uov_input_image=np.zeros((8, 8, 3), dtype=np.uint8))
+        c = GenerationRequest(prompt='cat', seed=1, uov_input_image=np.ones((8, 8, 3), dtype=np.uint8))
+        self.assertEqual(a.fingerprint(), b.fingerprint())
+        self.assertNotEqual(a.fingerprint(), c.fingerprint())
+
+    def test_json_schema_covers_all_fields(self):
+        schema = json_schema()
+        self.assertIn('prompt', schema['properties'])
+        self.assertEqual(modules.flags.Performance.values(), schema['properties']['performance_selection']['enum'])
+        self.assertIn('mask_model', schema['properties']['enhance_tabs']['items']['properties'])
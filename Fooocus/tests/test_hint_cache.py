@@ -0,0 +1,27 @@
+import unittest
+
+import numpy as np
+
+from modules.hint_cache import HintCache
+
+
+class TestHintCache(unittest.TestCase):
+    def test_key_depends_on_content_and_parameters(self):
+        img = np.zeros((8, 8, 3), dtype=np.uint8)
+        key = HintCache.make_key(img, 'PyraCanny', 1024, 1024, (False, 64, 128))
+        self.assertEqual(key, HintCache.make_key(img.copy(), 'PyraCanny', 1024, 1024, (False, 64, 128)))
+        self.assertNotEqual(key, HintCache.make_key(img, 'PyraCanny', 1024, 1024, (False, 64, 129)))
+        self.assertNotEqual(key, HintCache.make_key(img, 'PyraCanny', 1024, 896, (False, 64, 128)))
+        self.assertNotEqual(key, HintCache.make_key(img, 'CPDS', 1024, 1024, (False, 64, 128)))
+
+    def test_lru_eviction_and_read_only_hints(self):
+        cache = HintCache(capacity=1)
+        hint = np.zeros((8, 8, 3), dtype=np.uint8)
+        cache.put('a', hint)
+        self.assertIs(hint, cache.get('a'))
+        with self.assertRaises(ValueError):
+            hint[0, 0, 0] = 1
+
+        cache.put('b', np.zeros((8, 8, 3), dtype=np.uint8))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(dict(entries=1, hits=1, misses=1), cache.stats())
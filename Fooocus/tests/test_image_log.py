@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+import urllib.parse
+
+import modules.image_log as image_log
+
+
+def legacy_item(name, metadata, positive, negative):
+    # the markup private_logger wrote before log.jsonl
+    item = f"<div id=\"{name.replace('.', '_')}\" class=\"image-container\"><hr><table><tr>\n"
+    item += f"<td><a href=\"{name}\" target=\"_blank\"><img src='{name}' loading='lazy'/></a><div>{name}</div></td>"
+    item += "<td><table class='metadata'>"
+    for label, key, value in metadata:
+        item += f"<tr><td class='label'>{label}</td><td class='value'>{str(value).replace(chr(10), ' </br> ')}</td></tr>\n"
+    item += f"""<tr><td class='label'>Full raw prompt</td><td class='value'><details><summary>Positive</summary>{', '.join(positive)}</details>
+        <details><summary>Negative</summary>{', '.join(negative)}</details></td></tr>\n"""
+    js_txt = urllib.parse.quote(json.dumps({k: v for _, k, v, in metadata}, indent=0), safe='')
+    item += f"</table></br><button onclick=\"to_clipboard('{js_txt}')\">Copy to Clipboard</button></td></tr></table></div>\n\n"
+    return item
+
+
+class TestImageLog(unittest.TestCase):
+    def test_migrates_legacy_html(self):
+        first = [['Prompt', 'prompt', 'a cat\nin the rain'], ['Seed', 'seed', '42']]
+        second = [['Prompt', 'prompt', "a dog's day"], ['Seed', 'seed', '7']]
+        with tempfile.TemporaryDirectory() as path:
+            html_name, jsonl_name = os.path.join(path, 'log.html'), os.path.join(path, 'log.jsonl')
+            with open(html_name, 'w', encoding='utf-8') as f:
+                f.write('<html><body><!--fooocus-log-split-->\n\n' + legacy_item('b.png', second, ['dog'], [])
+                        + legacy_item('a.png', first, ['cat', 'rain'], ['blur']) + '\n<!--fooocus-log-split--></body></html>')
+
+            image_log.ensure_viewer(html_name, jsonl_name, '2024-01-01')
+            image_log.append_entry(jsonl_name, image_log.make_entry('c.png', [('Seed', 'seed', 1)]))
+
+            with open(jsonl_name, 'r', encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f]
+            self.assertEqual(['a.png', 'b.png', 'c.png'], [e['image'] for e in entries])
+            self.assertEqual(first, entries[0]['metadata'])
+            self.assertEqual((['cat', 'rain'], ['blur']), (entries[0]['positive'], entries[0]['negative']))
+            self.assertEqual(second, entries[1]['metadata'])
+            self.assertTrue(os.path.exists(os.path.join(path, 'log_legacy.html')))
+
+            with open(html_name, 'r', encoding='utf-8') as f:
+                self.assertIn(image_log.VIEWER_MARK, f.read())
+            image_log.ensure_viewer(html_name, jsonl_name, '2024-01-01')
+            with open(jsonl_name, 'r', encoding='utf-8') as f:
+                self.assertEqual(3, len(f.readlines()))
+            with open(os.path.join(path, 'log.js'), 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            self.assertEqual(3, len(lines))
+            self.assertEqual(entries[2], json.loads(lines[2][len('log_entries.push('):-len(');\n')]))
+
+    def test_matches_legacy_labels_by_key(self):
+        # two LoRA rows share one clipboard key, so the rows after them no longer line up with the keys
+        metadata = [['LoRA 1', 'lora_combined_1', 'a.safetensors : 0.5'], ['LoRA 2', 'lora_combined_1', 'b.safetensors : 1'],
+                    ['Seed', 'seed', '42'], ['Sampler', 'sampler', 'dpmpp_2m_sde_gpu']]
+        html = '<!--fooocus-log-split-->\n\n' + legacy_item('a.png', metadata, ['cat'], []) + '\n<!--fooocus-log-split-->'
+        entry, = image_log.parse_legacy_html(html)
+        self.assertEqual([['LoRA 1', 'lora_1', 'a.safetensors : 0.5'], ['LoRA 2', 'lora_combined_1', 'b.safetensors : 1'],
+                          ['Seed', 'seed', '42'], ['Sampler', 'sampler', 'dpmpp_2m_sde_gpu']], entry['metadata'])
+
+    def test_rewrites_fetch_viewer(self):
+        with tempfile.TemporaryDirectory() as path:
+            html_name, jsonl_name = os.path.join(path, 'log.html'), os.path.join(path, 'log.jsonl')
+            image_log.append_entry(jsonl_name, image_log.make_entry('a.png', [('Seed', 'seed', 1)]))
+            os.remove(os.path.join(path, 'log.js'))
+            with open(html_name, 'w', encoding='utf-8') as f:
+                f.write('<html><body><!--fooocus-log-viewer--><script>fetch("log.jsonl")</script></body></html>')
+
+            image_log.ensure_viewer(html_name, jsonl_name, '2024-01-01')
+
+            with open(html_name, 'r', encoding='utf-8') as f:
+                text = f.read()
+            self.assertIn(image_log.VIEWER_MARK, text)
+            self.assertNotIn("fetch('log.jsonl'", text)
+            self.assertFalse(os.path.exists(os.path.join(path, 'log_legacy.html')))
+            with open(os.path.join(path, 'log.js'), 'r', encoding='utf-8') as f:
+                self.assertEqual(image_log.script_line(image_log.make_entry('a.png', [('Seed', 'seed', 1)])), f.read())
@@ -0,0 +1,93 @@
+import unittest
+
+import cv2
+import numpy as np
+from PIL import Image, ImageFilter
+
+import modules.inpaint_worker as inpaint_worker
+
+
+def reference_morphological_open(x):
+    x_int16 = np.zeros_like(x, dtype=np.int16)
+    x_int16[x > 127] = 256
+    for _ in range(32):
+        maxed = cv2.dilate(x_int16, np.ones((3, 3), dtype=np.int16)) - 8
+        x_int16 = np.maximum(maxed, x_int16)
+    return np.clip(x_int16, 0, 255).astype(np.uint8)
+
+
+def reference_solve_abcd(x, a, b, c, d, k):
+    H, W = x.shape[:2]
+    if k == 1.0:
+        return 0, H, 0, W
+    while not (b - a >= H * k and d - c >= W * k):
+        add_h = (b - a) < (d - c)
+        add_w = not add_h
+        if b - a == H:
+            add_w = True
+        if d - c == W:
+            add_h = True
+        if add_h:
+            a, b = a - 1, b + 1
+        if add_w:
+            c, d = c - 1, d + 1
+        a, b, c, d = inpaint_worker.regulate_abcd(x, a, b, c, d)
+    return a, b, c, d
+
+
+def reference_fooocus_fill(image, mask):
+    current_image = image.copy()
+    area = np.where(mask < 127)
+    store = image[area]
+    for k, repeats in [(512, 2), (256, 2), (128, 4), (64, 4), (33, 8), (15, 8), (5, 16), (3, 16)]:
+        for _ in range(repeats):
+            current_image = np.array(Image.fromarray(current_image).filter(ImageFilter.BoxBlur(k)))
+            current_image[area] = store
+    return current_image
+
+
+def make_case(H, W, seed):
+    rng = np.random.default_rng(seed)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (H, W, 3), dtype=np.uint8), (0, 0), 3)
+    mask = np.zeros((H, W), dtype=np.uint8)
+    cv2.circle(mask, (W // 2, H // 3), min(H, W) // 4, 255, -1)
+    cv2.rectangle(mask, (0, H - H // 5), (W // 4, H - 1), 200, -1)
+    return image, mask
+
+
+class TestInpaintWorker(unittest.TestCase):
+    def test_morphological_open_matches_dilation_loop(self):
+        for seed in range(3):
+            _, mask = make_case(97, 131, seed)
+            mask[np.random.default_rng(seed).random(mask.shape) < 0.002] = 255
+            np.testing.assert_array_equal(inpaint_worker.morphological_open(mask), reference_morphological_open(mask))
+        empty = np.zeros((16, 16), dtype=np.uint8)
+        np.testing.assert_array_equal(inpaint_worker.morphological_open(empty), empty)
+
+    def test_solve_abcd_matches_growing_loop(self):
+        rng = np.random.default_rng(0)
+        for _ in range(2000):
+            H, W = rng.integers(1, 64, size=2)
+            a, c = rng.integers(0, H), rng.integers(0, W)
+            b, d = rng.integers(a + 1, H + 1), rng.integers(c + 1, W + 1)
+            k = rng.choice([0.0, 0.5, 0.618, rng.random(), 1.0])
+            x = np.zeros((H, W), dtype=np.uint8)
+            self.assertEqual(inpaint_worker.solve_abcd(x, a, b, c, d, k), reference_solve_abcd(x, a, b, c, d, k))
+
+    def test_fooocus_fill_close_to_box_blur_fill(self):
+        image, mask = make_case(320, 448, 0)
+        result = inpaint_worker.fooocus_fill(image, mask)
+        reference = reference_fooocus_fill(image, mask)
+        keep = mask < 127
+        np.testing.assert_array_equal(result[keep], image[keep])
+        difference = np.abs(result.astype(np.int32) - reference.astype(np.int32))
+        self.assertLessEqual(difference.max(), 3)
+        self.assertLess(difference.mean(), 0.5)
+
+    def test_fooocus_fill_without_mask_is_identity(self):
+        image, _ = make_case(32, 48, 1)
+        np.testing.assert_array_equal(inpaint_worker.fooocus_fill(image, np.zeros((32, 48), dtype=np.uint8)), image)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from modules.latent_cache import LatentCache, vae_identity
+
+
+class TestLatentCache(unittest.TestCase):
+    def test_key_depends_on_image_vae_and_tiling(self):
+        img = np.zeros((16, 16, 3), dtype=np.uint8)
+        vae, other_vae = SimpleNamespace(), SimpleNamespace()
+        key = LatentCache.make_key('encode_vae', img, vae_identity(vae), False)
+        self.assertEqual(key, LatentCache.make_key('encode_vae', img.copy(), vae_identity(vae), False))
+        self.assertNotEqual(key, LatentCache.make_key('encode_vae', img, vae_identity(vae), True))
+        self.assertNotEqual(key, LatentCache.make_key('encode_vae', img, vae_identity(other_vae), False))
+        self.assertNotEqual(key, LatentCache.make_key('encode_vae', img[:8], vae_identity(vae), False))
+
+    def test_budget_eviction_and_counters(self):
+        latent_bytes = 4 * 8 * 8 * 4
+        cache = LatentCache(budget=2 * latent_bytes)
+        calls = []
+
+        def encode(name):
+            calls.append(name)
+            return torch.zeros(1, 4, 8, 8)
+
+        for name in ['a', 'b', 'a', 'c', 'b']:
+            cache.get_or_compute(name, lambda: encode(name))
+        self.assertEqual(['a', 'b', 'c', 'b'], calls)
+        self.assertEqual(dict(entries=2, bytes=2 * latent_bytes, hits=1, misses=4), cache.stats())
+
+        cache.put('too big', torch.zeros(1, 4, 16, 16))
+        self.assertIsNone(cache.get('too big'))
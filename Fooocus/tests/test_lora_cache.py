@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+import safetensors.torch
+import torch
+
+from modules.lora_cache import MergedWeightCache, LazySafetensors, stack_key, match_lora_cached
+
+
+class TestMergedWeightCache(unittest.TestCase):
+    def test_lru_by_stack(self):
+        cache = MergedWeightCache(budget=2 * 16)
+        cache.put('a', 'w', torch.zeros(4))
+        cache.put('b', 'w', torch.zeros(4))
+        self.assertIsNotNone(cache.get('a', 'w'))
+
+        cache.put('c', 'w', torch.zeros(4))
+        self.assertIsNone(cache.get('b', 'w'))
+        self.assertIsNotNone(cache.get('a', 'w'))
+        self.assertIsNotNone(cache.get('c', 'w'))
+
+    def test_oversized_stack_is_not_cached(self):
+        cache = MergedWeightCache(budget=16)
+        cache.put('a', 'w1', torch.zeros(4))
+        cache.put('a', 'w2', torch.zeros(4))
+        cache.put('a', 'w3', torch.zeros(4))
+        self.assertIsNone(cache.get('a', 'w1'))
+        self.assertIsNone(cache.get('a', 'w3'))
+
+    def test_flush_and_reload(self):
+        with tempfile.TemporaryDirectory() as path:
+            weight = torch.randn(4, 4, dtype=torch.float16)
+            cache = MergedWeightCache(budget=1024, path=path)
+            cache.put('a', 'w', weight)
+            cache.flush()
+
+            cache = MergedWeightCache(budget=1024, path=path)
+            self.assertTrue(torch.equal(weight, cache.get('a', 'w')))
+
+    def test_stack_key(self):
+        self.assertEqual(stack_key('model.safetensors', 'unet', [('/loras/a.safetensors', 0.5)]),
+                         stack_key('model.safetensors', 'unet', [('/other/a.safetensors', 0.5)]))
+        self.assertNotEqual(stack_key('model.safetensors', 'unet', [('a.safetensors', 0.5)]),
+                            stack_key('model.safetensors', 'clip', [('a.safetensors', 0.5)]))
+
+    def test_stack_key_changes_with_replaced_lora(self):
+        with tempfile.TemporaryDirectory() as path:
+            lora = os.path.join(path, 'a.safetensors')
+            with open(lora, 'wb') as f:
+                f.write(b'a' * 16)
+            key = stack_key('model.safetensors', 'unet', [(lora, 0.5)])
+            self.assertEqual(key, stack_key('model.safetensors', 'unet', [(lora, 0.5)]))
+
+            # edited in place, same name and size
+            with open(lora, 'wb') as f:
+                f.write(b'b' * 16)
+            os.utime(lora, ns=(0, 10 ** 9))
+            self.assertNotEqual(key, stack_key('model.safetensors', 'unet', [(lora, 0.5)]))
+
+
+class TestLoraFileCache(unittest.TestCase):
+    def test_lazy_safetensors(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'lora.safetensors')
+            safetensors.torch.save_file({'a': torch.ones(2), 'b': torch.zeros(3)}, filename)
+
+            lora = LazySafetensors(filename)
+            self.assertEqual(['a', 'b'], sorted(lora.keys()))
+            self.assertIn('a', lora)
+            self.assertNotIn('c', lora)
+            self.assertEqual(0, len(lora.tensors))
+            self.assertTrue(torch.equal(torch.ones(2), lora['a']))
+            self.assertIs(lora['a'], lora['a'])
+            self.assertEqual(1, len(lora.tensors))
+
+    def test_match_lora_is_memoized(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'lora.safetensors')
+            safetensors.torch.save_file({
+                'unet_key.lora_up.weight': torch.ones(4, 2),
+                'unet_key.lora_down.weight': torch.ones(2, 4),
+                'clip_key.diff': torch.ones(4),
+                'unknown': torch.ones(1),
+            }, filename)
+
+            unet, clip, unmatch = match_lora_cached(filename, 'model', {'unet_key': 'unet.weight'},
+                                                    {'clip_key': 'clip.weight'})
+            self.assertEqual('lora', unet['unet.weight'][0])
+            self.assertEqual('diff', clip['clip.weight'][0])
+            self.assertEqual(['unknown'], list(unmatch.keys()))
+            self.assertIs(unet, match_lora_cached(filename, 'model', {}, {})[0])
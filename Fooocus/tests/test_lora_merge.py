@@ -0,0 +1,32 @@
+import unittest
+
+import torch
+
+from modules.lora_merge import LoraMergePlan
+
+
+def lora(out_features, in_features, rank=4):
+    return 'lora', (torch.randn(out_features, rank), torch.randn(rank, in_features), None, None)
+
+
+class TestLoraMergePlan(unittest.TestCase):
+    def test_groups_by_factor_shapes(self):
+        a, b, c = lora(8, 16), lora(8, 16), lora(16, 8)
+        plan = LoraMergePlan([[(1.0, a, 1.0)], [(1.0, b, 1.0), (1.0, c, 1.0)]])
+        self.assertEqual(2, len(plan.groups))
+
+        device = torch.device('meta')
+        self.assertEqual((8, 16), plan.delta(a, device).shape)
+        self.assertEqual(2, plan.batched)
+        self.assertEqual((8, 16), plan.delta(b, device).shape)
+        self.assertEqual(2, plan.batched)
+        self.assertIsNone(plan.delta(c, device))
+
+    def test_chunks_and_cpu_fallback(self):
+        patches = [lora(8, 16) for _ in range(5)]
+        plan = LoraMergePlan([[(1.0, v, 1.0)] for v in patches], chunk_elements=8 * 16 * 2)
+        for v in patches:
+            plan.delta(v, torch.device('meta'))
+        self.assertEqual(5, plan.batched)
+        self.assertEqual(0, len(plan.deltas))
+        self.assertIsNone(plan.delta(patches[0], torch.device('cpu')))
@@ -0,0 +1,38 @@
+import enum
+import json
+import unittest
+from types import SimpleNamespace
+
+import torch
+
+import modules.config
+import modules.model_cache
+
+
+class ModelType(enum.Enum):
+    EPS = 1
+
+
+class SDXL:
+    def __init__(self, unet_config):
+        self.unet_config = unet_config
+
+
+class TestModelCache(unittest.TestCase):
+    def test_disabled_without_path(self):
+        path = modules.config.fast_load_cache_path
+        try:
+            modules.config.fast_load_cache_path = ''
+            self.assertIsNone(modules.model_cache.cache_directory('model.safetensors'))
+            modules.config.fast_load_cache_path = 'None'
+            self.assertIsNone(modules.model_cache.cache_directory('model.safetensors'))
+        finally:
+            modules.config.fast_load_cache_path = path
+
+    def test_model_config_to_json(self):
+        model = SimpleNamespace(model_config=SDXL({'model_channels': 320, 'transformer_depth': [0, 0, 2, 2],
+                                                   'dtype': torch.float16}), model_type=ModelType.EPS)
+        config = json.loads(json.dumps(modules.model_cache.model_config_to_json(model)))
+        self.assertEqual('SDXL', config['model_config'])
+        self.assertEqual('EPS', config['model_type'])
+        self.assertEqual({'model_channels': 320, 'transformer_depth': [0, 0, 2, 2]}, config['unet_config'])
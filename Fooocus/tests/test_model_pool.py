@@ -0,0 +1,30 @@
+import unittest
+
+from modules.model_pool import ModelPool
+
+
+class TestModelPool(unittest.TestCase):
+    def test_lru_within_budget(self):
+        pool = ModelPool(budget=2)
+        a, b, c = object(), object(), object()
+        pool.put('a', a, 1)
+        pool.put('b', b, 1)
+        self.assertIs(a, pool.get('a'))
+
+        pool.put('c', c, 1)
+        self.assertIsNone(pool.get('b'))
+        self.assertIs(a, pool.get('a'))
+        self.assertEqual(2, pool.total_size())
+
+    def test_models_in_use_are_kept(self):
+        pool = ModelPool(budget=0)
+        a, b = object(), object()
+        pool.put('a', a, 1)
+        self.assertIs(a, pool.get('a'))
+
+        pool.put('b', b, 1, keep=[a])
+        self.assertIs(a, pool.get('a'))
+        self.assertIs(b, pool.get('b'))
+
+        pool.put('b', b, 1)
+        self.assertIsNone(pool.get('a'))
@@ -0,0 +1,26 @@
+import os
+import tempfile
+import unittest
+
+import torch
+import safetensors.torch
+
+import modules.prefetch
+from modules.lora_cache import load_lora_file
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_prefetch_and_wait(self):
+        with tempfile.TemporaryDirectory() as path:
+            vae = os.path.join(path, 'vae.bin')
+            with open(vae, 'wb') as f:
+                f.write(os.urandom(1024))
+            lora = os.path.join(path, 'lora.safetensors')
+            safetensors.torch.save_file({'a.lora_up.weight': torch.ones(2, 1)}, lora)
+
+            modules.prefetch.prefetch([('vae', vae), ('lora', lora), ('lora', os.path.join(path, 'missing'))])
+            self.assertNotIn(os.path.join(path, 'missing'), modules.prefetch.futures)
+            modules.prefetch.wait(vae)
+            modules.prefetch.wait(lora)
+
+            self.assertIn('a.lora_up.weight', load_lora_file(lora).tensors)
@@ -0,0 +1,25 @@
+import unittest
+
+from modules.preview_policy import PreviewPolicy
+
+
+class TestPreviewPolicy(unittest.TestCase):
+    def test_every_n_steps_keeps_last_step(self):
+        policy = PreviewPolicy(every_n_steps=4)
+        rendered = [step for step in range(10) if policy.should_preview(step, 10)]
+        self.assertEqual([3, 7, 9], rendered)
+        self.assertEqual(dict(rendered=3, skipped=7), policy.stats())
+
+    def test_min_interval(self):
+        policy = PreviewPolicy(min_interval=3600)
+        rendered = [step for step in range(5) if policy.should_preview(step, 5)]
+        self.assertEqual([0, 4], rendered)
+
+    def test_unwatched_skips_everything(self):
+        watched = [False]
+        policy = PreviewPolicy(watched=lambda: watched[0])
+        self.assertFalse(policy.should_preview(0, 2))
+        self.assertFalse(policy.should_preview(1, 2))
+        watched[0] = True
+        self.assertTrue(policy.should_preview(1, 2))
+        self.assertEqual(dict(rendered=1, skipped=2), policy.stats())
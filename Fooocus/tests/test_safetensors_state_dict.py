@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+import torch
+
+import ldm_patched.modules.utils as utils
+
+
+class TestSafetensorsStateDict(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'model.safetensors')
+        self.tensors = {'a.weight': torch.randn(4, 3), 'a.bias': torch.randn(4), 'b.weight': torch.randn(2, 2)}
+        utils.save_torch_file(self.tensors, self.filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_mapping(self):
+        sd = utils.load_torch_file(self.filename, lazy=True)
+        self.assertIsInstance(sd, utils.SafetensorsStateDict)
+        self.assertEqual(set(self.tensors), set(sd.keys()))
+        self.assertEqual(16, utils.calculate_parameters(sd, 'a.'))
+        self.assertTrue(torch.equal(self.tensors['a.bias'], sd.pop('a.bias')))
+        self.assertNotIn('a.bias', sd)
+
+        sd['c'] = torch.zeros(1)
+        self.assertEqual(3, len(sd))
+        self.assertTrue(torch.equal(torch.zeros(1), sd['c']))
+
+    def test_renames_do_not_read(self):
+        sd = utils.load_torch_file(self.filename, lazy=True)
+        sd = utils.state_dict_prefix_replace(sd, {'a.': 'x.'})
+        sd = utils.state_dict_key_replace(sd, {'b.weight': 'y.weight'})
+        self.assertEqual({}, sd.tensors)
+        self.assertEqual({'x.weight', 'x.bias', 'y.weight'}, set(sd.keys()))
+        self.assertTrue(torch.equal(self.tensors['a.weight'], sd['x.weight']))
+
+        vae = utils.state_dict_prefix_replace(sd, {'x.': ''}, filter_keys=True)
+        self.assertEqual({'weight', 'bias'}, set(vae.keys()))
+        self.assertEqual(['y.weight'], list(sd.keys()))
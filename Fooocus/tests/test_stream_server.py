@@ -0,0 +1,68 @@
+import base64
+import io
+import queue
+import threading
+import unittest
+
+import numpy as np
+from PIL import Image
+
+import modules.stream_server as stream_server
+
+
+class FakeTask:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.yields_condition = threading.Condition()
+        self.preview_consumers = 0
+
+    def emit(self, flag, product):
+        self.queue.put((flag, product))
+
+    def stream_events(self, timeout=None, previews=True):
+        while True:
+            flag, product = self.queue.get()
+            yield flag, product
+            if flag == 'finish':
+                return
+
+
+class TestStreamServer(unittest.TestCase):
+    def test_preview_event_is_jpeg(self):
+        data = stream_server.event_data('preview', (40, 'Sampling step 8/20', np.zeros((8, 8, 3), dtype=np.uint8)))
+        self.assertEqual(40, data['percentage'])
+        self.assertEqual('JPEG', Image.open(io.BytesIO(base64.b64decode(data['preview']))).format)
+        self.assertIsNone(stream_server.event_data('preview', (1, 'Loading', None))['preview'])
+
+    def test_results_keep_paths(self):
+        data = stream_server.event_data('finish', ['outputs/a.png', np.zeros((4, 4, 3), dtype=np.uint8)])
+        self.assertEqual('outputs/a.png', data['images'][0])
+        self.assertEqual('PNG', Image.open(io.BytesIO(base64.b64decode(data['images'][1]))).format)
+
+    def test_registry_is_bounded(self):
+        ids = [stream_server.add_task(FakeTask()) for _ in range(stream_server.max_tasks + 1)]
+        self.assertNotIn(ids[0], stream_server.tasks)
+        self.assertIn(ids[-1], stream_server.tasks)
+        stream_server.tasks.clear()
+
+    def test_every_subscriber_gets_every_event(self):
+        task = FakeTask()
+        events = stream_server.TaskEvents(task)
+        first, second = events.subscribe(timeout=5), events.subscribe(timeout=5)
+        task.emit('preview', (10, 'Sampling', None))
+        self.assertEqual('preview', next(first)[0])
+        self.assertEqual('preview', next(second)[0])
+        self.assertEqual(2, task.preview_consumers)
+
+        task.emit('results', ['a.png'])
+        task.emit('finish', ['a.png'])
+        for subscriber in [first, second]:
+            self.assertEqual([('results', ['a.png']), ('finish', ['a.png'])], list(subscriber))
+        self.assertEqual(0, task.preview_consumers)
+
+        # a reconnect after finish replays the latest preview and the results and returns instead of waiting
+        self.assertEqual(['preview', 'results', 'finish'], [flag for flag, _ in events.subscribe(timeout=5)])
+
+    def test_keep_alive_while_task_is_idle(self):
+        events = stream_server.TaskEvents(FakeTask())
+        self.assertEqual(('keep-alive', None), next(events.subscribe(timeout=0.01)))
@@ -5,7 +5,6 @@ Converts Windows paths to Linux and uses RunPod's shared model storage
 
 import os
 import sys
-import time
 import json
 
 # Setup paths for RunPod
@@ -19,6 +18,7 @@ import modules.config as config
 import modules.flags as flags
 import modules.async_worker as worker
 from modules.async_worker import AsyncTask
+from modules.generation_request import GenerationRequest
 
 # Update model paths for RunPod shared storage
 # RunPod typically mounts models at /workspace/models or similar
@@ -52,160 +52,52 @@ def generate_for_queue(prompt, request_id=None, parameters=None):
     
     print(f"\n[Queue {request_id}] Generating: {prompt[:80]}...")
     
-    # Build control parameters
-    ctrls = []
-    
-    # Basic parameters
-    ctrls.append(None)  # currentTask
-    ctrls.append(False)  # generate_image_grid
-    ctrls.append(prompt)  # prompt
-    ctrls.append(parameters.get('negative_prompt', ''))  # negative_prompt
-    ctrls.append(parameters.get('styles', ["Fooocus V2", "Fooocus Enhance", "Fooocus Sharp"]))  # styles
-    ctrls.append(parameters.get('performance', 'Quality'))  # performance
-    ctrls.append(parameters.get('resolution', '896×1152'))  # aspect_ratio
-    ctrls.append(parameters.get('image_number', 1))  # image_number
-    ctrls.append(parameters.get('output_format', 'png'))  # output_format
-    ctrls.append(parameters.get('seed', -1))  # image_seed (-1 for random)
-    ctrls.append(False)  # read_wildcards_in_order
-    ctrls.append(parameters.get('sharpness', 2.0))  # sharpness
-    ctrls.append(parameters.get('cfg', 4.0))  # guidance_scale
-    
-    # Models
-    ctrls.append(parameters.get('base_model', 'juggernautXL_v8Rundiffusion.safetensors'))
-    ctrls.append(parameters.get('refiner_model', 'realisticStockPhoto_v20.safetensors'))
-    ctrls.append(parameters.get('refiner_switch', 0.6))
-    
     # LoRAs - Default to your working configuration
     loras = parameters.get('loras', [
         {'enabled': True, 'name': 'remy.safetensors', 'weight': 0.94},
         {'enabled': True, 'name': 'RealVisXL_V5.0_fp32.safetensors', 'weight': 0.6},
         {'enabled': True, 'name': 'super-realism.safetensors', 'weight': 0.69},
-        {'enabled': False, 'name': 'None', 'weight': 1.0},
-        {'enabled': False, 'name': 'None', 'weight': 1.0}
     ])
     
-    # Ensure we have exactly 5 LoRA slots
-    while len(loras) < 5:
-        loras.append({'enabled': False, 'name': 'None', 'weight': 1.0})
-    
-    for lora in loras[:5]:
-        ctrls.append(lora.get('enabled', False))
-        ctrls.append(lora.get('name', 'None'))
-        ctrls.append(lora.get('weight', 1.0))
-    
-    # Image input parameters
-    ctrls.append(False)  # input_image_checkbox
-    ctrls.append('uov_tab')  # current_tab
-    ctrls.append(flags.disabled)  # uov_method
-    ctrls.append(None)  # uov_input_image
-    
-    # Outpaint/Inpaint
-    ctrls.append([])  # outpaint_selections
-    ctrls.append(None)  # inpaint_input_image
-    ctrls.append("")  # inpaint_additional_prompt
-    ctrls.append(None)  # inpaint_mask_image
-    
-    # Display settings
-    ctrls.append(False)  # disable_preview
-    ctrls.append(False)  # disable_intermediate_results
-    ctrls.append(False)  # disable_seed_increment
-    ctrls.append(False)  # black_out_nsfw
-    
-    # ADM settings
-    ctrls.append(parameters.get('adm_positive', 1.5))
-    ctrls.append(parameters.get('adm_negative', 0.8))
-    ctrls.append(parameters.get('adm_end', 0.3))
-    ctrls.append(parameters.get('adaptive_cfg', 7.0))
-    ctrls.append(parameters.get('clip_skip', 2))
-    
-    # Sampler settings
-    ctrls.append(parameters.get('sampler', 'dpmpp_2m_sde_gpu'))
-    ctrls.append(parameters.get('scheduler', 'karras'))
-    ctrls.append(flags.default_vae)
-    
-    # Overwrite settings (all -1 for defaults)
-    for _ in range(6):
-        ctrls.append(-1)
-    
-    # Mixing settings
-    ctrls.append(False)
-    ctrls.append(False)
-    
-    # ControlNet preprocessing
-    ctrls.append(False)
-    ctrls.append(False)
-    ctrls.append(64)
-    ctrls.append(128)
-    
-    # Refiner settings
-    ctrls.append('joint')
-    ctrls.append(0.25)
-    
-    # FreeU settings
-    ctrls.append(False)
-    ctrls.append(1.01)
-    ctrls.append(1.02)
-    ctrls.append(0.99)
-    ctrls.append(0.95)
-    
-    # Inpaint settings
-    ctrls.append(False)
-    ctrls.append(False)
-    ctrls.append('v2.6')
-    ctrls.append(1.0)
-    ctrls.append(0.618)
-    ctrls.append(False)
-    ctrls.append(False)
-    ctrls.append(0)
-    
-    # Save settings
-    ctrls.append(False)
-    ctrls.append(False)
-    ctrls.append('fooocus')
-    
-    # IP ControlNet (4 sets)
-    for _ in range(4):
-        ctrls.append(None)
-        ctrls.append(0.6)
-        ctrls.append(0.5)
-        ctrls.append(flags.default_ip)
-    
-    # DINO/Enhance settings
-    ctrls.append(False)
-    ctrls.append(0)
-    ctrls.append(False)
-    ctrls.append(None)
-    ctrls.append(False)
-    ctrls.append(flags.disabled)
-    ctrls.append(flags.enhancement_uov_before)
-    ctrls.append(flags.enhancement_uov_prompt_type_original)
-    
-    # Enhance tabs (3 sets)
-    for _ in range(3):
-        ctrls.append(False)
-        ctrls.append("")
-        ctrls.append("")
-        ctrls.append("")
-        ctrls.append('u2net')
-        ctrls.append('full')
-        ctrls.append('vit_b')
-        ctrls.append(0.3)
-        ctrls.append(0.25)
-        ctrls.append(10)
-        ctrls.append(flags.inpaint_option_default)
-        ctrls.append(False)
-        ctrls.append('v2.6')
-        ctrls.append(1.0)
-        ctrls.append(0.618)
-        ctrls.append(0)
-        ctrls.append(False)
-    
-    # Remove currentTask
-    ctrls.pop(0)
+    # Build the request
+    request = GenerationRequest(
+        prompt=prompt,
+        negative_prompt=parameters.get('negative_prompt', ''),
+        style_selections=parameters.get('styles', ["Fooocus V2", "Fooocus Enhance", "Fooocus Sharp"]),
+        performance_selection=parameters.get('performance', 'Quality'),
+        aspect_ratios_selection=parameters.get('resolution', '896×1152'),
+        image_number=parameters.get('image_number', 1),
+        output_format=parameters.get('output_format', 'png'),
+        seed=parameters.get('seed', -1),  # -1 for random
+        sharpness=parameters.get('sharpness', 2.0),
+        cfg_scale=parameters.get('cfg', 4.0),
+        base_model_name=parameters.get('base_model', 'juggernautXL_v8Rundiffusion.safetensors'),
+        refiner_model_name=parameters.get('refiner_model', 'realisticStockPhoto_v20.safetensors'),
+        refiner_switch=parameters.get('refiner_switch', 0.6),
+        loras=[(lora.get('enabled', False), lora.get('name', 'None'), lora.get('weight', 1.0)) for lora in loras[:5]],
+        disable_preview=False,
+        black_out_nsfw=False,
+        adm_scaler_positive=parameters.get('adm_positive', 1.5),
+        adm_scaler_negative=parameters.get('adm_negative', 0.8),
+        adm_scaler_end=parameters.get('adm_end', 0.3),
+        adaptive_cfg=parameters.get('adaptive_cfg', 7.0),
+        clip_skip=parameters.get('clip_skip', 2),
+        sampler_name=parameters.get('sampler', 'dpmpp_2m_sde_gpu'),
+        scheduler_name=parameters.get('scheduler', 'karras'),
+        vae_name=flags.default_vae,
+        overwrite_step=-1,
+        overwrite_switch=-1,
+        overwrite_upscale_strength=-1,
+        inpaint_engine='v2.6',
+        save_final_enhanced_image_only=False,
+        save_metadata_to_images=False,
+        metadata_scheme='fooocus',
+        enhance_checkbox=False,
+        enhance_uov_method=flags.disabled,
+    )
     
     # Create and queue task
-    task = AsyncTask(args=ctrls)
-    worker.async_tasks.append(task)
+    task = AsyncTask.from_request(request).submit()
     
     print(f"[Queue {request_id}] Task queued with parameters:")
     print(f"  Performance: {parameters.get('performance', 'Quality')}")
@@ -215,7 +107,6 @@ def generate_for_queue(prompt, request_id=None, parameters=None):
     
     # Wait for completion with progress callbacks
     timeout = 180 if parameters.get('performance', 'Quality') == 'Quality' else 90
-    start = time.time()
     last_preview = None
     
     result = {
@@ -225,28 +116,18 @@ def generate_for_queue(prompt, request_id=None, parameters=None):
         'output': None
     }
     
-    while time.time() - start < timeout:
-        time.sleep(0.1)
-        
-        while len(task.yields) > 0:
-            flag, product = task.yields.pop(0)
-            if flag == 'preview':
-                percentage, title, _ = product
-                if percentage != last_preview:
-                    result['progress'] = percentage
-                    result['message'] = title
-                    print(f"[Queue {request_id}] {percentage}% - {title}")
-                    last_preview = percentage
-            elif flag == 'finish':
-                print(f"[Queue {request_id}] ✓ Generation complete!")
-                result['status'] = 'completed'
-                result['output'] = product
-                return result
-        
-        if len(task.results) > 0:
+    for flag, product in task.stream_events(timeout=timeout, previews=False):
+        if flag == 'preview':
+            percentage, title, _ = product
+            if percentage != last_preview:
+                result['progress'] = percentage
+                result['message'] = title
+                print(f"[Queue {request_id}] {percentage}% - {title}")
+                last_preview = percentage
+        elif flag == 'finish':
             print(f"[Queue {request_id}] ✓ Generation complete!")
             result['status'] = 'completed'
-            result['output'] = task.results[0] if task.results else None
+            result['output'] = product[0] if product else None
             return result
     
     print(f"[Queue {request_id}] ✗ Generation timed out")
@@ -35,11 +35,13 @@ class LocalWorker:
         import modules.flags as flags
         import modules.async_worker as worker
         from modules.async_worker import AsyncTask
+        from modules.generation_request import GenerationRequest
         
         self.config = config
         self.flags = flags
         self.worker = worker
         self.AsyncTask = AsyncTask
+        self.GenerationRequest = GenerationRequest
         
         # Update configs
         self.config.update_files()
@@ -85,119 +87,64 @@ class LocalWorker:
         """Generate image using your exact Fooocus setup"""
         logger.info(f"Generating for request {request_id}: {prompt[:50]}...")
         
-        # Build control parameters (YOUR EXACT SETUP)
-        ctrls = []
-        
-        # Basic parameters
-        ctrls.append(None)  # currentTask
-        ctrls.append(False)  # generate_image_grid
-        ctrls.append(prompt)  # prompt
-        ctrls.append("")  # negative_prompt
-        ctrls.append(["Fooocus V2", "Fooocus Enhance", "Fooocus Sharp"])  # styles
-        ctrls.append("Quality")  # performance
-        ctrls.append("896×1152")  # aspect_ratio (× not *)
-        ctrls.append(1)  # image_number
-        ctrls.append("png")  # output_format
-        ctrls.append(-1)  # random seed
-        ctrls.append(False)  # read_wildcards_in_order
-        ctrls.append(2.0)  # sharpness
-        ctrls.append(4.0)  # guidance_scale
-        
-        # Models
-        ctrls.append("juggernautXL_v8Rundiffusion.safetensors")
-        ctrls.append("realisticStockPhoto_v20.safetensors")
-        ctrls.append(0.6)
-        
-        # YOUR EXACT LoRAs
-        # LoRA 1: remy
-        ctrls.append(True)
-        ctrls.append("remy.safetensors")
-        ctrls.append(0.94)
-        
-        # LoRA 2: RealVisXL
-        ctrls.append(True)
-        ctrls.append("RealVisXL_V5.0_fp32.safetensors")
-        ctrls.append(0.6)
-        
-        # LoRA 3: super-realism
-        ctrls.append(True)
-        ctrls.append("super-realism.safetensors")
-        ctrls.append(0.69)
-        
-        # Empty LoRA slots
-        for _ in range(2):
-            ctrls.append(False)
-            ctrls.append("None")
-            ctrls.append(1.0)
-        
-        # Rest of parameters (matching api_exact.py)
-        ctrls.append(False)  # input_image_checkbox
-        ctrls.append('uov_tab')
-        ctrls.append(self.flags.disabled)
-        ctrls.append(None)
-        
-        ctrls.extend([[], None, "", None])  # Outpaint/Inpaint
-        ctrls.extend([False, False, False, False])  # Display settings
-        ctrls.extend([1.5, 0.8, 0.3, 7.0, 2])  # ADM settings
-        ctrls.extend(["dpmpp_2m_sde_gpu", "karras", self.flags.default_vae])  # Sampler
-        ctrls.extend([-1] * 6)  # Overwrite settings
-        ctrls.extend([False, False])  # Mixing
-        ctrls.extend([False, False, 64, 128])  # ControlNet
-        ctrls.extend(['joint', 0.25])  # Refiner
-        ctrls.extend([False, 1.01, 1.02, 0.99, 0.95])  # FreeU
-        ctrls.extend([False, False, 'v2.6', 1.0, 0.618, False, False, 0])  # Inpaint
-        ctrls.extend([False, False, 'fooocus'])  # Save settings
-        
-        # IP ControlNet (4 sets)
-        for _ in range(4):
-            ctrls.extend([None, 0.6, 0.5, self.flags.default_ip])
-        
-        # DINO/Enhance
-        ctrls.extend([False, 0, False, None, False, self.flags.disabled, 
-                      self.flags.enhancement_uov_before, self.flags.enhancement_uov_prompt_type_original])
-        
-        # Enhance tabs (3 sets)
-        for _ in range(3):
-            ctrls.extend([False, "", "", "", 'u2net', 'full', 'vit_b', 
-                          0.3, 0.25, 10, self.flags.inpaint_option_default, 
-                          False, 'v2.6', 1.0, 0.618, 0, False])
-        
-        # Remove currentTask
-        ctrls.pop(0)
+        # Build the request (YOUR EXACT SETUP)
+        request = self.GenerationRequest(
+            prompt=prompt,
+            negative_prompt="",
+            style_selections=["Fooocus V2", "Fooocus Enhance", "Fooocus Sharp"],
+            performance_selection="Quality",
+            aspect_ratios_selection="896×1152",
+            image_number=1,
+            output_format="png",
+            seed=-1,  # random seed
+            sharpness=2.0,
+            cfg_scale=4.0,
+            base_model_name="juggernautXL_v8Rundiffusion.safetensors",
+            refiner_model_name="realisticStockPhoto_v20.safetensors",
+            refiner_switch=0.6,
+            loras=[
+                (True, "remy.safetensors", 0.94),
+                (True, "RealVisXL_V5.0_fp32.safetensors", 0.6),
+                (True, "super-realism.safetensors", 0.69),
+            ],
+            disable_preview=False,
+            black_out_nsfw=False,
+            adaptive_cfg=7.0,
+            clip_skip=2,
+            sampler_name="dpmpp_2m_sde_gpu",
+            scheduler_name="karras",
+            vae_name=self.flags.default_vae,
+            overwrite_step=-1,
+            overwrite_switch=-1,
+            overwrite_upscale_strength=-1,
+            inpaint_engine='v2.6',
+            save_final_enhanced_image_only=False,
+            save_metadata_to_images=False,
+            metadata_scheme='fooocus',
+            enhance_checkbox=False,
+            enhance_uov_method=self.flags.disabled,
+        )
         
         # Create and queue task
-        task = self.AsyncTask(args=ctrls)
-        self.worker.async_tasks.append(task)
+        task = self.AsyncTask.from_request(request).submit()
         
         # Wait for completion
         timeout = 180
-        start = time.time()
         
-        while time.time() - start < timeout:
-            time.sleep(0.1)
-            
-            while len(task.yields) > 0:
-                flag, product = task.yields.pop(0)
-                if flag == 'preview':
-                    percentage, title, _ = product
-                    logger.info(f"Progress: {percentage}% - {title}")
-                    self.update_status(request_id, 'processing', {
-                        'progress': percentage,
-                        'message': title
-                    })
-                elif flag == 'finish':
-                    logger.info(f"Generation complete: {product}")
-                    # Product is a list, return first image path
-                    if isinstance(product, list) and len(product) > 0:
-                        return product[0]
-                    return product
-            
-            if len(task.results) > 0:
-                logger.info(f"Generation complete: {task.results}")
-                # Results is a list, return first image path
-                if isinstance(task.results, list) and len(task.results) > 0:
-                    return task.results[0]
-                return task.results[0] if task.results else None
+        for flag, product in task.stream_events(timeout=timeout, previews=False):
+            if flag == 'preview':
+                percentage, title, _ = product
+                logger.info(f"Progress: {percentage}% - {title}")
+                self.update_status(request_id, 'processing', {
+                    'progress': percentage,
+                    'message': title
+                })
+            elif flag == 'finish':
+                logger.info(f"Generation complete: {product}")
+                # Product is a list, return first image path
+                if isinstance(product, list) and len(product) > 0:
+                    return product[0]
+                return product
         
         logger.error("Generation timed out")
         return None